@@ -0,0 +1,162 @@
+"""
+// Copyright (c) William Newport
+// SPDX-License-Identifier: BUSL-1.1
+
+A local cache of resolved transformer code releases. Finding the release a VersionPatternReleaseSelector picks lists
+the tags of the repository and fetching it clones that tag, network and git work on every run even when the release
+hasn't changed. Here the tag to commit lookups of each repository are kept for a time to live, and the code tree of
+each release is stored once under its commit hash. A run on an unchanged release within the time to live does no git
+or network work at all, and a new tag is picked up once the lookups expire.
+
+The cache directory is DATASURFACE_ARTIFACT_CACHE_DIR, which should be on the GitCacheConfig volume so every pod
+shares it. Entries are written to a temporary name and renamed so concurrent runs never see half of one.
+
+It is a standalone tool for now: the platform fetches transformer code releases itself and nothing in this repository
+calls it at run time. It measures what caching the releases would save and can prefetch a release into the volume.
+
+    python artifact_cache.py --repo https://github.com/billynewport/yellow_starter.git --pattern 'v(\\d+)\\.(\\d+)\\.(\\d+)-prod'
+    python artifact_cache.py --repo ... --pattern ... --benchmark 20
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+from atomic_file import write_atomically
+
+ARTIFACT_CACHE_DIR_ENV: str = "DATASURFACE_ARTIFACT_CACHE_DIR"
+
+DEFAULT_TAG_TTL_SECONDS: float = 300.0
+
+
+def get_artifact_cache_dir() -> str:
+    return os.environ.get(ARTIFACT_CACHE_DIR_ENV, os.path.join(tempfile.gettempdir(), "datasurface_artifact_cache"))
+
+
+class ArtifactCache:
+    """Tag lookups with a time to live and code trees by commit for the repositories of transformer code."""
+
+    def __init__(self, cache_dir: Optional[str] = None, tag_ttl_seconds: float = DEFAULT_TAG_TTL_SECONDS) -> None:
+        self.cache_dir: str = cache_dir or get_artifact_cache_dir()
+        self.tag_ttl_seconds: float = tag_ttl_seconds
+        self.git_calls: int = 0
+        """The git commands run, each of which may go to the network"""
+
+    def git(self, *args: str) -> str:
+        self.git_calls += 1
+        return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout
+
+    def get_tags_file(self, repo_url: str) -> str:
+        return os.path.join(self.cache_dir, "tags", f"{hashlib.sha256(repo_url.encode()).hexdigest()[:32]}.json")
+
+    def get_tags(self, repo_url: str) -> dict[str, str]:
+        """The commit of each tag of the repository, listed again once the last listing is older than the time to live."""
+        tags_file = self.get_tags_file(repo_url)
+        try:
+            with open(tags_file) as f:
+                cached = json.load(f)
+            if time.time() - cached["listed_at"] < self.tag_ttl_seconds:
+                return cached["commits"]
+        except (OSError, ValueError, KeyError):
+            pass
+        # An annotated tag is listed with the hash of the tag object and again, peeled, with the commit it points to
+        tags: dict[str, str] = {}
+        peeled: dict[str, str] = {}
+        for line in self.git("ls-remote", "--tags", repo_url).splitlines():
+            sha, _, ref = line.partition("\t")
+            tag = ref.removeprefix("refs/tags/")
+            if tag.endswith("^{}"):
+                peeled[tag.removesuffix("^{}")] = sha
+            else:
+                tags[tag] = sha
+        tags.update(peeled)
+        write_atomically(tags_file, json.dumps({"repo": repo_url, "listed_at": time.time(), "commits": tags}))
+        return tags
+
+    def resolve_release(self, repo_url: str, tag_pattern: str) -> tuple[str, str]:
+        """The highest version tag matching tag_pattern, whose groups are the numeric parts of the version, and its commit."""
+        regex = re.compile(tag_pattern)
+        versions: list[tuple[tuple[int, ...], str, str]] = []
+        for tag, commit in self.get_tags(repo_url).items():
+            m = regex.fullmatch(tag)
+            if m is not None:
+                versions.append((tuple(int(g) for g in m.groups()), tag, commit))
+        if not versions:
+            raise ValueError(f"No tag of {repo_url} matches '{tag_pattern}'")
+        _, tag, commit = max(versions)
+        return tag, commit
+
+    def get_code_tree(self, repo_url: str, tag: str, commit: str) -> str:
+        """The directory holding the code of the commit, cloned the first time it is asked for."""
+        tree_dir = os.path.join(self.cache_dir, "trees", commit)
+        if os.path.isdir(tree_dir):
+            return tree_dir
+        os.makedirs(os.path.dirname(tree_dir), exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=f"{commit}.", dir=os.path.dirname(tree_dir))
+        try:
+            self.git("clone", "--quiet", "--depth", "1", "--branch", tag, repo_url, tmp_dir)
+            cloned = self.git("-C", tmp_dir, "rev-parse", "HEAD").strip()
+            if cloned != commit:
+                raise RuntimeError(f"Tag {tag} of {repo_url} is now {cloned}, not {commit}")
+            shutil.rmtree(os.path.join(tmp_dir, ".git"))
+            try:
+                os.rename(tmp_dir, tree_dir)
+            except OSError:
+                if not os.path.isdir(tree_dir):  # Otherwise another run stored the same commit first
+                    raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return tree_dir
+
+    def fetch_release(self, repo_url: str, tag_pattern: str) -> tuple[str, str, str]:
+        """Resolve the release and return its tag, commit and code tree."""
+        tag, commit = self.resolve_release(repo_url, tag_pattern)
+        return tag, commit, self.get_code_tree(repo_url, tag, commit)
+
+
+def benchmark(repo_url: str, tag_pattern: str, runs: int) -> str:
+    """Time fetching the release with an empty cache against fetching it again from the cache."""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = ArtifactCache(cache_dir)
+        start = time.perf_counter()
+        cache.fetch_release(repo_url, tag_pattern)
+        cold_seconds = time.perf_counter() - start
+        cold_calls = cache.git_calls
+        warm: list[float] = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            cache.fetch_release(repo_url, tag_pattern)
+            warm.append(time.perf_counter() - start)
+    warm_seconds = sum(warm) / len(warm) if warm else 0.0
+    return "\n".join([
+        f"cold: {cold_seconds * 1000:.1f}ms with {cold_calls} git commands",
+        f"warm: {warm_seconds * 1000:.3f}ms mean over {runs} runs with {cache.git_calls - cold_calls} git commands",
+        f"saving: {cold_seconds / warm_seconds:.0f}x" if warm_seconds > 0 else "saving: n/a"
+    ])
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Resolve and fetch a transformer code release through the local artifact cache")
+    parser.add_argument("--repo", required=True, help="The git URL of the code repository")
+    parser.add_argument("--pattern", required=True, help="Regular expression matching release tags, its groups are the version numbers")
+    parser.add_argument("--ttl", type=float, default=DEFAULT_TAG_TTL_SECONDS, help="Seconds a listing of the tags is reused for")
+    parser.add_argument("--benchmark", type=int, default=0, help="Compare a cold fetch with this many cached fetches")
+    args = parser.parse_args(argv)
+
+    if args.benchmark > 0:
+        print(benchmark(args.repo, args.pattern, args.benchmark))
+        return 0
+    tag, commit, tree_dir = ArtifactCache(tag_ttl_seconds=args.ttl).fetch_release(args.repo, args.pattern)
+    print(json.dumps({"tag": tag, "commit": commit, "path": tree_dir}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
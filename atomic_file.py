@@ -0,0 +1,36 @@
+"""
+// Copyright (c) William Newport
+// SPDX-License-Identifier: BUSL-1.1
+
+Atomic replacement of the cache, state and metrics files written by the tools in this repository. The content is
+written to a temporary file in the same directory which is then renamed over the file, so a reader, another process
+or a metrics collector, sees the old file or the new one and never half of one.
+"""
+
+import os
+import uuid
+from contextlib import contextmanager
+from typing import IO, Any, Iterator
+
+
+@contextmanager
+def atomic_open(file_name: str, binary: bool = False) -> Iterator[IO[Any]]:
+    """Open a new temporary file which replaces file_name when the block exits. If the block raises the temporary
+    file is removed and file_name is left as it was. The directory is created if it doesn't exist."""
+    os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+    # Unique per writer so concurrent writers, even threads of one process, never share a temporary file
+    tmp_file = f"{file_name}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_file, "xb" if binary else "x") as f:
+            yield f
+        os.replace(tmp_file, file_name)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def write_atomically(file_name: str, content: str) -> None:
+    """Replace file_name with the content."""
+    with atomic_open(file_name) as f:
+        f.write(content)
@@ -0,0 +1,318 @@
+"""
+// Copyright (c) William Newport
+// SPDX-License-Identifier: BUSL-1.1
+
+Scaling benchmark for building, linting and graphing the model. The starter model from eco.py is extended with
+synthetic teams following the team1.py pattern, each with M datastores of K datasets and W consumer workspaces, and
+the time and peak memory of each phase is measured at each size in a fresh process. The time to import the model
+modules and to load the starter model with loadEcosystemFromEcoModule are measured too.
+
+Sizes are TEAMSxSTORESxDATASETSxWORKSPACES. The growth exponent of each phase is reported for each of the four axes,
+from sizes which differ in that axis alone, so a phase which only grows badly with, say, the workspaces per team isn't
+hidden by the others. The default sizes grow each axis from the first size. A phase should grow at most linearly with
+each axis, one whose exponent is above --max-exponent is reported as super linear. Results can be saved as a baseline
+and later runs compared against it, exiting non zero on a regression so CI can catch it. A baseline is only
+comparable on the machine it was recorded on, so record it on the CI runner before adding this to CI.
+
+The DSG of every synthetic workspace must be mapped to a data platform, so each size is measured in a copy of the
+model whose Test_DP_dsg_platform_mapping.json also maps the LiveDSG of that size's synthetic workspaces to YellowLive.
+
+    python bench_model.py --sizes 10x2x5x2,100x2x5x2,10x2x50x2 --save-baseline bench_model_baseline.json
+    python bench_model.py --baseline bench_model_baseline.json
+"""
+
+import argparse
+import json
+import glob
+import math
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, astuple, dataclass, fields
+from typing import Any, Optional
+from datasurface.md import (
+    Team, GovernanceZone, Ecosystem, LocationKey, PlainTextDocumentation, WorkspacePlatformConfig, Datastore, Dataset,
+    CronTrigger, IngestionConsistencyType, ConsumerRetentionRequirements, DataMilestoningStrategy, DataLatency, Workspace,
+    DatasetSink, DatasetGroup, PostgresDatabase, TeamDeclaration, EnvironmentMap, EnvRefDataContainer, ProductionStatus,
+    DataPlatformManagedDataContainer
+)
+from datasurface.md.containers import SQLSnapshotIngestion, HostPortPair
+from datasurface.md.credential import Credential, CredentialType
+from datasurface.md.model_loader import loadEcosystemFromEcoModule
+from datasurface.md.policy import SimpleDC, SimpleDCTypes
+from datasurface.md.repo import GitHubRepository
+from eco import buildEcosystem
+from rte_prod import PSP_NAME
+from team1 import GH_REPO_NAME, GH_REPO_OWNER, createCustomersSchema
+from incremental_validation import DSG_PLATFORM_MAPPING_SUFFIX
+from transformer_metrics import peak_rss_mb
+
+DEFAULT_SIZES: str = "5x2x5x2,20x2x5x2,5x8x5x2,5x2x20x2,5x2x5x8"
+
+# Phases faster than this at the smaller size are too noisy to judge their growth
+MIN_SCALING_SECONDS: float = 0.05
+
+
+@dataclass
+class ModelSize:
+    teams: int
+    datastores: int
+    """Datastores per team"""
+    datasets: int
+    """Datasets per datastore"""
+    workspaces: int
+    """Workspaces per team, each with a dataset group sinking every dataset of the team"""
+
+    @staticmethod
+    def parse(text: str) -> 'ModelSize':
+        parts = [int(p) for p in text.lower().split("x")]
+        if len(parts) != 4:
+            raise ValueError(f"Model size '{text}' is not TEAMSxSTORESxDATASETSxWORKSPACES")
+        return ModelSize(*parts)
+
+    def __str__(self) -> str:
+        return f"{self.teams}x{self.datastores}x{self.datasets}x{self.workspaces}"
+
+    @property
+    def total_datasets(self) -> int:
+        return self.teams * self.datastores * self.datasets
+
+
+@dataclass
+class ModelResult:
+    """The measurements of one model size."""
+    size: str
+    total_datasets: int
+    phase_seconds: dict[str, float]
+    peak_rss_mb: float
+
+
+def create_synthetic_team(ecosys: Ecosystem, index: int, size: ModelSize) -> Team:
+    """Add a team like team1 to the USA governance zone with size.datastores datastores of size.datasets customer
+    datasets and size.workspaces workspaces consuming them all."""
+    gz: GovernanceZone = ecosys.getZoneOrThrow("USA")
+    name = f"synth{index}"
+    gz.add(TeamDeclaration(name, GitHubRepository(f"{GH_REPO_OWNER}/{GH_REPO_NAME}", name, credential=ecosys.owningRepo.credential)))
+    team: Team = gz.getTeamOrThrow(name)
+    for keyword, host, status in (("prod", "postgres", ProductionStatus.PRODUCTION), ("uat", "postgres-uat", ProductionStatus.NOT_PRODUCTION)):
+        team.add(EnvironmentMap(
+            keyword=keyword,
+            dataContainers={
+                frozenset(["customer_db"]): PostgresDatabase(
+                    "CustomerDB",
+                    hostPort=HostPortPair(host, 5432),
+                    locations={LocationKey("MyCorp:USA/NY_1")},
+                    productionStatus=status,
+                    databaseName="customer_db"
+                )
+            },
+            dtReleaseSelectors={}
+        ))
+    sinks: list[DatasetSink] = []
+    for s in range(size.datastores):
+        storeName = f"{name}_store{s}"
+        team.add(Datastore(
+            storeName,
+            documentation=PlainTextDocumentation("Synthetic datastore"),
+            capture_metadata=SQLSnapshotIngestion(
+                EnvRefDataContainer("customer_db"),
+                CronTrigger("Every 5 minutes", "*/5 * * * *"),
+                IngestionConsistencyType.MULTI_DATASET,
+                Credential("postgres", CredentialType.USER_PASSWORD),
+            ),
+            datasets=[
+                Dataset(f"dataset{d}", schema=createCustomersSchema(), classifications=[SimpleDC(SimpleDCTypes.PUB, "Customer")])
+                for d in range(size.datasets)
+            ]
+        ))
+        sinks.extend(DatasetSink(storeName, f"dataset{d}") for d in range(size.datasets))
+    for w in range(size.workspaces):
+        team.add(Workspace(
+            f"{name}_consumer{w}",
+            DataPlatformManagedDataContainer(f"{name}_consumer{w} container"),
+            DatasetGroup(
+                "LiveDSG",
+                sinks=list(sinks),
+                platform_chooser=WorkspacePlatformConfig(
+                    hist=ConsumerRetentionRequirements(r=DataMilestoningStrategy.LIVE_ONLY, latency=DataLatency.MINUTES, regulator=None)
+                )
+            )
+        ))
+    return team
+
+
+def get_synthetic_mappings(size: ModelSize) -> list[dict[str, Any]]:
+    """The DSG platform mappings of the synthetic workspaces of a size, each assigning its LiveDSG to YellowLive."""
+    return [
+        {
+            "dsgName": "LiveDSG",
+            "workspace": f"synth{t}_consumer{w}",
+            "assignments": [
+                {
+                    "dataPlatform": "YellowLive",
+                    "documentation": "Live Yellow DataPlatform",
+                    "productionStatus": "PRODUCTION",
+                    "deprecationsAllowed": "NEVER",
+                    "status": "PROVISIONED"
+                }
+            ]
+        }
+        for t in range(size.teams) for w in range(size.workspaces)
+    ]
+
+
+def copy_model(directory: str, size: Optional[ModelSize] = None) -> None:
+    """Copy the model and this script to a directory, adding the mappings of the synthetic workspaces of the size."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    for file in glob.glob(os.path.join(here, "*.py")) + glob.glob(os.path.join(here, "*.json")):
+        shutil.copy(file, directory)
+    if size is not None:
+        mapping_file = os.path.join(directory, f"{PSP_NAME}{DSG_PLATFORM_MAPPING_SUFFIX}")
+        with open(mapping_file) as f:
+            mappings: list[dict[str, Any]] = json.load(f)
+        with open(mapping_file, "w") as f:
+            json.dump(mappings + get_synthetic_mappings(size), f, indent=2)
+
+
+def measure_synthetic_model(size: ModelSize) -> ModelResult:
+    """Build, lint and graph the starter model extended to the size. Runs in its own process so the peak memory is its own."""
+    phases: dict[str, float] = {}
+    start = time.perf_counter()
+    ecosys: Ecosystem = buildEcosystem("prod")
+    for i in range(size.teams):
+        create_synthetic_team(ecosys, i, size)
+    phases["build"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tree = ecosys.lintAndHydrateCaches()
+    phases["lint"] = time.perf_counter() - start
+    if tree.hasErrors():
+        tree.printTree()
+        raise RuntimeError(f"The synthetic model {size} failed validation")
+
+    start = time.perf_counter()
+    ecosys.getGraph()
+    phases["graph"] = time.perf_counter() - start
+    return ModelResult(str(size), size.total_datasets, {k: round(v, 6) for k, v in phases.items()}, round(peak_rss_mb(), 1))
+
+
+def measure_starter_model() -> ModelResult:
+    """Load the starter model the way the platform does."""
+    start = time.perf_counter()
+    ecosys, tree = loadEcosystemFromEcoModule(".")
+    if ecosys is None or tree is None or tree.hasErrors():
+        raise RuntimeError("The starter model failed to load")
+    return ModelResult("starter", 0, {"load": round(time.perf_counter() - start, 6)}, round(peak_rss_mb(), 1))
+
+
+def measure_import_seconds() -> dict[str, float]:
+    """The cumulative import time of datasurface and of the model modules, from python -X importtime in a fresh process."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import eco"], capture_output=True, text=True, check=True)
+    seconds: dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        m = re.match(r"import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)$", line)
+        if m and m.group(3) in ("datasurface", "eco"):
+            seconds[f"import_{m.group(3)}"] = round(int(m.group(1)) / 1e6, 6)
+    return seconds
+
+
+def run_worker(target: str) -> ModelResult:
+    """Measure a model in a new process, in a copy of the model with the mappings of its synthetic workspaces."""
+    with tempfile.TemporaryDirectory() as directory:
+        copy_model(directory, None if target == "starter" else ModelSize.parse(target))
+        output = subprocess.run(
+            [sys.executable, os.path.join(directory, os.path.basename(__file__)), "--worker", target],
+            stdout=subprocess.PIPE, text=True, check=True, cwd=directory).stdout
+    return ModelResult(**json.loads(output.strip().splitlines()[-1]))
+
+
+def get_scaling_exponents(results: list[ModelResult]) -> dict[tuple[str, str, str], float]:
+    """The growth exponent of each phase along each size axis, keyed by (larger size, axis, phase). It is measured
+    between each size and the next smaller one along the axis with the same other three axes. 1.0 is linear."""
+    exponents: dict[tuple[str, str, str], float] = {}
+    synthetic = [(astuple(ModelSize.parse(r.size)), r) for r in results if r.total_datasets > 0]
+    for axis, field in enumerate(fields(ModelSize)):
+        # Sizes which only differ in this axis, by their other axes
+        lines: dict[tuple[int, ...], list[tuple[int, ModelResult]]] = {}
+        for size, r in synthetic:
+            lines.setdefault(size[:axis] + size[axis + 1:], []).append((size[axis], r))
+        for line in lines.values():
+            line.sort(key=lambda p: p[0])
+            for (small_n, smaller), (large_n, larger) in zip(line, line[1:]):
+                if large_n == small_n:
+                    continue
+                for phase, seconds in larger.phase_seconds.items():
+                    before = smaller.phase_seconds.get(phase, 0.0)
+                    if before >= MIN_SCALING_SECONDS and seconds > 0:
+                        exponents[(larger.size, field.name, phase)] = math.log(seconds / before) / math.log(large_n / small_n)
+    return exponents
+
+
+def compare_to_baseline(results: list[ModelResult], baseline: dict[str, Any], max_regression: float) -> list[str]:
+    """Describe every phase of a size in the baseline which got slower by more than max_regression."""
+    regressions: list[str] = []
+    baseline_phases: dict[str, dict[str, float]] = {r["size"]: r["phase_seconds"] for r in baseline["results"]}
+    for r in results:
+        if r.size not in baseline_phases:
+            print(f"No baseline for {r.size}, record one with --save-baseline")
+            continue
+        for phase, seconds in r.phase_seconds.items():
+            before = baseline_phases.get(r.size, {}).get(phase)
+            if before is not None and before >= MIN_SCALING_SECONDS and seconds > before * (1 + max_regression):
+                regressions.append(f"{r.size} {phase}: {seconds:.3f}s against a baseline of {before:.3f}s ({seconds / before - 1:+.0%})")
+    return regressions
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark how building, linting and graphing the model scale with its size")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma separated TEAMSxSTORESxDATASETSxWORKSPACES model sizes")
+    parser.add_argument("--max-exponent", type=float, default=1.5, help="Growth exponent above which a phase is super linear")
+    parser.add_argument("--output", default=None, help="Also write the report to this file")
+    parser.add_argument("--save-baseline", default=None, help="Write the results as a JSON baseline to this file")
+    parser.add_argument("--baseline", default=None, help="Compare the results to this JSON baseline")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="Allowed time increase over the baseline, 0.25 is 25%%")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker is not None:
+        result = measure_starter_model() if args.worker == "starter" else measure_synthetic_model(ModelSize.parse(args.worker))
+        print(json.dumps(asdict(result)))
+        return 0
+
+    sizes = [ModelSize.parse(s) for s in args.sizes.split(",")]
+    results: list[ModelResult] = [ModelResult("import", 0, measure_import_seconds(), 0.0), run_worker("starter")]
+    for size in sizes:
+        print(f"Measuring {size}, {size.total_datasets} datasets")
+        results.append(run_worker(str(size)))
+
+    exponents = get_scaling_exponents(results)
+    lines = [f"{'size':<20}{'datasets':>10}{'peak MB':>9}  phases"]
+    for r in results:
+        phases = " ".join(
+            f"{k}={v:.3f}" + "".join(f" ({axis}^{e:.2f})" for (size, axis, phase), e in exponents.items() if size == r.size and phase == k)
+            for k, v in r.phase_seconds.items())
+        lines.append(f"{r.size:<20}{r.total_datasets:>10}{r.peak_rss_mb:>9.1f}  {phases}")
+    report = "\n".join(lines) + "\n"
+    print(report, end="")
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"results": [asdict(r) for r in results]}, f, indent=2)
+
+    problems = [f"{size} {phase}: grows as {axis}^{e:.2f}" for (size, axis, phase), e in exponents.items() if e > args.max_exponent]
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems += compare_to_baseline(results, json.load(f), args.max_regression)
+    for p in problems:
+        print(f"REGRESSION {p}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
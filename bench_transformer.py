@@ -0,0 +1,299 @@
+"""
+// Copyright (c) William Newport
+// SPDX-License-Identifier: BUSL-1.1
+
+Benchmark for the MaskedCustomerGenerator transformer. Synthetic customers and addresses matching the Store1 schemas
+in team1.py are generated into a local database and the transformer is run once for each mode, reporting the run and
+phase times, rows per second and peak RSS. Each mode runs in a process of its own so its peak RSS is its own. Every run
+truncates the outputs first, as the platform does. The results can be saved as a baseline and later runs compared
+against it, exiting non zero when a mode has slowed by more than the allowed regression, so CI can catch it. As the
+baseline is seldom recorded on the machine comparing against it, each mode's time is compared as a ratio of the full
+mode's time in the same run rather than in seconds. Modes faster than MIN_COMPARE_SECONDS in the baseline are too noisy
+to compare and are left out.
+
+The default database is a temporary SQLite file. Any SQLAlchemy URL can be given with --db to benchmark a real
+database. Row hashing, hash partitioning and masking functions aren't available on SQLite so those modes are skipped
+there. The mask_functions mode against the full mode compares masking with database functions to inline CASE SQL.
+
+    python bench_transformer.py --rows 50000 --baseline bench_baseline.json --max-regression 0.5 --output bench_output.txt
+    python bench_transformer.py --rows 50000 --save-baseline bench_baseline.json
+    python bench_transformer.py --rows 1000000 --baseline bench_baseline.json --max-regression 0.25
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from dataclasses import asdict, dataclass
+from typing import Any, Optional
+from unittest.mock import patch
+from sqlalchemy import BigInteger, Column, Engine, Table, text
+from datasurface.md import DDLTable
+from team1 import createAddressesSchema, createCustomersSchema
+from transformer import executeTransformer
+from transformer_dialects import BATCH_ID_COLUMN
+from transformer_local import LocalTransformerContext, create_local_engine, create_table_for_schema
+from transformer_masking import DERIVED_DATASETS, get_masked_copy_table_name
+from transformer_metrics import current_run, peak_rss_mb
+from transformer_state import clearState, ensureStateTable
+
+SOURCE_CUSTOMERS_TABLE: str = "bench_customers"
+SOURCE_ADDRESSES_TABLE: str = "bench_addresses"
+
+# Rows inserted per statement when generating data
+INSERT_BATCH_ROWS: int = 10000
+
+# The percentage of customers changed before the timed run of the modes which mask changes
+CHANGED_PERCENT: float = 1.0
+
+# Baseline run times below this are mostly noise and aren't compared
+MIN_COMPARE_SECONDS: float = 0.05
+
+
+@dataclass
+class BenchMode:
+    """A benchmarked transformer configuration."""
+    name: str
+    hints: dict[str, str]
+    """The hint options for the run"""
+    changes_only: bool = False
+    """If true the output is filled by an untimed run and the timed run masks CHANGED_PERCENT changed customers"""
+    needs_hashing: bool = False
+    """If true the mode needs database hash functions"""
+    needs_functions: bool = False
+    """If true the mode needs user defined SQL functions"""
+
+
+BENCH_MODES: list[BenchMode] = [
+    BenchMode("full", {}),
+    BenchMode("mask_functions", {"DT_MASK_FUNCTIONS": "true"}, needs_functions=True),
+    BenchMode("chunked", {"DT_CHUNK_SIZE": "100000"}),
+    BenchMode("parallel_range", {"DT_PARALLELISM": "4", "DT_PARTITIONING": "range"}),
+    BenchMode("parallel_hash", {"DT_PARALLELISM": "4", "DT_PARTITIONING": "hash"}, needs_hashing=True),
+    BenchMode("stream", {"DT_ENGINE": "stream"}),
+    BenchMode("swap", {"DT_OUTPUT": "swap"}),
+    BenchMode("upsert", {"DT_OUTPUT": "upsert"}, changes_only=True),
+    BenchMode("incremental", {"DT_MODE": "incremental"}, changes_only=True),
+    BenchMode("rowhash", {"DT_MODE": "rowhash"}, changes_only=True, needs_hashing=True)
+]
+
+
+@dataclass
+class BenchResult:
+    """The measurements of one benchmarked mode."""
+    mode: str
+    rows: int
+    rows_written: int
+    run_seconds: float
+    rows_per_second: float
+    phase_seconds: dict[str, float]
+    peak_rss_mb: float
+
+
+def synthetic_value(column_name: str, max_size: Optional[int], i: int) -> Any:
+    """A deterministic value for row i of a column, shaped like the real data so the masks do their usual work."""
+    if column_name == "dob":
+        return datetime.date(1950, 1, 1) + datetime.timedelta(days=i % 20000)
+    if column_name == "email":
+        value = f"user{i}@example{i % 100}.com"
+    elif column_name == "phone":
+        value = f"555-{i % 1000:03d}-{i % 10000:04d}"
+    elif column_name.endswith("id"):
+        # Every id of row i is the same so customer i has address i as its primary address, and it as its customer
+        value = f"i{i:012d}"
+    else:
+        value = f"{column_name}{i}"
+    return value if max_size is None else value[:max_size]
+
+
+def generate_rows(engine: Engine, table: Table, schema: DDLTable, rows: int) -> None:
+    """Insert rows synthetic rows for the schema into the table, all in batch 1."""
+    columns = [(c.name, getattr(c.type, "maxSize", None)) for c in schema.columns.values()]
+    with_batch = BATCH_ID_COLUMN in table.columns
+    with engine.begin() as conn:
+        for start in range(0, rows, INSERT_BATCH_ROWS):
+            batch: list[dict[str, Any]] = []
+            for i in range(start, min(start + INSERT_BATCH_ROWS, rows)):
+                row = {name: synthetic_value(name, max_size, i) for name, max_size in columns}
+                if with_batch:
+                    row[BATCH_ID_COLUMN] = 1
+                batch.append(row)
+            conn.execute(table.insert(), batch)
+
+
+def change_customers(engine: Engine, rows: int, batch_id: int) -> None:
+    """Change the email of CHANGED_PERCENT of the customers, spread evenly over the ids, as a new batch."""
+    step = max(1, int(100 / CHANGED_PERCENT))
+    ids = [synthetic_value("id", 20, i) for i in range(0, rows, step)]
+    with engine.begin() as conn:
+        conn.execute(
+            text(f"UPDATE {SOURCE_CUSTOMERS_TABLE} SET email = :email, {BATCH_ID_COLUMN} = :batchId WHERE id = :id"),
+            [{"email": f"changed{batch_id}@example.com", "batchId": batch_id, "id": i} for i in ids])
+
+
+def run_transformer(engine: Engine, context: LocalTransformerContext, hints: dict[str, str]) -> None:
+    """Run the transformer once with the hint options as the platform does, truncating the outputs in the transaction
+    it runs in and then committing it."""
+    with patch.dict(os.environ, hints), redirect_stdout(io.StringIO()), engine.connect() as conn:
+        for table in context.output_tables.values():
+            conn.execute(text(f"DELETE FROM {table}"))
+        executeTransformer(conn, context)
+        conn.commit()
+
+
+def run_mode(engine: Engine, mode: BenchMode, rows: int, batch_id: int) -> BenchResult:
+    """Benchmark one mode into its own output tables."""
+    output_table = f"bench_masked_{mode.name}"
+    create_table_for_schema(engine, output_table, createCustomersSchema())
+    output_tables: dict[str, str] = {"customers": output_table}
+    for d in DERIVED_DATASETS:
+        output_tables[d.name] = f"{output_table}_{d.name}"
+        create_table_for_schema(engine, output_tables[d.name], d.create_schema())
+    with engine.begin() as conn:
+        ensureStateTable(conn)
+        for table in output_tables.values():
+            clearState(conn, table)
+            clearState(conn, get_masked_copy_table_name(table))
+    context = LocalTransformerContext(
+        {("Original", "Store1", "customers"): SOURCE_CUSTOMERS_TABLE, ("Original", "Store1", "addresses"): SOURCE_ADDRESSES_TABLE}, output_tables)
+    if mode.changes_only:
+        run_transformer(engine, context, mode.hints)
+        change_customers(engine, rows, batch_id)
+    run_transformer(engine, context, mode.hints)
+
+    metrics = current_run()
+    assert metrics is not None
+    run_seconds = metrics.run_seconds
+    return BenchResult(
+        mode.name, rows, metrics.rows_written, round(run_seconds, 6),
+        round(rows / run_seconds, 1) if run_seconds > 0 else 0.0,
+        {k: round(v, 6) for k, v in metrics.phase_seconds.items()}, round(peak_rss_mb(), 1))
+
+
+def run_worker(db_url: str, mode: BenchMode, rows: int, batch_id: int) -> BenchResult:
+    """Benchmark one mode in a new process."""
+    target = json.dumps({"db": db_url, "mode": mode.name, "rows": rows, "batch_id": batch_id})
+    output = subprocess.run([sys.executable, __file__, "--worker", target], stdout=subprocess.PIPE, text=True, check=True).stdout
+    return BenchResult(**json.loads(output.strip().splitlines()[-1]))
+
+
+def compare_to_baseline(results: list[BenchResult], baseline: dict[str, Any], max_regression: float) -> list[str]:
+    """Return a description of every mode whose run time, as a ratio of the full mode's run time in the same run,
+    regressed by more than max_regression against the same ratio in the baseline. Comparing ratios leaves out how fast
+    the machine is. Baselines for a different row count aren't comparable and are ignored, as are modes under
+    MIN_COMPARE_SECONDS."""
+    regressions: list[str] = []
+    if baseline.get("rows") != (results[0].rows if results else None):
+        print(f"Baseline is for {baseline.get('rows')} rows, not comparing")
+        return regressions
+    baseline_seconds: dict[str, float] = {r["mode"]: r["run_seconds"] for r in baseline["results"]}
+    full_seconds = next((r.run_seconds for r in results if r.mode == "full"), 0.0)
+    baseline_full_seconds = baseline_seconds.get("full", 0.0)
+    if full_seconds <= 0 or baseline_full_seconds < MIN_COMPARE_SECONDS:
+        print("The full mode wasn't run or is too fast to compare against, not comparing")
+        return regressions
+    for r in results:
+        before = baseline_seconds.get(r.mode)
+        if r.mode == "full" or before is None or before < MIN_COMPARE_SECONDS:
+            continue
+        ratio, baseline_ratio = r.run_seconds / full_seconds, before / baseline_full_seconds
+        if ratio > baseline_ratio * (1 + max_regression):
+            regressions.append(f"{r.mode}: {ratio:.2f}x full against a baseline of {baseline_ratio:.2f}x full ({ratio / baseline_ratio - 1:+.0%})")
+    return regressions
+
+
+def format_report(results: list[BenchResult], db_url: str) -> str:
+    """A table of the results with each mode's time relative to the full rebuild."""
+    full_seconds = next((r.run_seconds for r in results if r.mode == "full"), 0.0)
+    lines = [
+        f"Transformer benchmark: {results[0].rows if results else 0} customers on {db_url}",
+        f"{'mode':<16}{'written':>10}{'seconds':>11}{'rows/s':>12}{'vs full':>9}{'peak MB':>9}  phases"
+    ]
+    for r in results:
+        relative = f"{r.run_seconds / full_seconds:.2f}x" if full_seconds > 0 else "-"
+        phases = " ".join(f"{k}={v:.3f}" for k, v in r.phase_seconds.items())
+        lines.append(f"{r.mode:<16}{r.rows_written:>10}{r.run_seconds:>11.3f}{r.rows_per_second:>12.0f}{relative:>9}{r.peak_rss_mb:>9.1f}  {phases}")
+    return "\n".join(lines) + "\n"
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the masking transformer against synthetic data")
+    parser.add_argument("--rows", type=int, default=10000, help="Number of customers (and addresses) to generate")
+    parser.add_argument("--db", default=None, help="SQLAlchemy URL of the database to use, a temporary SQLite file by default")
+    parser.add_argument("--modes", default=None, help=f"Comma separated modes to run from {', '.join(m.name for m in BENCH_MODES)}")
+    parser.add_argument("--output", default=None, help="Also write the report to this file")
+    parser.add_argument("--save-baseline", default=None, help="Write the results as a JSON baseline to this file")
+    parser.add_argument("--baseline", default=None, help="Compare the results to this JSON baseline")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="Allowed increase in a mode's run time relative to full over the baseline, 0.25 is 25%%")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker is not None:
+        target = json.loads(args.worker)
+        engine = create_local_engine(target["db"])
+        result = run_mode(engine, next(m for m in BENCH_MODES if m.name == target["mode"]), target["rows"], target["batch_id"])
+        engine.dispose()
+        print(json.dumps(asdict(result)))
+        return 0
+
+    modes = BENCH_MODES
+    if args.modes:
+        names = args.modes.split(",")
+        unknown = set(names) - {m.name for m in BENCH_MODES}
+        if unknown:
+            parser.error(f"Unknown modes {sorted(unknown)}")
+        modes = [m for m in BENCH_MODES if m.name in names]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_url: str = args.db or f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+        engine = create_local_engine(db_url)
+        is_sqlite = engine.dialect.name == "sqlite"
+
+        start = time.perf_counter()
+        customers = create_table_for_schema(engine, SOURCE_CUSTOMERS_TABLE, createCustomersSchema(), [Column(BATCH_ID_COLUMN, BigInteger)])
+        generate_rows(engine, customers, createCustomersSchema(), args.rows)
+        addresses = create_table_for_schema(engine, SOURCE_ADDRESSES_TABLE, createAddressesSchema(), [Column(BATCH_ID_COLUMN, BigInteger)])
+        generate_rows(engine, addresses, createAddressesSchema(), args.rows)
+        engine.dispose()
+        print(f"Generated {args.rows} customers and addresses in {time.perf_counter() - start:.1f}s")
+
+        results: list[BenchResult] = []
+        batch_id = 1
+        for mode in modes:
+            if mode.needs_hashing and is_sqlite:
+                print(f"Skipping {mode.name}, it needs hash functions SQLite doesn't have")
+                continue
+            if mode.needs_functions and is_sqlite:
+                print(f"Skipping {mode.name}, SQLite can't create SQL functions")
+                continue
+            if mode.changes_only:
+                batch_id += 1
+            results.append(run_worker(db_url, mode, args.rows, batch_id))
+            print(f"{mode.name}: {results[-1].run_seconds:.3f}s")
+
+    report = format_report(results, db_url)
+    print(report, end="")
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"rows": args.rows, "results": [asdict(r) for r in results]}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.max_regression)
+        for r in regressions:
+            print(f"REGRESSION {r}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
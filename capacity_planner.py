@@ -0,0 +1,205 @@
+"""
+// Copyright (c) William Newport
+// SPDX-License-Identifier: BUSL-1.1
+
+Project the load the model puts on each data container, host and credential. Every scheduled job of a runtime
+environment moves datasets between containers: ingestion reads the source snapshot and writes it to the merge
+database, the data transformers read their inputs from and write their outputs to the merge database, and the consumer
+replica groups copy the datasets their workspaces use from the merge database to each replica. The rows a run moves come
+from supplied dataset row counts, the row width from the dataset schema and the runs per second from the job's trigger.
+
+Hosts whose projected bytes per second are above --max-utilization of their throughput are flagged as over subscribed.
+The throughput of a host is an estimate given with --host-throughput, DEFAULT_HOST_BYTES_PER_SECOND otherwise.
+
+    python capacity_planner.py --rte prod --rows Store1.customers=2000000 --rows Store1.addresses=2500000
+"""
+
+import argparse
+import sys
+from dataclasses import dataclass
+from typing import Iterable, Optional
+from datasurface.md import ConsumerReplicaGroup, CronTrigger, DataContainer, Datastore, Ecosystem
+from datasurface.platforms.yellow import YellowPlatformServiceProvider
+from eco import createEcosystem
+from transformer_metrics import estimate_row_bytes
+from trigger_analysis import SECONDS_PER_DAY, as_list, get_placed_containers, get_start_seconds
+
+DEFAULT_DATASET_ROWS: int = 100000
+
+# A conservative sustained throughput for a database host, override per host with --host-throughput
+DEFAULT_HOST_BYTES_PER_SECOND: float = 50e6
+
+
+@dataclass(frozen=True)
+class DataFlow:
+    """The rows one job moves for one dataset to or from one container, projected per second from its trigger."""
+    job: str
+    container: str
+    host: str
+    credential: str
+    direction: str
+    """read or write"""
+    dataset: str
+    rows_per_second: float
+    bytes_per_second: float
+
+
+@dataclass
+class LoadTotals:
+    rows_per_second: float = 0.0
+    bytes_per_second: float = 0.0
+
+    def add(self, flow: DataFlow) -> None:
+        self.rows_per_second += flow.rows_per_second
+        self.bytes_per_second += flow.bytes_per_second
+
+
+def get_runs_per_second(trigger: CronTrigger) -> float:
+    return len(get_start_seconds(trigger.cron)) / SECONDS_PER_DAY
+
+
+def get_container_host(container: DataContainer) -> str:
+    """The host of the container, or the container's name for containers referenced by environment."""
+    hostPort = getattr(container, "hostPortPair", None)
+    return hostPort.hostName if hostPort is not None else f"({container.name})"
+
+
+class CapacityPlanner:
+    """Collects the data flows of a runtime environment's jobs."""
+
+    def __init__(self, ecosys: Ecosystem, rteName: str, dataset_rows: dict[str, int], default_rows: int = DEFAULT_DATASET_ROWS) -> None:
+        self.ecosys: Ecosystem = ecosys
+        psp = ecosys.getRuntimeEnvironmentOrThrow(rteName).psp
+        assert isinstance(psp, YellowPlatformServiceProvider)
+        self.psp: YellowPlatformServiceProvider = psp
+        self.dataset_rows: dict[str, int] = dataset_rows
+        self.default_rows: int = default_rows
+        self.flows: list[DataFlow] = []
+
+    def add_flows(self, job: str, containers: Iterable[DataContainer], credential: str, direction: str,
+                  datasets: Iterable[tuple[Datastore, str]], runs_per_second: float) -> None:
+        for container in containers:
+            for store, datasetName in datasets:
+                rows = self.dataset_rows.get(f"{store.name}.{datasetName}", self.default_rows) * runs_per_second
+                row_bytes = estimate_row_bytes(store.datasets[datasetName].originalSchema)
+                self.flows.append(DataFlow(
+                    job, container.name, get_container_host(container), credential, direction, f"{store.name}.{datasetName}", rows, rows * row_bytes))
+
+    def get_sink_datasets(self, workspaceName: str) -> list[tuple[Datastore, str]]:
+        """Every dataset the workspace's dataset groups use, once for each group as each is copied on its own."""
+        workspace = self.ecosys.cache_getWorkspaceOrThrow(workspaceName).workspace
+        return [(self.ecosys.cache_getDatastoreOrThrow(sink.storeName).datastore, sink.datasetName)
+                for dsg in workspace.dsgs.values() for sink in dsg.sinks.values()]
+
+    def collect(self) -> list[DataFlow]:
+        merge = self.psp.mergeStore
+        mergeCredential: str = self.psp.mergeRW_Credential.name
+        for entry in self.ecosys.datastoreCache.values():
+            store: Datastore = entry.datastore
+            cmd = store.cmd
+            if cmd is None or not isinstance(cmd.stepTrigger, CronTrigger):
+                continue
+            job = f"ingestion:{store.name}"
+            runs = get_runs_per_second(cmd.stepTrigger)
+            datasets = [(store, name) for name in store.datasets.keys()]
+            if cmd.dataContainer is not None:
+                self.add_flows(job, [cmd.dataContainer], cmd.credential.name, "read", datasets, runs)
+            self.add_flows(job, [merge], mergeCredential, "write", datasets, runs)
+        placements = get_placed_containers(self.psp)
+        for entry in self.ecosys.workSpaceCache.values():
+            dt = entry.workspace.dataTransformer
+            if dt is None or not isinstance(dt.trigger, CronTrigger):
+                continue
+            job = f"transformer:{dt.name}"
+            runs = get_runs_per_second(dt.trigger)
+            outputs = [(dt.outputDatastore, name) for name in dt.outputDatastore.datasets.keys()]
+            # A transformer placed on a consumer replica group reads its inputs and writes its outputs there
+            containers = placements.get(entry.workspace.name) or [merge]
+            self.add_flows(job, containers, dt.runAsCredential.name, "read", self.get_sink_datasets(entry.workspace.name), runs)
+            self.add_flows(job, containers, dt.runAsCredential.name, "write", outputs, runs)
+        for crg in as_list(self.psp.consumerReplicaGroups):
+            assert isinstance(crg, ConsumerReplicaGroup)
+            if not isinstance(crg.trigger, CronTrigger):
+                continue
+            job = f"crg:{crg.name}"
+            runs = get_runs_per_second(crg.trigger)
+            datasets = [d for workspaceName in sorted(crg.workspaceNames) for d in self.get_sink_datasets(workspaceName)]
+            self.add_flows(job, [merge], mergeCredential, "read", datasets * len(crg.dataContainers), runs)
+            self.add_flows(job, crg.dataContainers, crg.credential.name, "write", datasets, runs)
+        return self.flows
+
+
+def get_host_roles(psp: YellowPlatformServiceProvider, flows: Iterable[DataFlow]) -> dict[str, set[str]]:
+    """What each host is used for: the merge and Airflow databases and the containers of the flows."""
+    roles: dict[str, set[str]] = {get_container_host(psp.mergeStore): {"merge"}}
+    afHostPort = getattr(psp.yp_assembly, "afHostPortPair", None)
+    if afHostPort is not None:
+        roles.setdefault(afHostPort.hostName, set()).add("airflow")
+    for flow in flows:
+        roles.setdefault(flow.host, set()).add(flow.container)
+    return roles
+
+
+def total_by(flows: Iterable[DataFlow], key: str) -> dict[str, LoadTotals]:
+    totals: dict[str, LoadTotals] = {}
+    for flow in flows:
+        totals.setdefault(getattr(flow, key), LoadTotals()).add(flow)
+    return totals
+
+
+def get_oversubscribed_hosts(flows: list[DataFlow], host_throughput: dict[str, float], max_utilization: float) -> dict[str, float]:
+    """The hosts whose projected bytes per second exceed max_utilization of their throughput, with their utilization."""
+    utilization = {host: t.bytes_per_second / host_throughput.get(host, DEFAULT_HOST_BYTES_PER_SECOND) for host, t in total_by(flows, "host").items()}
+    return {host: u for host, u in utilization.items() if u > max_utilization}
+
+
+def format_capacity_report(flows: list[DataFlow], roles: dict[str, set[str]], oversubscribed: dict[str, float]) -> str:
+    lines: list[str] = []
+    for title, key in (("container", "container"), ("credential", "credential"), ("host", "host")):
+        lines.append(f"{title:<24}{'rows/s':>14}{'bytes/s':>16}")
+        for name, t in sorted(total_by(flows, key).items()):
+            extra = ""
+            if key == "host":
+                extra = f"  {', '.join(sorted(roles.get(name, set())))}" + ("  OVER SUBSCRIBED" if name in oversubscribed else "")
+            lines.append(f"{name:<24}{t.rows_per_second:>14,.1f}{t.bytes_per_second:>16,.0f}{extra}")
+        lines.append("")
+    for host, u in sorted(oversubscribed.items()):
+        lines.append(f"Host {host} is over subscribed at {u:.0%} of its throughput")
+    return "\n".join(lines).rstrip("\n")
+
+
+def parse_assignments(values: list[str], option: str) -> dict[str, float]:
+    parsed: dict[str, float] = {}
+    for v in values:
+        name, _, number = v.rpartition("=")
+        try:
+            parsed[name] = float(number)
+        except ValueError:
+            raise ValueError(f"{option} {v} is not NAME=NUMBER")
+    return parsed
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Project rows and bytes per second per container, credential and host")
+    parser.add_argument("--rte", default="prod", help="The runtime environment to plan")
+    parser.add_argument("--rows", action="append", default=[], help="STORE.DATASET=ROWS, the row count of a dataset")
+    parser.add_argument("--default-rows", type=int, default=DEFAULT_DATASET_ROWS, help="The row count of datasets without --rows")
+    parser.add_argument("--host-throughput", action="append", default=[], help="HOST=BYTES_PER_SECOND the host can sustain")
+    parser.add_argument("--max-utilization", type=float, default=0.7, help="Fraction of a host's throughput above which it is over subscribed")
+    args = parser.parse_args(argv)
+
+    try:
+        dataset_rows = {k: int(v) for k, v in parse_assignments(args.rows, "--rows").items()}
+        host_throughput = parse_assignments(args.host_throughput, "--host-throughput")
+    except ValueError as e:
+        parser.error(str(e))
+    ecosys = createEcosystem()
+    planner = CapacityPlanner(ecosys, args.rte, dataset_rows, args.default_rows)
+    flows = planner.collect()
+    oversubscribed = get_oversubscribed_hosts(flows, host_throughput, args.max_utilization)
+    print(format_capacity_report(flows, get_host_roles(planner.psp, flows), oversubscribed))
+    return 1 if oversubscribed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
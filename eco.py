@@ -6,12 +6,13 @@ This is a starter datasurface repository. It defines a simple Ecosystem using Ye
 It will generate 2 pipelines, one with live records only and the other with full milestoning.
 """
 
+from typing import Callable, Optional
 from datasurface.md import InfrastructureVendor, InfrastructureLocation
 from datasurface.md import Ecosystem
 from datasurface.md.credential import Credential, CredentialType
 from datasurface.md.documentation import PlainTextDocumentation
 from datasurface.md.repo import GitHubRepository
-from datasurface.md import CloudVendor, RuntimeDeclaration
+from datasurface.md import CloudVendor, RuntimeDeclaration, RuntimeEnvironment
 from datasurface.md import ValidationTree
 from datasurface.md.model_schema import addDatasurfaceModel
 from gz import createGZ
@@ -22,12 +23,18 @@ GH_REPO_OWNER: str = "billynewport"  # Change to your github username
 GH_REPO_NAME: str = "yellow_starter"  # Change to your github repository name containing this project
 GH_DT_REPO_NAME: str = "yellow_starter"  # For now, we use the same repo for the transformer
 
+# The runtime environments by name, with the branch their owners edit them on and the function which builds them
+RTE_FACTORIES: dict[str, tuple[str, Callable[[Ecosystem], RuntimeEnvironment]]] = {
+    "prod": ("prod_rte_edit", createProdRTE),
+    "uat": ("uat_rte_edit", createUATRTE)
+}
 
-def createEcosystem() -> Ecosystem:
-    """This is a very simple test model with a single datastore and dataset.
-    It is used to test the YellowDataPlatform. We are using a monorepo approach
-    so all the model fragments use the same owning repository.
-    """
+
+def buildEcosystem(rteName: Optional[str] = None) -> Ecosystem:
+    """Build the model without linting it. See createEcosystem."""
+    if rteName is not None and rteName not in RTE_FACTORIES:
+        raise ValueError(f"Unknown runtime environment '{rteName}'")
+    rteNames: list[str] = [rteName] if rteName is not None else list(RTE_FACTORIES.keys())
 
     git: Credential = Credential("git", CredentialType.API_TOKEN)
     eRepo: GitHubRepository = GitHubRepository(f"{GH_REPO_OWNER}/{GH_REPO_NAME}", "main_edit", credential=git)
@@ -36,8 +43,7 @@ def createEcosystem() -> Ecosystem:
         name="YellowStarter",
         repo=eRepo,
         runtimeDecls=[
-            RuntimeDeclaration("prod", GitHubRepository(eRepo.repositoryName, "prod_rte_edit", credential=git)),
-            RuntimeDeclaration("uat", GitHubRepository(eRepo.repositoryName, "uat_rte_edit", credential=git))
+            RuntimeDeclaration(name, GitHubRepository(eRepo.repositoryName, RTE_FACTORIES[name][0], credential=git)) for name in rteNames
         ],
         infrastructure_vendors=[
             # Onsite data centers
@@ -57,14 +63,26 @@ def createEcosystem() -> Ecosystem:
         ],
         liveRepo=GitHubRepository(f"{GH_REPO_OWNER}/{GH_REPO_NAME}", "main", credential=git)
     )
-    # Define the prod RTE
-    createProdRTE(ecosys)
-    createUATRTE(ecosys)
+    # Define the runtime environments
+    for name in rteNames:
+        RTE_FACTORIES[name][1](ecosys)
     # Add the system models to the ecosystem. They can be modified by the ecosystem repository owners.
     addDatasurfaceModel(ecosys, ecosys.owningRepo)
 
     # Add the governance zone and associated teamsto the ecosystem.
     createGZ(ecosys, git)
+    return ecosys
 
+
+def createEcosystem(rteName: Optional[str] = None) -> Ecosystem:
+    """This is a very simple test model with a single datastore and dataset.
+    It is used to test the YellowDataPlatform. We are using a monorepo approach
+    so all the model fragments use the same owning repository.
+
+    If rteName names a runtime environment then only that one is declared and built, which model_cache does for the
+    processes that work in one runtime environment so they don't pay to build the others. The platform loads the model
+    without one so by default every runtime environment is built.
+    """
+    ecosys: Ecosystem = buildEcosystem(rteName)
     _: ValidationTree = ecosys.lintAndHydrateCaches()
     return ecosys
@@ -0,0 +1,220 @@
+"""
+// Copyright (c) William Newport
+// SPDX-License-Identifier: BUSL-1.1
+
+Validate only the runtime environments a model change can affect. Each runtime environment is validated on its own
+model, built with just that runtime environment, from the model modules eco.py imports less the factory modules of
+the other runtime environments. The modules a runtime environment is built from are found from the imports of the
+model source, and a fingerprint of them is stored after it validates cleanly. A later run only validates the runtime
+environments whose fingerprint changed, so a change to rte_uat.py validates uat alone while a change to a team or
+governance zone, which every runtime environment includes, validates them all. The DSG platform mapping file of each
+runtime environment's platform service provider is part of its fingerprint too.
+
+The runtime environments are validated concurrently, each in its own process, so checking the model takes as long as
+the slowest runtime environment rather than all of them in turn. Their results are merged into one report with the
+time each took.
+
+    python incremental_validation.py [--all] [--state FILE] [--workers N]
+"""
+
+import argparse
+import ast
+import contextlib
+import glob
+import hashlib
+import importlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+import datasurface
+from datasurface.md import ValidationTree
+from atomic_file import atomic_open
+from eco import RTE_FACTORIES
+from model_cache import get_model_cache_dir, loadEcosystemCached
+
+ECO_MODULE: str = "eco"
+
+# The file a platform service provider's DSG platform mappings are read from is its name followed by this
+DSG_PLATFORM_MAPPING_SUFFIX: str = "_dsg_platform_mapping.json"
+
+
+@dataclass
+class RTEValidationResult:
+    """The outcome of validating one runtime environment. The validation tree stays in the process which built it,
+    only its printed form comes back."""
+    rteName: str
+    seconds: float
+    hasErrors: bool
+    hasWarnings: bool
+    tree: str
+
+
+def get_local_imports(path: str) -> dict[str, set[str]]:
+    """The model modules in path and the other model modules each one imports."""
+    modules = {os.path.splitext(os.path.basename(f))[0]: f for f in glob.glob(os.path.join(path, "*.py"))}
+    graph: dict[str, set[str]] = {}
+    for module, file_name in modules.items():
+        with open(file_name) as f:
+            tree = ast.parse(f.read(), file_name)
+        imported: set[str] = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                imported.update(a.name.split(".")[0] for a in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module is not None and node.level == 0:
+                imported.add(node.module.split(".")[0])
+        graph[module] = imported & modules.keys()
+    return graph
+
+
+def get_rte_fragments(path: str) -> dict[str, set[str]]:
+    """The model modules each runtime environment is built from: everything eco.py imports, directly or not, except
+    the factory modules of the other runtime environments."""
+    graph = get_local_imports(path)
+    rte_modules: dict[str, str] = {name: factory.__module__ for name, (_, factory) in RTE_FACTORIES.items()}
+    fragments: dict[str, set[str]] = {}
+    for rteName in rte_modules:
+        excluded = {m for n, m in rte_modules.items() if n != rteName}
+        fragment: set[str] = set()
+        pending = [ECO_MODULE]
+        while pending:
+            module = pending.pop()
+            if module not in fragment and module not in excluded:
+                fragment.add(module)
+                pending.extend(graph.get(module, set()))
+        fragments[rteName] = fragment
+    return fragments
+
+
+def get_rte_mapping_files() -> dict[str, str]:
+    """The DSG platform mapping file each runtime environment reads, named after the platform service provider its
+    factory module declares in PSP_NAME."""
+    return {
+        name: f"{importlib.import_module(factory.__module__).PSP_NAME}{DSG_PLATFORM_MAPPING_SUFFIX}" for name, (_, factory) in RTE_FACTORIES.items()}
+
+
+def get_fragment_fingerprint(path: str, fragment: set[str], data_files: Optional[list[str]] = None) -> str:
+    """A hash of the source of the modules in a fragment, the data files it reads and the datasurface version. A
+    missing data file hashes differently to any content."""
+    h = hashlib.sha256(f"datasurface={getattr(datasurface, '__version__', 'unknown')}".encode())
+    for module in sorted(fragment):
+        with open(os.path.join(path, f"{module}.py"), "rb") as f:
+            h.update(module.encode())
+            h.update(hashlib.sha256(f.read()).digest())
+    for data_file in sorted(data_files or []):
+        h.update(data_file.encode())
+        try:
+            with open(os.path.join(path, data_file), "rb") as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        except FileNotFoundError:
+            h.update(b"missing")
+    return h.hexdigest()
+
+
+def read_validation_state(state_file: str) -> dict[str, str]:
+    """The fingerprint of each runtime environment when it last validated cleanly."""
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+        return state if isinstance(state, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def write_validation_state(state_file: str, state: dict[str, str]) -> None:
+    with atomic_open(state_file) as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+
+def get_changed_rtes(path: str, state: dict[str, str]) -> dict[str, str]:
+    """The runtime environments whose fragment changed since they last validated, with their new fingerprints."""
+    mapping_files = get_rte_mapping_files()
+    fingerprints = {name: get_fragment_fingerprint(path, fragment, [mapping_files[name]]) for name, fragment in get_rte_fragments(path).items()}
+    return {name: fp for name, fp in fingerprints.items() if state.get(name) != fp}
+
+
+def validate_rte(path: str, rteName: str) -> ValidationTree:
+    """Load and validate the model built with only the runtime environment."""
+    ecosys, tree = loadEcosystemCached(path, rteName, scopeToRTE=True)
+    if ecosys is None or tree is None:
+        raise RuntimeError(f"The model for runtime environment {rteName} could not be loaded")
+    return tree
+
+
+def run_rte_validation(path: str, rteName: str) -> RTEValidationResult:
+    """Validate a runtime environment, timing it and printing its validation tree. Runs in a worker process."""
+    start = time.perf_counter()
+    tree = validate_rte(path, rteName)
+    seconds = time.perf_counter() - start
+    printed = io.StringIO()
+    if tree.hasErrors() or tree.hasWarnings():
+        with contextlib.redirect_stdout(printed):
+            tree.printTree()
+    return RTEValidationResult(rteName, seconds, tree.hasErrors(), tree.hasWarnings(), printed.getvalue())
+
+
+def validate_rtes(path: str, rteNames: list[str], max_workers: Optional[int] = None) -> dict[str, RTEValidationResult]:
+    """Validate the runtime environments concurrently, one process each up to max_workers."""
+    workers = min(len(rteNames), max_workers or os.cpu_count() or 1)
+    if workers <= 1:
+        return {rteName: run_rte_validation(path, rteName) for rteName in rteNames}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {rteName: pool.submit(run_rte_validation, path, rteName) for rteName in rteNames}
+        return {rteName: future.result() for rteName, future in futures.items()}
+
+
+def validate_changed(path: str, state_file: str, validate_all: bool = False, max_workers: Optional[int] = None) -> dict[str, RTEValidationResult]:
+    """Validate the runtime environments changed since the last run, or all of them, recording those which pass.
+    Returns the result of each runtime environment validated."""
+    state = read_validation_state(state_file)
+    changed = get_changed_rtes(path, {} if validate_all else state)
+    results = validate_rtes(path, list(changed.keys()), max_workers)
+    for rteName, result in results.items():
+        if not result.hasErrors:
+            state[rteName] = changed[rteName]
+    write_validation_state(state_file, state)
+    return results
+
+
+def format_validation_report(results: dict[str, RTEValidationResult], wall_seconds: float) -> str:
+    """One report for all the runtime environments: a line each with its time, then the trees with errors or warnings."""
+    lines: list[str] = []
+    for result in results.values():
+        status = "failed validation with errors" if result.hasErrors else "validated OK" + (" with warnings" if result.hasWarnings else "")
+        lines.append(f"Runtime environment {result.rteName} {status} in {result.seconds:.2f}s")
+    for result in results.values():
+        if result.tree:
+            lines.append(f"Runtime environment {result.rteName} {'errors' if result.hasErrors else 'warnings'}:")
+            lines.append(result.tree.rstrip("\n"))
+    if results:
+        total = sum(r.seconds for r in results.values())
+        lines.append(f"Validated {len(results)} runtime environments in {wall_seconds:.2f}s, {total:.2f}s if validated in turn")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Validate the runtime environments changed since the last validation")
+    parser.add_argument("--path", default=".", help="The model directory")
+    parser.add_argument("--state", default=None, help="The file recording validated fingerprints, in the model cache directory by default")
+    parser.add_argument("--all", action="store_true", help="Validate every runtime environment")
+    parser.add_argument("--workers", type=int, default=None, help="Most runtime environments to validate at once, one per CPU by default")
+    args = parser.parse_args(argv)
+
+    state_file: str = args.state or os.path.join(get_model_cache_dir(), "validation_state.json")
+    start = time.perf_counter()
+    results = validate_changed(args.path, state_file, args.all, args.workers)
+    skipped = sorted(set(RTE_FACTORIES.keys()) - results.keys())
+    if skipped:
+        print(f"Unchanged since last validated: {', '.join(skipped)}")
+    report = format_validation_report(results, time.perf_counter() - start)
+    if report:
+        print(report)
+    return 1 if any(r.hasErrors for r in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+// Copyright (c) William Newport
+// SPDX-License-Identifier: BUSL-1.1
+
+A disk cache of the loaded and validated Ecosystem. Building the model runs createEcosystem and lints and hydrates
+it, which every process loading the model pays for again. Here the result is pickled to a snapshot keyed by a hash of
+the model source and JSON files, the datasurface version and the Python version, so a process loading an unchanged model only
+reads the snapshot. A snapshot which is stale, corrupt or can't be unpickled by the installed datasurface is rebuilt.
+
+The cache directory is DATASURFACE_MODEL_CACHE_DIR, or a directory in the system temporary directory. In Kubernetes it
+should be on a volume the pods share, such as the git cache PVC. Only trusted processes may write to it as loading a
+pickle can run code.
+"""
+
+import glob
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+from typing import Optional
+import datasurface
+from datasurface.md import Ecosystem, ValidationTree
+from datasurface.md.model_loader import loadEcosystemFromEcoModule
+from atomic_file import atomic_open
+from eco import buildEcosystem
+
+MODEL_CACHE_DIR_ENV: str = "DATASURFACE_MODEL_CACHE_DIR"
+
+# Pickling the model recurses once per level of its object graph
+PICKLE_RECURSION_LIMIT: int = 20000
+
+
+def get_model_cache_dir() -> str:
+    return os.environ.get(MODEL_CACHE_DIR_ENV, os.path.join(tempfile.gettempdir(), "datasurface_model_cache"))
+
+
+def get_model_files(path: str) -> list[str]:
+    """The model source files in path: the Python modules, less tests, and the JSON files, such as the DSG platform
+    mappings of the runtime environments, less the benchmark baselines."""
+    files = [f for f in glob.glob(os.path.join(path, "*.py")) if not os.path.basename(f).startswith("test_")]
+    files += [f for f in glob.glob(os.path.join(path, "*.json")) if not os.path.basename(f).startswith("bench_")]
+    return sorted(files)
+
+
+def get_model_hash(path: str) -> str:
+    """A hash of the model source files in path, the datasurface version and the Python version. Any of them changing
+    makes earlier snapshots stale."""
+    h = hashlib.sha256()
+    h.update(f"datasurface={getattr(datasurface, '__version__', 'unknown')};python={sys.version_info[:3]}".encode())
+    for file_name in get_model_files(path):
+        h.update(os.path.basename(file_name).encode())
+        with open(file_name, "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+
+def get_snapshot_file(cache_dir: str, rteName: Optional[str], model_hash: str, scopeToRTE: bool = False) -> str:
+    """The snapshot of the model loaded for rteName, built with only that runtime environment if scopeToRTE is set."""
+    scope = rteName if scopeToRTE and rteName is not None else "all"
+    return os.path.join(cache_dir, f"ecosystem-{rteName or 'all'}-{scope}-{model_hash[:32]}.pickle")
+
+
+def read_snapshot(snapshot_file: str) -> Optional[tuple[Ecosystem, ValidationTree]]:
+    """Read a snapshot, returning None if it is missing or can't be loaded."""
+    try:
+        with open(snapshot_file, "rb") as f:
+            ecosys, tree = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Model snapshot {snapshot_file} can't be loaded, rebuilding: {e!r}")
+        return None
+    if not isinstance(ecosys, Ecosystem) or not isinstance(tree, ValidationTree):
+        print(f"Model snapshot {snapshot_file} is not an ecosystem, rebuilding")
+        return None
+    return ecosys, tree
+
+
+def write_snapshot(snapshot_file: str, ecosys: Ecosystem, tree: ValidationTree) -> None:
+    """Write a snapshot atomically so readers never see half of one, then remove the stale snapshots it replaces.
+    A model which can't be pickled is just not cached."""
+    old_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(old_limit, PICKLE_RECURSION_LIMIT))
+    try:
+        with atomic_open(snapshot_file, binary=True) as f:
+            pickle.dump((ecosys, tree), f, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        print(f"Model can't be cached: {e!r}")
+        return
+    finally:
+        sys.setrecursionlimit(old_limit)
+    prefix = os.path.basename(snapshot_file).rsplit("-", 1)[0]
+    for stale_file in glob.glob(os.path.join(os.path.dirname(snapshot_file), f"{prefix}-*.pickle")):
+        if stale_file != snapshot_file:
+            try:
+                os.remove(stale_file)
+            except OSError:
+                pass  # Another process removed it first
+
+
+def loadEcosystemCached(
+        path: str, rteName: Optional[str] = None, cache_dir: Optional[str] = None, scopeToRTE: bool = False) -> tuple[Optional[Ecosystem], Optional[ValidationTree]]:
+    """loadEcosystemFromEcoModule, returning the cached snapshot of the model when its sources haven't changed.
+    If scopeToRTE is set the model is built and linted as createEcosystem(rteName) does, with only the runtime
+    environment rteName, from the eco module on the Python path. Models which fail validation are never cached so their
+    errors are reported on every load."""
+    snapshot_file = get_snapshot_file(cache_dir or get_model_cache_dir(), rteName, get_model_hash(path), scopeToRTE)
+    snapshot = read_snapshot(snapshot_file)
+    if snapshot is not None:
+        return snapshot
+    ecosys: Optional[Ecosystem]
+    tree: Optional[ValidationTree]
+    if scopeToRTE and rteName is not None:
+        ecosys = buildEcosystem(rteName)
+        tree = ecosys.lintAndHydrateCaches()
+    else:
+        ecosys, tree = loadEcosystemFromEcoModule(path, rteName)
+    if ecosys is not None and tree is not None and not tree.hasErrors():
+        write_snapshot(snapshot_file, ecosys, tree)
+    return ecosys, tree
@@ -0,0 +1,118 @@
+"""
+// Copyright (c) William Newport
+// SPDX-License-Identifier: BUSL-1.1
+
+Measure how far each consumer replica is behind the merge database. The Yellow platform stamps every merged row with
+the id of the batch which last wrote it and the consumer replica groups copy those rows, so the distinct batch ids in a
+merge table above the highest in its replica table are the batches the replica still has to apply. Batch ids are not
+contiguous per table, a batch which didn't touch a table leaves a gap, so they are counted rather than subtracted. The lag of
+every table on every replica is printed as a JSON log line and can be written in the Prometheus text format, like the
+transformer run metrics, so an alert fires when a replica group stops keeping up with its trigger.
+
+    python replica_lag.py --merge-url postgresql://... --replica SQLServer=mssql+pyodbc://... --table customers
+"""
+
+import argparse
+import json
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Optional
+from sqlalchemy import Connection, create_engine, text
+from atomic_file import write_atomically
+from transformer_dialects import BATCH_ID_COLUMN, get_database_type, get_dialect
+from transformer_metrics import prometheus_metric
+
+
+@dataclass
+class ReplicaLag:
+    replica: str
+    table: str
+    merge_batch_id: Optional[int]
+    replica_batch_id: Optional[int]
+    lag_batches: Optional[int]
+    """Batches merged but not yet in the replica. None if the merge table has no batches."""
+
+
+def get_max_batch_id(conn: Connection, table: str) -> Optional[int]:
+    dialect = get_dialect(get_database_type(conn))
+    value = conn.execute(text(f"SELECT MAX({dialect.quote(BATCH_ID_COLUMN)}) FROM {dialect.quote(table)}")).scalar()
+    return int(value) if value is not None else None
+
+
+def count_batches_after(conn: Connection, table: str, batch_id: Optional[int]) -> int:
+    """The number of distinct batch ids in the table above batch_id, all of them if it is None."""
+    dialect = get_dialect(get_database_type(conn))
+    batch_col = dialect.quote(BATCH_ID_COLUMN)
+    where = "" if batch_id is None else f" WHERE {batch_col} > :batchId"
+    return int(conn.execute(text(f"SELECT COUNT(DISTINCT {batch_col}) FROM {dialect.quote(table)}{where}"), {"batchId": batch_id}).scalar() or 0)
+
+
+def get_replica_lags(merge_conn: Connection, replica_conns: dict[str, Connection], tables: dict[str, str]) -> list[ReplicaLag]:
+    """The lag of each replica table, tables maps each merge table to its name in the replicas."""
+    merge_batch_ids = {table: get_max_batch_id(merge_conn, table) for table in tables}
+    # Replicas at the same batch share the count of the merge batches after it
+    lag_counts: dict[tuple[str, Optional[int]], int] = {}
+    lags: list[ReplicaLag] = []
+    for replica, conn in replica_conns.items():
+        for table, replica_table in tables.items():
+            replica_batch_id = get_max_batch_id(conn, replica_table)
+            lag_batches: Optional[int] = None
+            if merge_batch_ids[table] is not None:
+                key = (table, replica_batch_id)
+                if key not in lag_counts:
+                    lag_counts[key] = count_batches_after(merge_conn, table, replica_batch_id)
+                lag_batches = lag_counts[key]
+            lags.append(ReplicaLag(replica, replica_table, merge_batch_ids[table], replica_batch_id, lag_batches))
+    return lags
+
+
+def to_prometheus(lags: list[ReplicaLag]) -> str:
+    lines = prometheus_metric(
+        "datasurface_crg_replica_lag_batches", "Batches in the merge database not yet applied to the replica table",
+        [(f'replica="{lag.replica}",table="{lag.table}"', lag.lag_batches) for lag in lags if lag.lag_batches is not None])
+    lines += prometheus_metric("datasurface_crg_replica_lag_timestamp_seconds", "When the replica lag was measured", [("", time.time())])
+    return "\n".join(lines) + "\n"
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure how many batches each consumer replica is behind the merge database")
+    parser.add_argument("--merge-url", required=True, help="SQLAlchemy URL of the merge database")
+    parser.add_argument("--replica", action="append", required=True, help="NAME=URL, a SQLAlchemy URL of a replica database")
+    parser.add_argument("--table", action="append", required=True, help="MERGE_TABLE or MERGE_TABLE=REPLICA_TABLE")
+    parser.add_argument("--prometheus-file", default=None, help="Also write the lags in the Prometheus text format to this file")
+    parser.add_argument("--max-lag", type=int, default=None, help="Exit non zero if any replica table is more batches behind than this")
+    args = parser.parse_args(argv)
+
+    tables: dict[str, str] = {}
+    for t in args.table:
+        table, _, replica_table = t.partition("=")
+        tables[table] = replica_table or table
+    replica_urls: dict[str, str] = {}
+    for r in args.replica:
+        name, sep, url = r.partition("=")
+        if not sep:
+            parser.error(f"--replica {r} is not NAME=URL")
+        replica_urls[name] = url
+
+    merge_engine = create_engine(args.merge_url)
+    replica_engines = {name: create_engine(url) for name, url in replica_urls.items()}
+    with merge_engine.connect() as merge_conn:
+        replica_conns = {name: engine.connect() for name, engine in replica_engines.items()}
+        try:
+            lags = get_replica_lags(merge_conn, replica_conns, tables)
+        finally:
+            for conn in replica_conns.values():
+                conn.close()
+
+    for lag in lags:
+        print(json.dumps({"event": "crg_replica_lag", **asdict(lag)}))
+    if args.prometheus_file:
+        write_atomically(args.prometheus_file, to_prometheus(lags))
+    if args.max_lag is not None and any(lag.lag_batches is not None and lag.lag_batches > args.max_lag for lag in lags):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -22,6 +22,9 @@ from datasurface.platforms.yellow.yellow_dp import K8sDataTransformerHint
 from datasurface.md.repo import VersionPatternReleaseSelector, GitHubRepository, ReleaseType, VersionPatterns
 UAT_KUB_NAME_SPACE: str = "ns-yellow-starter-uat"  # This is the namespace you want to use for your kubernetes environment
 
+# The platform service provider, whose DSG platform mappings are read from Test_DP_UAT_dsg_platform_mapping.json
+PSP_NAME: str = "Test_DP_UAT"
+
 
 def createPSP() -> YellowPlatformServiceProvider:
     # Kubernetes merge database configuration
@@ -58,7 +61,7 @@ def createPSP() -> YellowPlatformServiceProvider:
     )
 
     psp: YellowPlatformServiceProvider = YellowPlatformServiceProvider(
-        "Test_DP_UAT",
+        PSP_NAME,
         {LocationKey("MyCorp:USA/NY_1")},
         PlainTextDocumentation("Test"),
         gitCredential=Credential("git", CredentialType.API_TOKEN),
@@ -93,7 +96,7 @@ def createPSP() -> YellowPlatformServiceProvider:
                     )
                 },
                 workspaceNames={"Consumer1"},
-                trigger=CronTrigger("Every 5 minute", "*/5 * * * *"),
+                trigger=CronTrigger("Every 5 minute", "2-59/5 * * * *"),  # Staggered by trigger_analysis.py
                 credential=Credential("postgres", CredentialType.USER_PASSWORD)
             ),
             ConsumerReplicaGroup(
@@ -108,7 +111,7 @@ def createPSP() -> YellowPlatformServiceProvider:
                     )
                 },
                 workspaceNames={"Consumer1", "MaskedStoreGenerator"},
-                trigger=CronTrigger("Every 5 minute", "*/5 * * * *"),
+                trigger=CronTrigger("Every 5 minute", "1-59/5 * * * *"),  # Staggered by trigger_analysis.py
                 credential=Credential("sa", CredentialType.USER_PASSWORD)
             )
         ],
@@ -28,6 +28,54 @@ GH_REPO_NAME: str = "yellow_starter"  # Change to your github repository name co
 GH_DT_REPO_NAME: str = "yellow_starter"  # For now, we use the same repo for the transformer
 
 
+def createCustomersSchema() -> DDLTable:
+    """The schema of the Store1 customers dataset and of its masked copy. The masking transformer compiles its SQL from this."""
+    return DDLTable(
+        columns=[
+            DDLColumn("id", VarChar(20), nullable=NullableStatus.NOT_NULLABLE, primary_key=PrimaryKeyStatus.PK),
+            DDLColumn("firstname", VarChar(100), nullable=NullableStatus.NOT_NULLABLE),
+            DDLColumn("lastname", VarChar(100), nullable=NullableStatus.NOT_NULLABLE),
+            DDLColumn("dob", Date(), nullable=NullableStatus.NOT_NULLABLE),
+            DDLColumn("email", VarChar(100)),
+            DDLColumn("phone", VarChar(100)),
+            DDLColumn("primaryaddressid", VarChar(20)),
+            DDLColumn("billingaddressid", VarChar(20))
+        ]
+    )
+
+
+def createAddressesSchema() -> DDLTable:
+    """The schema of the Store1 addresses dataset."""
+    return DDLTable(
+        columns=[
+            DDLColumn("id", VarChar(20), nullable=NullableStatus.NOT_NULLABLE, primary_key=PrimaryKeyStatus.PK),
+            DDLColumn("customerid", VarChar(20), nullable=NullableStatus.NOT_NULLABLE),
+            DDLColumn("streetname", VarChar(100), nullable=NullableStatus.NOT_NULLABLE),
+            DDLColumn("city", VarChar(100), nullable=NullableStatus.NOT_NULLABLE),
+            DDLColumn("state", VarChar(100), nullable=NullableStatus.NOT_NULLABLE),
+            DDLColumn("zipcode", VarChar(30), nullable=NullableStatus.NOT_NULLABLE)
+        ]
+    )
+
+
+def createCustomerAddressesSchema() -> DDLTable:
+    """The schema of the masked customers joined to their primary address. Customers without one have no address values."""
+    return DDLTable(
+        columns=[
+            DDLColumn("id", VarChar(20), nullable=NullableStatus.NOT_NULLABLE, primary_key=PrimaryKeyStatus.PK),
+            DDLColumn("firstname", VarChar(100), nullable=NullableStatus.NOT_NULLABLE),
+            DDLColumn("lastname", VarChar(100), nullable=NullableStatus.NOT_NULLABLE),
+            DDLColumn("dob", Date(), nullable=NullableStatus.NOT_NULLABLE),
+            DDLColumn("email", VarChar(100)),
+            DDLColumn("phone", VarChar(100)),
+            DDLColumn("streetname", VarChar(100)),
+            DDLColumn("city", VarChar(100)),
+            DDLColumn("state", VarChar(100)),
+            DDLColumn("zipcode", VarChar(30))
+        ]
+    )
+
+
 def createTeam(ecosys: Ecosystem, git: Credential) -> Team:
     gz: GovernanceZone = ecosys.getZoneOrThrow("USA")
     gz.add(TeamDeclaration(
@@ -70,41 +118,24 @@ def createTeam(ecosys: Ecosystem, git: Credential) -> Team:
         Datastore(
             "Store1",
             documentation=PlainTextDocumentation("Test datastore"),
+            # Captured as full snapshots, each diffed against the merge database. Reading only rows past a high-water
+            # mark and reconciling keys for deletes must be done by the platform's ingestion, it can't be declared
+            # here until datasurface offers such a capture type. Only this capture_metadata would then change.
             capture_metadata=SQLSnapshotIngestion(
                 EnvRefDataContainer("customer_db"),
-                CronTrigger("Every 5 minute", "*/1 * * * *"),  # Cron trigger for ingestion
+                CronTrigger("Every 1 minute", "*/1 * * * *"),  # Cron trigger for ingestion
                 IngestionConsistencyType.MULTI_DATASET,  # Ingestion consistency type
                 Credential("postgres", CredentialType.USER_PASSWORD),  # Credential for platform to read from database
                 ),
             datasets=[
                 Dataset(
                     "customers",
-                    schema=DDLTable(
-                        columns=[
-                            DDLColumn("id", VarChar(20), nullable=NullableStatus.NOT_NULLABLE, primary_key=PrimaryKeyStatus.PK),
-                            DDLColumn("firstname", VarChar(100), nullable=NullableStatus.NOT_NULLABLE),
-                            DDLColumn("lastname", VarChar(100), nullable=NullableStatus.NOT_NULLABLE),
-                            DDLColumn("dob", Date(), nullable=NullableStatus.NOT_NULLABLE),
-                            DDLColumn("email", VarChar(100)),
-                            DDLColumn("phone", VarChar(100)),
-                            DDLColumn("primaryaddressid", VarChar(20)),
-                            DDLColumn("billingaddressid", VarChar(20))
-                        ]
-                    ),
+                    schema=createCustomersSchema(),
                     classifications=[SimpleDC(SimpleDCTypes.CPI, "Customer")]
                 ),
                 Dataset(
                     "addresses",
-                    schema=DDLTable(
-                        columns=[
-                            DDLColumn("id", VarChar(20), nullable=NullableStatus.NOT_NULLABLE, primary_key=PrimaryKeyStatus.PK),
-                            DDLColumn("customerid", VarChar(20), nullable=NullableStatus.NOT_NULLABLE),
-                            DDLColumn("streetname", VarChar(100), nullable=NullableStatus.NOT_NULLABLE),
-                            DDLColumn("city", VarChar(100), nullable=NullableStatus.NOT_NULLABLE),
-                            DDLColumn("state", VarChar(100), nullable=NullableStatus.NOT_NULLABLE),
-                            DDLColumn("zipcode", VarChar(30), nullable=NullableStatus.NOT_NULLABLE)
-                        ]
-                    ),
+                    schema=createAddressesSchema(),
                     classifications=[SimpleDC(SimpleDCTypes.CPI, "Address")]
                 )
             ]
@@ -117,7 +148,9 @@ def createTeam(ecosys: Ecosystem, git: Credential) -> Team:
                 sinks=[
                     DatasetSink("Store1", "customers"),
                     DatasetSink("Store1", "addresses"),
-                    DatasetSink("MaskedCustomers", "customers")
+                    DatasetSink("MaskedCustomers", "customers"),
+                    DatasetSink("MaskedCustomers", "addresses"),
+                    DatasetSink("MaskedCustomers", "customeraddresses")
                 ],
                 platform_chooser=WorkspacePlatformConfig(
                     hist=ConsumerRetentionRequirements(
@@ -132,7 +165,9 @@ def createTeam(ecosys: Ecosystem, git: Credential) -> Team:
                 sinks=[
                     DatasetSink("Store1", "customers"),
                     DatasetSink("Store1", "addresses"),
-                    DatasetSink("MaskedCustomers", "customers")
+                    DatasetSink("MaskedCustomers", "customers"),
+                    DatasetSink("MaskedCustomers", "addresses"),
+                    DatasetSink("MaskedCustomers", "customeraddresses")
                 ],
                 platform_chooser=WorkspacePlatformConfig(
                     hist=ConsumerRetentionRequirements(
@@ -148,7 +183,10 @@ def createTeam(ecosys: Ecosystem, git: Credential) -> Team:
             DataPlatformManagedDataContainer("MaskedStoreGenerator container"),
             DatasetGroup(
                 "Original",
-                sinks=[DatasetSink("Store1", "customers")]
+                sinks=[
+                    DatasetSink("Store1", "customers"),
+                    DatasetSink("Store1", "addresses")
+                ]
             ),
             DataTransformer(
                 name="MaskedCustomerGenerator",
@@ -166,18 +204,17 @@ def createTeam(ecosys: Ecosystem, git: Credential) -> Team:
                     datasets=[
                         Dataset(
                             "customers",
-                            schema=DDLTable(
-                                columns=[
-                                    DDLColumn("id", VarChar(20), nullable=NullableStatus.NOT_NULLABLE, primary_key=PrimaryKeyStatus.PK),
-                                    DDLColumn("firstname", VarChar(100), nullable=NullableStatus.NOT_NULLABLE),
-                                    DDLColumn("lastname", VarChar(100), nullable=NullableStatus.NOT_NULLABLE),
-                                    DDLColumn("dob", Date(), nullable=NullableStatus.NOT_NULLABLE),
-                                    DDLColumn("email", VarChar(100)),
-                                    DDLColumn("phone", VarChar(100)),
-                                    DDLColumn("primaryaddressid", VarChar(20)),
-                                    DDLColumn("billingaddressid", VarChar(20))
-                                ]
-                            ),
+                            schema=createCustomersSchema(),
+                            classifications=[SimpleDC(SimpleDCTypes.PUB, "Customer")]
+                        ),
+                        Dataset(
+                            "addresses",
+                            schema=createAddressesSchema(),
+                            classifications=[SimpleDC(SimpleDCTypes.PUB, "Address")]
+                        ),
+                        Dataset(
+                            "customeraddresses",
+                            schema=createCustomerAddressesSchema(),
                             classifications=[SimpleDC(SimpleDCTypes.PUB, "Customer")]
                         )
                     ]
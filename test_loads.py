@@ -1,7 +1,19 @@
+import json
+import os
+import subprocess
+import tempfile
 import unittest
 from datasurface.md import Ecosystem, ValidationTree, DataPlatform, EcosystemPipelineGraph, PlatformPipelineGraph
 from typing import Any, Optional
+from unittest.mock import patch
 from datasurface.md.model_loader import loadEcosystemFromEcoModule
+from artifact_cache import ArtifactCache
+from bench_model import ModelResult, ModelSize, copy_model, run_worker
+from capacity_planner import CapacityPlanner, DataFlow, get_oversubscribed_hosts
+from eco import RTE_FACTORIES, createEcosystem
+from incremental_validation import RTEValidationResult, get_rte_fragments, get_rte_mapping_files, validate_changed, validate_rtes
+from model_cache import get_model_hash, get_snapshot_file, loadEcosystemCached
+from trigger_analysis import DEFAULT_DURATIONS, ScheduledJob, get_host_load, get_scheduled_jobs, stagger_jobs
 
 
 class TestEcosystem(unittest.TestCase):
@@ -58,6 +70,130 @@ class TestEcosystem(unittest.TestCase):
         forensic_root: Optional[PlatformPipelineGraph] = graph.roots.get(forensic_dp.name)
         self.assertIsNotNone(forensic_root)
 
+    def test_modelCache(self):
+        with tempfile.TemporaryDirectory() as cacheDir:
+            ecosys, ecoTree = loadEcosystemCached(".", "prod", cacheDir)  # Cold, builds and writes the snapshot
+            assert ecosys is not None and ecoTree is not None
+            self.assertFalse(ecoTree.hasErrors())
+            snapshotFile: str = get_snapshot_file(cacheDir, "prod", get_model_hash("."))
+            self.assertTrue(os.path.exists(snapshotFile))
+
+            cachedEcosys, cachedTree = loadEcosystemCached(".", "prod", cacheDir)  # Warm, reads the snapshot
+            assert cachedEcosys is not None and cachedTree is not None
+            self.assertIsNot(cachedEcosys, ecosys)
+            self.assertEqual(cachedEcosys.name, ecosys.name)
+            self.assertIsNotNone(cachedEcosys.getDataPlatformOrThrow("YellowLive"))
+
+            with open(snapshotFile, "wb") as f:  # A corrupt snapshot is rebuilt
+                f.write(b"not a pickle")
+            rebuiltEcosys, rebuiltTree = loadEcosystemCached(".", "prod", cacheDir)
+            assert rebuiltEcosys is not None and rebuiltTree is not None
+            self.assertEqual(rebuiltEcosys.name, ecosys.name)
+
+    def test_modelHashFiles(self):
+        with tempfile.TemporaryDirectory() as modelDir:
+            def write(name: str, content: str) -> None:
+                with open(os.path.join(modelDir, name), "w") as f:
+                    f.write(content)
+
+            for name in ["eco.py", "test_eco.py", "Test_DP_dsg_platform_mapping.json", "bench_baseline.json"]:
+                write(name, "1")
+            modelHash: str = get_model_hash(modelDir)
+            write("test_eco.py", "2")
+            write("bench_baseline.json", "2")
+            self.assertEqual(get_model_hash(modelDir), modelHash)
+            write("Test_DP_dsg_platform_mapping.json", "2")  # A DSG platform mapping is part of the model
+            self.assertNotEqual(get_model_hash(modelDir), modelHash)
+
+    def test_benchModel(self):
+        with tempfile.TemporaryDirectory() as modelDir:
+            copy_model(modelDir, ModelSize(2, 1, 1, 2))
+            with open(os.path.join(modelDir, "Test_DP_dsg_platform_mapping.json")) as f:
+                mappings: list[dict[str, Any]] = json.load(f)
+            workspaces: set[str] = {m["workspace"] for m in mappings}
+            self.assertTrue({"Consumer1", "synth0_consumer0", "synth1_consumer1"} <= workspaces)
+        # The synthetic model validates with its DSGs mapped
+        result: ModelResult = run_worker("2x1x1x2")
+        self.assertEqual(set(result.phase_seconds.keys()), {"build", "lint", "graph"})
+        self.assertEqual(result.total_datasets, 2)
+
+    def test_scopedEcosystem(self):
+        ecosys: Ecosystem = createEcosystem("prod")
+        self.assertIsNotNone(ecosys.getRuntimeEnvironmentOrThrow("prod"))
+        with self.assertRaises(Exception):
+            ecosys.getRuntimeEnvironmentOrThrow("uat")
+        self.assertIsNotNone(ecosys.getDataPlatformOrThrow("YellowLive"))
+        with patch.dict(os.environ, {"DATASURFACE_RTE_NAME": "prod"}):  # The model factory only takes the scope as an argument
+            self.assertIsNotNone(createEcosystem().getRuntimeEnvironmentOrThrow("uat"))
+
+        with tempfile.TemporaryDirectory() as cacheDir:
+            ecosys, ecoTree = loadEcosystemCached(".", "uat", cacheDir, scopeToRTE=True)
+            assert ecosys is not None and ecoTree is not None
+            self.assertFalse(ecoTree.hasErrors())
+            self.assertTrue(os.path.exists(get_snapshot_file(cacheDir, "uat", get_model_hash("."), scopeToRTE=True)))
+            self.assertIsNotNone(ecosys.getDataPlatformOrThrow("YellowLiveUAT"))
+            with self.assertRaises(Exception):
+                ecosys.getRuntimeEnvironmentOrThrow("prod")
+
+    def test_rteFragments(self):
+        fragments: dict[str, set[str]] = get_rte_fragments(".")
+        self.assertEqual(fragments["prod"], {"eco", "gz", "team1", "rte_prod"})
+        self.assertEqual(fragments["uat"], {"eco", "gz", "team1", "rte_uat"})
+        mappingFiles: dict[str, str] = get_rte_mapping_files()
+        self.assertEqual(mappingFiles, {"prod": "Test_DP_dsg_platform_mapping.json", "uat": "Test_DP_UAT_dsg_platform_mapping.json"})
+        for mappingFile in mappingFiles.values():
+            self.assertTrue(os.path.exists(mappingFile))
+        with tempfile.TemporaryDirectory() as stateDir:
+            stateFile: str = os.path.join(stateDir, "validation_state.json")
+            results: dict[str, RTEValidationResult] = validate_changed(".", stateFile)
+            self.assertEqual(set(results.keys()), {"prod", "uat"})
+            self.assertFalse(any(result.hasErrors for result in results.values()))
+            self.assertEqual(validate_changed(".", stateFile), {})  # Nothing changed so nothing is validated again
+
+    def test_validateAllRTEs(self):
+        results: dict[str, RTEValidationResult] = validate_rtes(".", list(RTE_FACTORIES.keys()), max_workers=len(RTE_FACTORIES))
+        self.assertEqual(list(results.keys()), list(RTE_FACTORIES.keys()))
+        for result in results.values():
+            if result.hasErrors:
+                print(result.tree)
+            self.assertFalse(result.hasErrors, f"Runtime environment {result.rteName} failed validation")
+            self.assertGreater(result.seconds, 0.0)
+
+    def test_triggerStagger(self):
+        jobs: list[ScheduledJob] = get_scheduled_jobs(createEcosystem(), "prod")
+        self.assertEqual({job.kind for job in jobs}, {"ingestion", "transformer", "crg"})
+        staggered: list[ScheduledJob] = stagger_jobs(jobs, DEFAULT_DURATIONS)
+        before = get_host_load(jobs, DEFAULT_DURATIONS)
+        after = get_host_load(staggered, DEFAULT_DURATIONS)
+        for host, (peak, _) in after.items():
+            self.assertLessEqual(peak, before[host][0])
+        self.assertEqual([job.cron for job in staggered], [job.cron for job in jobs])  # The model is already staggered
+
+    def test_capacityPlanner(self):
+        flows: list[DataFlow] = CapacityPlanner(createEcosystem(), "prod", {"Store1.customers": 1000000}).collect()
+        self.assertEqual({flow.job.split(":")[0] for flow in flows}, {"ingestion", "transformer", "crg"})
+        self.assertIn("postgres", {flow.host for flow in flows})
+        # MaskedStoreGenerator is placed on the SQLServer consumer replica group
+        self.assertEqual({flow.host for flow in flows if flow.job.startswith("transformer:")}, {"sqlserver"})
+        self.assertEqual(get_oversubscribed_hosts(flows, {"postgres": 1e12, "sqlserver": 1e12}, 0.7), {})
+        self.assertIn("postgres", get_oversubscribed_hosts(flows, {"postgres": 1.0}, 0.7))
+
+    def test_artifactCache(self):
+        with tempfile.TemporaryDirectory() as repoDir, tempfile.TemporaryDirectory() as cacheDir:
+            for args in (["init", "-q"], ["-c", "user.name=t", "-c", "user.email=t@t", "commit", "-q", "--allow-empty", "-m", "release"],
+                         ["tag", "v1.2.0-prod"], ["-c", "user.name=t", "-c", "user.email=t@t", "tag", "-a", "-m", "release", "v1.10.0-prod"],
+                         ["tag", "v2.0.0-uat"]):
+                subprocess.run(["git", "-C", repoDir, *args], check=True)
+            cache: ArtifactCache = ArtifactCache(cacheDir)
+            tag, commit, treeDir = cache.fetch_release(repoDir, r"v(\d+)\.(\d+)\.(\d+)-prod")
+            self.assertEqual(tag, "v1.10.0-prod")
+            # The commit of the annotated tag, not the hash of its tag object
+            self.assertEqual(commit, subprocess.run(["git", "-C", repoDir, "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip())
+            self.assertTrue(treeDir.endswith(commit))
+            gitCalls: int = cache.git_calls
+            self.assertEqual(cache.fetch_release(repoDir, r"v(\d+)\.(\d+)\.(\d+)-prod"), (tag, commit, treeDir))
+            self.assertEqual(cache.git_calls, gitCalls)  # An unchanged release does no git work
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,548 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from http.server import ThreadingHTTPServer
+from unittest.mock import patch
+from sqlalchemy import BigInteger, Column, create_engine, text
+from datasurface.md import DDLColumn, DDLTable, NullableStatus, PrimaryKeyStatus, VarChar
+from datasurface.md.policy import SimpleDC, SimpleDCTypes
+import transformer
+import transformer_masking
+import transformer_stream
+from atomic_file import atomic_open, write_atomically
+from replica_lag import get_replica_lags
+from team1 import createAddressesSchema, createCustomersSchema
+from transformer_local import LocalTransformerContext, create_local_engine, create_table_for_schema
+from transformer_dialects import get_dialect
+from transformer_metrics import TransformerMetrics, current_run
+from transformer_stream import mask_column, mask_email, to_csv_value
+from transformer_worker import TransformerWorker, create_handler
+from transformer_masking import (
+    get_masked_customer_insert_sql, get_masked_customer_select_sql, get_masked_customer_upsert_sql, get_masked_customer_write_sql,
+    get_customer_masking, get_next_chunk_bound_sql, get_row_hash_sql, get_swap_index_name, compile_masking, register_mask_rule, TransformerOptions
+)
+
+
+class TestTransformer(unittest.TestCase):
+    def test_insertSQL(self):
+        pgSQL: str = get_masked_customer_insert_sql("src", "out", "postgresql")
+        self.assertIn('INSERT INTO "out"', pgSQL)
+        self.assertIn('FROM "src"', pgSQL)
+        self.assertNotIn("WHERE", pgSQL.split("FROM")[-1])
+
+        msSQL: str = get_masked_customer_insert_sql("src", "out", "sqlserver")
+        self.assertIn("INSERT INTO [out]", msSQL)
+        self.assertIn("RIGHT([firstname], 2)", msSQL)
+        self.assertEqual(get_dialect("sqlserver").quote("a]; DROP TABLE x; --"), "[a]]; DROP TABLE x; --]")
+        self.assertEqual(get_dialect("postgresql").quote('a"b'), '"a""b"')
+
+    def test_selectWhere(self):
+        selectSQL: str = get_masked_customer_select_sql("src", "postgresql", '"ds_surf_batch_id" > :lastBatchId')
+        self.assertTrue(selectSQL.rstrip().endswith('WHERE "ds_surf_batch_id" > :lastBatchId'))
+
+    def test_chunkBoundSQL(self):
+        self.assertIn("LIMIT :chunkSize", get_next_chunk_bound_sql('"src"', "id", "postgresql", True))
+        self.assertNotIn(":lowKey", get_next_chunk_bound_sql('"src"', "id", "postgresql", True))
+        msSQL: str = get_next_chunk_bound_sql("[src]", "id", "sqlserver", False)
+        self.assertIn("TOP (:chunkSize)", msSQL)
+        self.assertIn("[id] > :lowKey", msSQL)
+
+    def test_options(self):
+        with patch.dict(os.environ, {"DT_PARALLELISM": "4", "DT_PARTITIONING": "range"}):
+            options: TransformerOptions = TransformerOptions.from_hints()
+            self.assertEqual(options.mode, "full")
+            self.assertEqual(options.parallelism, 4)
+            self.assertEqual(options.partitioning, "range")
+            self.assertFalse(options.skip_unchanged)
+            self.assertFalse(options.mask_functions)
+        with patch.dict(os.environ, {"DT_SKIP_UNCHANGED": "True"}):
+            self.assertTrue(TransformerOptions.from_hints().skip_unchanged)
+        with patch.dict(os.environ, {"DT_PARALLELISM": "4", "DT_CHUNK_SIZE": "1000"}):
+            with self.assertRaises(ValueError):
+                TransformerOptions.from_hints()
+
+    def test_upsertSQL(self):
+        pgSQL: str = get_masked_customer_upsert_sql("src", "out", "postgresql")
+        self.assertIn('ON CONFLICT ("id") DO UPDATE', pgSQL)
+        self.assertIn("IS DISTINCT FROM", pgSQL)
+        msSQL: str = get_masked_customer_upsert_sql("src", "out", "sqlserver")
+        self.assertIn("MERGE INTO [out] AS t", msSQL)
+        self.assertIn("EXCEPT", msSQL)
+        self.assertTrue(msSQL.endswith(";"))
+
+    def test_rowHashSQL(self):
+        pgSQL: str = get_row_hash_sql(get_customer_masking("postgresql"), "postgresql", '"src"')
+        self.assertTrue(pgSQL.startswith("md5(concat_ws(chr(31), "))
+        self.assertIn(f"'{transformer_masking.get_masking_version(get_customer_masking('postgresql'))}'", pgSQL)
+        self.assertIn('"src"."billingaddressid"', pgSQL)
+        msSQL: str = get_row_hash_sql(get_customer_masking("sqlserver"), "sqlserver", "[src]")
+        self.assertIn("HASHBYTES('MD5'", msSQL)
+        self.assertIn("[src].[dob]", msSQL)
+
+    def test_compileMasking(self):
+        schema: DDLTable = DDLTable(
+            columns=[
+                DDLColumn("key", VarChar(20), nullable=NullableStatus.NOT_NULLABLE, primary_key=PrimaryKeyStatus.PK),
+                DDLColumn("notes", VarChar(200)),
+                DDLColumn("phone", VarChar(100))
+            ]
+        )
+        with patch.dict(transformer_masking.COLUMN_MASK_RULES):
+            register_mask_rule("redact", columns=["notes"])
+            compiled = compile_masking(schema, "postgresql")
+        self.assertEqual(compiled.key_column, "key")
+        self.assertEqual(compiled.value_columns, ("notes", "phone"))
+        self.assertIn("""THEN '***' ELSE NULL END as "notes\"""", compiled.select_list)
+        self.assertIn("'***-***-'", compiled.select_list)
+        with self.assertRaises(ValueError):
+            register_mask_rule("scramble", columns=["notes"])
+
+    def test_classificationMaskRule(self):
+        schema: DDLTable = DDLTable(
+            columns=[
+                DDLColumn("key", VarChar(20), nullable=NullableStatus.NOT_NULLABLE, primary_key=PrimaryKeyStatus.PK),
+                DDLColumn("notes", VarChar(200), classifications=[SimpleDC(SimpleDCTypes.CPI, "Notes")]),
+                DDLColumn("city", VarChar(100), classifications=[SimpleDC(SimpleDCTypes.PUB, "City")])
+            ]
+        )
+        engine = create_engine("sqlite://")
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE src (key VARCHAR(20) PRIMARY KEY, notes VARCHAR(200), city VARCHAR(100))"))
+            conn.execute(text("CREATE TABLE out (key VARCHAR(20) PRIMARY KEY, notes VARCHAR(200), city VARCHAR(100))"))
+            conn.execute(text("INSERT INTO src VALUES ('k1', 'likes cats', 'Springfield')"))
+        self.addCleanup(transformer_masking.clear_compiled_masking)
+        with patch.dict(transformer_masking.CLASSIFICATION_MASK_RULES):
+            # Compiled before the rule so the rule must replace the cached masking
+            self.assertEqual(compile_masking(schema, "sqlite").masks, (None, None, None))
+            register_mask_rule("redact", classifications=["CPI"])
+            masking = compile_masking(schema, "sqlite")
+            self.assertEqual(masking.masks, (None, "redact", None))
+            with engine.begin() as conn:
+                conn.execute(text(transformer_masking.get_masked_insert_sql(masking, '"src"', "out", "sqlite")))
+                self.assertEqual(conn.execute(text("SELECT * FROM out")).one(), ("k1", "***", "Springfield"))
+
+    def test_streamMasks(self):
+        self.assertEqual(mask_column(["smith", None, "a"], "name", "postgresql"), ["***th", None, "***a"])
+        self.assertEqual(mask_column(["555-123-4567"], "phone", "sqlserver"), ["***-***-4567"])
+        self.assertEqual(mask_email("bob@x.com", "postgresql"), "bob***@x.com")
+        self.assertEqual(mask_email("ab@x.com", "postgresql"), "ab@***@x.com")
+        self.assertIsNone(mask_email("ab@x.com", "sqlserver"))
+        self.assertIsNone(mask_email("nobody", "postgresql"))
+        self.assertEqual(to_csv_value(None), "")
+        self.assertEqual(to_csv_value('say "hi"'), '"say ""hi"""')
+
+    def test_streamMasksVectorized(self):
+        if transformer_stream.pc is None:
+            self.skipTest("PyArrow isn't installed")
+        values = ["bob@x.com", "ab@x.com", "nobody", None, "", "a@b@c", "@x", "abc@", "ümlaut@x.de", "smith", "555-123-4567"]
+        for mask in ["name", "phone", "id", "initial", "redact", "email"]:
+            for dbType in ["postgresql", "sqlserver"]:
+                vectorized = mask_column(values, mask, dbType)
+                with patch.object(transformer_stream, "pc", None):
+                    self.assertEqual(vectorized, mask_column(values, mask, dbType), f"{mask} on {dbType}")
+
+    def test_oracleAndDB2(self):
+        oraSQL: str = get_masked_customer_insert_sql("src", "out", "oracle")
+        self.assertIn("INSERT INTO out", oraSQL)
+        self.assertIn("INSTR(email, '@', 1, 2)", oraSQL)
+        self.assertIn("FETCH FIRST :chunkSize ROWS ONLY", get_next_chunk_bound_sql("src", "id", "oracle", True))
+        self.assertNotIn(" AS ", get_masked_customer_upsert_sql("src", "out", "oracle").split("USING")[0])
+        self.assertIn("STANDARD_HASH(", get_row_hash_sql(get_customer_masking("oracle"), "oracle", "s"))
+        self.assertIn("FROM DUAL", get_dialect("oracle").select_value_sql("1"))
+
+        db2SQL: str = get_masked_customer_insert_sql("src", "out", "db2")
+        self.assertIn("LOCATE_IN_STRING(email, '@', 1, 2, CODEUNITS32)", db2SQL)
+        self.assertIn("HASH_MD5(", get_row_hash_sql(get_customer_masking("db2"), "db2", "s"))
+        with self.assertRaises(ValueError):
+            get_dialect("db2").hash_partition_sql("id", 4)
+
+    def test_sqlite(self):
+        liteSQL: str = get_masked_customer_insert_sql("src", "out", "sqlite")
+        self.assertIn('SUBSTR("firstname", MAX(LENGTH("firstname") - 1, 1))', liteSQL)
+        self.assertIn("LIMIT :chunkSize", get_next_chunk_bound_sql('"src"', "id", "sqlite", True))
+        self.assertIn("WHERE true", get_masked_customer_upsert_sql("src", "out", "sqlite"))
+        with self.assertRaises(ValueError):
+            get_row_hash_sql(get_customer_masking("sqlite"), "sqlite", "s")
+
+    def test_swap(self):
+        msSQL: str = get_masked_customer_write_sql("src", "out_staging", "sqlserver", "swap")
+        self.assertIn("INSERT INTO [out_staging] WITH (TABLOCK)", msSQL)
+        self.assertIn("EXEC sp_rename '[out]', 'out_swapped'", get_dialect("sqlserver").rename_table_sql("[out]", "out_swapped"))
+        self.assertIn('ALTER TABLE "out" RENAME TO "out_swapped"', get_dialect("postgresql").rename_table_sql('"out"', "out_swapped"))
+        self.assertEqual(get_swap_index_name("out_pkey"), "out_pkey_swap")
+        self.assertEqual(get_swap_index_name("out_pkey_swap"), "out_pkey")
+        with patch.dict(os.environ, {"DT_OUTPUT": "swap", "DT_MODE": "incremental"}):
+            with self.assertRaises(ValueError):
+                TransformerOptions.from_hints()
+
+    def test_swapGrants(self):
+        self.assertEqual(
+            get_dialect("postgresql").grant_sql('"out_staging"', "reporting", "SELECT", False), 'GRANT SELECT ON "out_staging" TO "reporting"')
+        self.assertEqual(
+            get_dialect("sqlserver").grant_sql("[out_staging]", "analyst", "SELECT", True), "GRANT SELECT ON [out_staging] TO [analyst] WITH GRANT OPTION")
+        self.assertEqual(get_dialect("oracle").grant_sql("out_staging", "PUBLIC", "SELECT", False), "GRANT SELECT ON out_staging TO PUBLIC")
+        self.assertIn("aclexplode(c.relacl)", get_dialect("postgresql").table_grants_sql() or "")
+        self.assertIn("OBJECT_ID(QUOTENAME(:table))", get_dialect("sqlserver").table_grants_sql() or "")
+        self.assertIn("user_tab_privs_made", get_dialect("oracle").table_grants_sql() or "")
+        db2SQL = get_dialect("db2").table_grants_sql() or ""
+        self.assertEqual(db2SQL.count("SYSCAT.TABAUTH"), 7)
+        self.assertIn("WHEN SELECTAUTH = 'G'", db2SQL)
+        self.assertIsNone(get_dialect("sqlite").table_grants_sql())
+
+    def test_derivedDatasets(self):
+        customerAddresses = next(d for d in transformer_masking.DERIVED_DATASETS if d.name == "customeraddresses")
+        sourceSQL: str = customerAddresses.source_sql({"customers": "cust", "addresses": "addr"}, "postgresql", True)
+        self.assertIn('c."firstname", c."lastname"', sourceSQL)
+        self.assertIn('a."streetname"', sourceSQL)
+        self.assertIn('LEFT JOIN "addr" a ON a."id" = c."primaryaddressid"', sourceSQL)
+        masking = transformer_masking.get_derived_masking(customerAddresses, "postgresql")
+        self.assertEqual(masking.key_column, "id")
+        self.assertEqual(masking.masks[masking.columns.index("streetname")], "redact")
+        self.assertIsNone(masking.masks[masking.columns.index("city")])
+        insertSQL: str = transformer_masking.get_masked_write_sql(masking, sourceSQL, "out", "postgresql", "insert")
+        self.assertIn(f"FROM {sourceSQL}", insertSQL)
+
+    def test_maskFunctions(self):
+        nameFunction: str = transformer_masking.get_mask_function_name("name", "postgresql")
+        self.assertTrue(nameFunction.startswith("ds_mask_name_"))
+        pgSQL: str = get_masked_customer_write_sql("src", "out", "postgresql", "insert", None, True)
+        self.assertIn(f'{nameFunction}(s."firstname") as "firstname"', pgSQL)
+        self.assertNotIn("CASE", pgSQL)
+        self.assertIn("IMMUTABLE PARALLEL SAFE", get_dialect("postgresql").mask_function_sql(nameFunction, "name")[0])
+        emailFunction: str = transformer_masking.get_mask_function_name("email", "sqlserver")
+        msSQL = get_masked_customer_write_sql("src", "out", "sqlserver", "insert", None, True)
+        emailIndex: int = get_customer_masking("sqlserver").columns.index("email")
+        self.assertIn(f"m{emailIndex}.v as [email]", msSQL)
+        self.assertIn(f"CROSS APPLY dbo.{emailFunction}_rows(s.[email]) m{emailIndex}", msSQL)
+        self.assertIn("s.[id] as [id]", msSQL)
+        scalarSQL, functionSQL = get_dialect("sqlserver").mask_function_sql(emailFunction, "email")
+        # A schema bound scalar function for computed columns and the table valued function the masking SQL calls
+        self.assertIn(f"dbo.{emailFunction}(@v NVARCHAR(4000)) RETURNS NVARCHAR(4000)\n    WITH SCHEMABINDING", scalarSQL)
+        self.assertIn(f"dbo.{emailFunction}_rows(@v NVARCHAR(4000)) RETURNS TABLE\n    WITH SCHEMABINDING", functionSQL)
+        self.assertTrue(functionSQL.endswith("AS v"))
+        self.assertEqual(functionSQL.count("CHARINDEX"), 1)
+        self.assertIn("RIGHT([firstname], 2)", get_masked_customer_write_sql("src", "out", "sqlserver", "insert"))
+        with self.assertRaises(ValueError):
+            transformer_masking.get_customer_masking("sqlite", True)
+
+    def test_atomicWrite(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            fileName = os.path.join(tmpDir, "metrics", "dt.prom")
+            write_atomically(fileName, "old\n")
+            with self.assertRaises(RuntimeError):
+                with atomic_open(fileName) as f:
+                    f.write("half")
+                    raise RuntimeError("failed")
+            with open(fileName) as f:
+                self.assertEqual(f.read(), "old\n")
+            self.assertEqual(os.listdir(os.path.dirname(fileName)), ["dt.prom"])
+
+    def test_metrics(self):
+        metrics: TransformerMetrics = TransformerMetrics("dt", 60.0)
+        with metrics.phase("execution"):
+            metrics.rows_written = 100
+        metrics.finish("success")
+        d = metrics.to_dict()
+        self.assertEqual(d["outcome"], "success")
+        self.assertIn("execution", d["phase_seconds"])
+        self.assertIsNone(d["rows_read"])
+        metrics.add_rows_read(60)
+        metrics.add_rows_read(40)
+        self.assertEqual(metrics.to_dict()["rows_read"], 100)
+        prom: str = metrics.to_prometheus()
+        self.assertIn('datasurface_dt_rows_written{transformer="dt",dialect="unknown",mode="unknown"} 100', prom)
+        self.assertIn('outcome="success"} 1', prom)
+        self.assertIn('datasurface_dt_rows_read{transformer="dt",dialect="unknown",mode="unknown"} 100', prom)
+
+
+class TestReplicaLag(unittest.TestCase):
+    """The lag of consumer replica tables behind their merge tables, against SQLite databases."""
+
+    def createCustomers(self, conn, batchIds: tuple[int, ...]) -> None:
+        conn.execute(text("CREATE TABLE customers (id VARCHAR(20), ds_surf_batch_id INTEGER)"))
+        for b in batchIds:
+            conn.execute(text("INSERT INTO customers VALUES (:id, :b)"), {"id": str(b), "b": b})
+
+    def test_lagCountsDistinctBatches(self):
+        mergeEngine = create_engine("sqlite://")
+        replicaEngine = create_engine("sqlite://")
+        emptyEngine = create_engine("sqlite://")
+        with mergeEngine.begin() as mergeConn, replicaEngine.begin() as replicaConn, emptyEngine.begin() as emptyConn:
+            # Batches 3 and 4 didn't touch customers, so only batch 5 is missing from the replica
+            self.createCustomers(mergeConn, (1, 2, 5, 5))
+            self.createCustomers(replicaConn, (1, 2))
+            self.createCustomers(emptyConn, ())
+            lags = get_replica_lags(mergeConn, {"SQLServer": replicaConn, "Postgres": emptyConn}, {"customers": "customers"})
+        self.assertEqual([(lag.replica, lag.replica_batch_id, lag.lag_batches) for lag in lags], [("SQLServer", 2, 1), ("Postgres", None, 3)])
+
+
+class TestTransformerRuns(unittest.TestCase):
+    """Runs of the transformer against a SQLite database, checking the output tables."""
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.engine = create_local_engine(f"sqlite:///{os.path.join(self.tmpDir.name, 'test.db')}")
+        create_table_for_schema(self.engine, "src_customers", createCustomersSchema(), [Column(transformer_masking.BATCH_ID_COLUMN, BigInteger)])
+        create_table_for_schema(self.engine, "src_addresses", createAddressesSchema(), [Column(transformer_masking.BATCH_ID_COLUMN, BigInteger)])
+        outputTables: dict[str, str] = {"customers": "out_customers"}
+        create_table_for_schema(self.engine, "out_customers", createCustomersSchema())
+        for d in transformer_masking.DERIVED_DATASETS:
+            outputTables[d.name] = f"out_{d.name}"
+            create_table_for_schema(self.engine, outputTables[d.name], d.create_schema())
+        self.context = LocalTransformerContext(
+            {("Original", "Store1", "customers"): "src_customers", ("Original", "Store1", "addresses"): "src_addresses"}, outputTables)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmpDir.cleanup()
+
+    def execute(self, sql: str, **params) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(text(sql), params)
+
+    def addCustomer(self, customerId: str, firstname: str, batchId: int) -> None:
+        self.execute(
+            "INSERT INTO src_customers VALUES (:id, :firstname, 'jones', '1980-01-01', :email, '555-123-4567', :addressId, NULL, :batchId)",
+            id=customerId, firstname=firstname, email=f"{firstname}@example.com", addressId=f"a{customerId}", batchId=batchId)
+        self.execute(
+            "INSERT INTO src_addresses VALUES (:id, :customerId, '1 Main St', 'Springfield', 'IL', '62701', :batchId)",
+            id=f"a{customerId}", customerId=customerId, batchId=batchId)
+
+    def runTransformer(self, hints: dict[str, str]) -> None:
+        """Run the transformer as the platform does, truncating the outputs in the transaction it runs in and then
+        committing it."""
+        with patch.dict(os.environ, {"DT_SKIP_UNCHANGED": "false", **hints}), redirect_stdout(io.StringIO()), self.engine.connect() as conn:
+            for table in self.context.output_tables.values():
+                conn.execute(text(f"DELETE FROM {table}"))
+            transformer.executeTransformer(conn, self.context)
+            conn.commit()
+
+    def output(self, table: str = "out_customers") -> dict[str, tuple]:
+        with self.engine.connect() as conn:
+            return {row[0]: tuple(row) for row in conn.execute(text(f"SELECT * FROM {table}"))}
+
+    def test_incremental(self):
+        for i, name in enumerate(["alice", "bobby", "carol"]):
+            self.addCustomer(f"c{i}", name, 1)
+        self.runTransformer({"DT_MODE": "incremental"})
+        self.assertEqual(sorted(self.output()), ["c0", "c1", "c2"])
+        self.assertEqual(self.output()["c1"][1], "***by")
+        self.assertEqual(self.output()["c1"][4], "bob***@example.com")
+
+        # A row the next run must leave alone as its customer didn't change, it is copied from the masked copy
+        self.execute("UPDATE out_customers_masked SET lastname = 'untouched' WHERE id = 'c0'")
+        self.execute("UPDATE src_customers SET firstname = 'robert', ds_surf_batch_id = 2 WHERE id = 'c1'")
+        self.execute("DELETE FROM src_customers WHERE id = 'c2'")
+        self.addCustomer("c3", "dave", 2)
+        self.runTransformer({"DT_MODE": "incremental"})
+        out = self.output()
+        self.assertEqual(sorted(out), ["c0", "c1", "c3"])
+        self.assertEqual(out["c0"][2], "untouched")
+        self.assertEqual(out["c1"][1], "***rt")
+        self.assertEqual(out["c3"][1], "***ve")
+
+    def test_incrementalMaskRuleChange(self):
+        self.addCustomer("c0", "alice", 1)
+        self.runTransformer({"DT_MODE": "incremental"})
+        self.assertEqual(self.output("out_customeraddresses")["c0"][7], "Springfield")
+
+        # A new rule masks the rows masked before it too, although no customer changed
+        self.addCleanup(transformer_masking.clear_compiled_masking)
+        with patch.dict(transformer_masking.COLUMN_MASK_RULES):
+            register_mask_rule("redact", columns=["city"])
+            self.runTransformer({"DT_MODE": "incremental"})
+        self.assertEqual(self.output("out_customeraddresses")["c0"][7], "***")
+        self.assertEqual(self.output("out_addresses")["ac0"][3], "***")
+
+    def test_derivedIncremental(self):
+        for i, name in enumerate(["alice", "bobby"]):
+            self.addCustomer(f"c{i}", name, 1)
+        self.runTransformer({"DT_MODE": "incremental"})
+        self.assertEqual(sorted(self.output("out_customeraddresses")), ["c0", "c1"])
+        self.assertEqual(self.output("out_customeraddresses")["c1"][7], "Springfield")
+
+        # Only the customer whose address moved is masked again
+        self.execute("UPDATE out_customeraddresses_masked SET lastname = 'untouched' WHERE id = 'c0'")
+        self.execute("UPDATE out_addresses_masked SET city = 'untouched' WHERE id = 'ac0'")
+        self.execute("UPDATE src_addresses SET city = 'Shelbyville', ds_surf_batch_id = 2 WHERE id = 'ac1'")
+        self.runTransformer({"DT_MODE": "incremental"})
+        customerAddresses = self.output("out_customeraddresses")
+        self.assertEqual(customerAddresses["c0"][2], "untouched")
+        self.assertEqual(customerAddresses["c1"][7], "Shelbyville")
+        addresses = self.output("out_addresses")
+        self.assertEqual(addresses["ac0"][3], "untouched")
+        self.assertEqual(addresses["ac1"][3], "Shelbyville")
+        with self.engine.connect() as conn:
+            self.assertEqual(transformer_masking.getState(conn, "out_customeraddresses_masked", "lastBatchId"), "2")
+
+    def test_derivedSwap(self):
+        self.addCustomer("c0", "alice", 1)
+        self.runTransformer({"DT_OUTPUT": "swap"})
+        self.assertEqual(sorted(self.output()), ["c0"])
+        self.assertEqual(sorted(self.output("out_addresses")), ["ac0"])
+        self.assertEqual(self.output("out_customeraddresses")["c0"][1], "***ce")
+        metrics = current_run()
+        assert metrics is not None
+        self.assertIn("swap", metrics.phase_seconds)
+
+    def test_skipUnchanged(self):
+        hints: dict[str, str] = {"DT_SKIP_UNCHANGED": "true"}
+        self.addCustomer("c0", "alice", 1)
+        self.runTransformer(hints)
+        self.assertEqual(sorted(self.output()), ["c0"])
+
+        def outcome() -> str:
+            metrics = current_run()
+            assert metrics is not None
+            return metrics.outcome
+
+        # The truncated outputs are filled from the masked copies
+        self.runTransformer(hints)
+        self.assertEqual(outcome(), "skipped")
+        self.assertEqual(sorted(self.output()), ["c0"])
+        self.assertEqual(sorted(self.output("out_customeraddresses")), ["c0"])
+
+        self.addCustomer("c1", "bobby", 2)
+        self.runTransformer(hints)
+        self.assertEqual(outcome(), "success")
+        self.assertEqual(sorted(self.output()), ["c0", "c1"])
+
+        # Any masked copy which was emptied is rebuilt, not only the customers
+        self.execute("DELETE FROM out_customeraddresses_masked")
+        self.runTransformer(hints)
+        self.assertEqual(outcome(), "success")
+        self.assertEqual(sorted(self.output("out_customeraddresses")), ["c0", "c1"])
+
+    def test_upsert(self):
+        for i, name in enumerate(["alice", "bobby", "carol"]):
+            self.addCustomer(f"c{i}", name, 1)
+        self.runTransformer({"DT_OUTPUT": "upsert"})
+        self.assertEqual(sorted(self.output()), ["c0", "c1", "c2"])
+
+        # Nothing changed so nothing is written
+        self.runTransformer({"DT_OUTPUT": "upsert"})
+        metrics = current_run()
+        assert metrics is not None
+        self.assertEqual(metrics.rows_written, 0)
+
+        # A masked row which no longer matches its masked source row is put back
+        self.execute("UPDATE out_customers_masked SET lastname = 'stale' WHERE id = 'c0'")
+        self.execute("UPDATE src_customers SET firstname = 'robert', ds_surf_batch_id = 2 WHERE id = 'c1'")
+        self.execute("DELETE FROM src_customers WHERE id = 'c2'")
+        self.addCustomer("c3", "dave", 2)
+        self.runTransformer({"DT_OUTPUT": "upsert"})
+        out = self.output()
+        self.assertEqual(sorted(out), ["c0", "c1", "c3"])
+        self.assertEqual(out["c0"][2], "***es")
+        self.assertEqual(out["c1"][1], "***rt")
+        self.assertEqual(out["c3"][1], "***ve")
+
+    def test_commitPhase(self):
+        self.addCustomer("c0", "alice", 1)
+        with patch.dict(os.environ, {"DT_SKIP_UNCHANGED": "false"}), redirect_stdout(io.StringIO()), self.engine.connect() as conn:
+            transformer.executeTransformer(conn, self.context, commit=True)
+            self.assertFalse(conn.in_transaction())
+        metrics = current_run()
+        assert metrics is not None
+        self.assertIn("commit", metrics.phase_seconds)
+        self.assertEqual(metrics.rows_written, 3)
+        self.assertIsNone(metrics.rows_read)
+        self.assertEqual(sorted(self.output()), ["c0"])
+
+    def test_streamRowsRead(self):
+        for i, name in enumerate(["alice", "bobby"]):
+            self.addCustomer(f"c{i}", name, 1)
+        self.runTransformer({"DT_ENGINE": "stream"})
+        self.assertEqual(self.output()["c1"][1], "***by")
+        metrics = current_run()
+        assert metrics is not None
+        self.assertEqual(metrics.rows_read, metrics.rows_written)
+        self.assertIn("datasurface_dt_rows_read", metrics.to_prometheus())
+
+    def startWorker(self) -> tuple[TransformerWorker, str]:
+        """Start a worker on the test database serving on a free port, returning it and its URL."""
+        tables = transformer.get_context_tables(self.context)
+        allowedTables = {kind: {name: {table} for name, table in datasets.items()} for kind, datasets in tables.items()}
+        worker = TransformerWorker(str(self.engine.url), allowedTables, "secret")
+        worker.start()
+        server = ThreadingHTTPServer(("127.0.0.1", 0), create_handler(worker))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        assert worker.engine is not None
+        self.addCleanup(worker.engine.dispose)
+        return worker, f"http://127.0.0.1:{server.server_port}"
+
+    def test_worker(self):
+        worker, url = self.startWorker()
+        self.addCustomer("c0", "alice", 1)
+        # The worker clears the outputs as the platform does, so a second full run doesn't insert duplicates
+        for _ in range(2):
+            self.runTransformer({"DT_WORKER_URL": url, "DT_WORKER_TOKEN": "secret"})
+        self.assertEqual(sorted(self.output()), ["c0"])
+        self.assertEqual(sorted(self.output("out_customeraddresses")), ["c0"])
+        self.assertEqual(worker.run_counts["success"], 2)
+
+        # Runs need the token and may only be on the allowed tables
+        tables = transformer.get_context_tables(self.context)
+        with self.assertRaisesRegex(RuntimeError, "Unauthorized"):
+            transformer.run_on_worker(url, tables, 1.0, "wrong")
+        otherTables = {"inputs": tables["inputs"], "outputs": {**tables["outputs"], "customers": "src_customers"}}
+        with self.assertRaisesRegex(RuntimeError, "isn't one of the tables allowed"):
+            transformer.run_on_worker(url, otherTables, 1.0, "secret")
+        self.assertEqual(worker.run_counts["success"], 2)
+        self.assertEqual(sorted(self.output("src_customers")), ["c0"])
+
+        # A busy worker is retried until the deadline and then fails the run
+        with worker._run_lock, patch.object(transformer, "WORKER_BUSY_RETRY_SECONDS", 0.05):
+            with self.assertRaises(RuntimeError):
+                transformer.run_on_worker(url, tables, 0.2, "secret")
+        self.assertGreater(worker.run_counts["busy"], 1)
+
+    def test_entryImports(self):
+        result = subprocess.run(
+            [sys.executable, "-c", "import sys, transformer; print('transformer_masking' in sys.modules, 'pyarrow' in sys.modules)"],
+            capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.split(), ["False", "False"])
+        self.assertEqual(set(transformer.INPUT_DATASETS), {"customers"} | {i for d in transformer_masking.DERIVED_DATASETS for i in d.inputs})
+        self.assertEqual(list(transformer.OUTPUT_DATASETS), ["customers"] + [d.name for d in transformer_masking.DERIVED_DATASETS])
+
+    def test_chunked(self):
+        for i, name in enumerate(["alice", "bobby", "carol"]):
+            self.addCustomer(f"c{i}", name, 1)
+        self.runTransformer({"DT_CHUNK_SIZE": "2"})
+        self.assertEqual(sorted(self.output()), ["c0", "c1", "c2"])
+        self.assertEqual(self.output()["c2"][1], "***ol")
+        with self.engine.connect() as conn:
+            self.assertIsNone(transformer_masking.getState(conn, "out_customers_masked", "chunkCheckpoint"))
+
+        # A run which failed after committing the chunk up to c1 is resumed after it
+        self.execute("UPDATE out_customers_masked SET lastname = 'untouched' WHERE id = 'c0'")
+        self.execute("DELETE FROM out_customers_masked WHERE id = 'c2'")
+        with self.engine.begin() as conn:
+            transformer_masking.setState(conn, "out_customers_masked", "chunkCheckpoint", "c1")
+        self.runTransformer({"DT_CHUNK_SIZE": "2"})
+        out = self.output()
+        self.assertEqual(sorted(out), ["c0", "c1", "c2"])
+        self.assertEqual(out["c0"][2], "untouched")
+        self.assertEqual(out["c2"][1], "***ol")
+
+    def test_parallel(self):
+        for i, name in enumerate(["alice", "bobby", "carol", "dave"]):
+            self.addCustomer(f"c{i}", name, 1)
+        self.runTransformer({"DT_PARALLELISM": "2", "DT_PARTITIONING": "range"})
+        self.assertEqual(sorted(self.output()), ["c0", "c1", "c2", "c3"])
+        self.assertEqual(self.output()["c3"][1], "***ve")
+        self.assertEqual(sorted(self.output("out_customers_masked")), ["c0", "c1", "c2", "c3"])
+
+        self.runTransformer({"DT_PARALLELISM": "2", "DT_PARTITIONING": "range", "DT_OUTPUT": "swap"})
+        self.assertEqual(sorted(self.output()), ["c0", "c1", "c2", "c3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,118 +1,77 @@
-from sqlalchemy import Connection, text
+"""
+// Copyright (c) William Newport
+// SPDX-License-Identifier: BUSL-1.1
+
+The entry point the platform calls to run the MaskedCustomerGenerator data transformer. The masking itself is in
+transformer_masking.py, which is only imported when the run is done in this process. Setting the DT_WORKER_URL option
+in the K8sDataTransformerHint hands the run to a long lived transformer_worker.py instead, so the platform's job
+doesn't pay to import the masking, its dialects and PyArrow only to wait for the worker.
+"""
+
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from typing import Any
+from sqlalchemy import Connection
 from datasurface.platforms.yellow.transformer_context import DataTransformerContext
 
-
-def get_database_type(conn: Connection) -> str:
-    """Detect the database type from the connection."""
-    dialect_name = conn.dialect.name.lower()
-    if 'postgresql' in dialect_name or 'postgres' in dialect_name:
-        return 'postgresql'
-    elif 'mssql' in dialect_name or 'sqlserver' in dialect_name:
-        return 'sqlserver'
-    else:
-        # Default to PostgreSQL syntax
-        return 'postgresql'
-
-
-def quote_field_name(field_name: str, db_type: str) -> str:
-    """Quote field names appropriately for the database type."""
-    if db_type == 'sqlserver':
-        return f"[{field_name}]"
-    else:  # PostgreSQL
-        return f'"{field_name}"'
-
-
-def quote_table_name(table_name: str, db_type: str) -> str:
-    """Quote table names appropriately for the database type."""
-    if db_type == 'sqlserver':
-        return f"[{table_name}]"
-    else:  # PostgreSQL
-        return f'"{table_name}"'
-
-
-def get_masked_field_sql(field_name: str, mask_pattern: str, db_type: str) -> str:
-    """Generate database-specific SQL for masking a field."""
-    quoted_field = quote_field_name(field_name, db_type)
-
-    if db_type == 'sqlserver':
-        if mask_pattern == 'name':  # For firstname/lastname - show last 2 chars
-            return f"CASE WHEN {quoted_field} IS NOT NULL THEN '***' + RIGHT({quoted_field}, 2) ELSE NULL END"
-        elif mask_pattern == 'phone':  # For phone - show last 4 chars
-            return f"CASE WHEN {quoted_field} IS NOT NULL THEN '***-***-' + RIGHT({quoted_field}, 4) ELSE NULL END"
-        elif mask_pattern == 'id':  # For IDs - show last 3 chars
-            return f"CASE WHEN {quoted_field} IS NOT NULL THEN '***' + RIGHT({quoted_field}, 3) ELSE NULL END"
-        elif mask_pattern == 'email':  # For email - complex masking
-            return f"""CASE
-                WHEN {quoted_field} IS NOT NULL AND {quoted_field} LIKE '%@%' AND CHARINDEX('@', {quoted_field}) > 3
-                THEN LEFT({quoted_field}, 3) + '***@' +
-                     SUBSTRING({quoted_field}, CHARINDEX('@', {quoted_field}) + 1,
-                               LEN({quoted_field}) - CHARINDEX('@', {quoted_field}))
-                ELSE NULL
-            END"""
-    else:  # PostgreSQL
-        if mask_pattern == 'name':  # For firstname/lastname - show last 2 chars
-            return f"CASE WHEN {quoted_field} IS NOT NULL THEN '***' || SUBSTRING({quoted_field}, LENGTH({quoted_field}) - 1) ELSE NULL END"
-        elif mask_pattern == 'phone':  # For phone - show last 4 chars
-            return f"CASE WHEN {quoted_field} IS NOT NULL THEN '***-***-' || SUBSTRING({quoted_field}, LENGTH({quoted_field}) - 3) ELSE NULL END"
-        elif mask_pattern == 'id':  # For IDs - show last 3 chars
-            return f"CASE WHEN {quoted_field} IS NOT NULL THEN '***' || SUBSTRING({quoted_field}, LENGTH({quoted_field}) - 2) ELSE NULL END"
-        elif mask_pattern == 'email':  # For email - complex masking
-            return f"""CASE
-                WHEN {quoted_field} IS NOT NULL AND {quoted_field} LIKE '%@%'
-                THEN SUBSTRING({quoted_field}, 1, 3) || '***@' || SPLIT_PART({quoted_field}, '@', 2)
-                ELSE NULL
-            END"""
-
-    # Default fallback - should never reach here with valid inputs
-    return f"CASE WHEN {quoted_field} IS NOT NULL THEN '***' ELSE NULL END"
-
-
-def executeTransformer(conn: Connection, context: DataTransformerContext) -> None:
-    print(f"Executing transformer with {context}")
-    sourceCustomerTableName = context.getInputTableNameForDataset("Original", "Store1", "customers")
-    outputCustomerTableName = context.getOutputTableNameForDataset("customers")
-
-    # Detect database type
-    db_type = get_database_type(conn)
-    print(f"Detected database type: {db_type}")
-
-    # Generate database-specific SQL for each field
-    firstname_sql = get_masked_field_sql('firstname', 'name', db_type)
-    lastname_sql = get_masked_field_sql('lastname', 'name', db_type)
-    email_sql = get_masked_field_sql('email', 'email', db_type)
-    phone_sql = get_masked_field_sql('phone', 'phone', db_type)
-    primaryaddressid_sql = get_masked_field_sql('primaryaddressid', 'id', db_type)
-    billingaddressid_sql = get_masked_field_sql('billingaddressid', 'id', db_type)
-
-    # Quote column names for database compatibility
-    id_col = quote_field_name('id', db_type)
-    firstname_col = quote_field_name('firstname', db_type)
-    lastname_col = quote_field_name('lastname', db_type)
-    dob_col = quote_field_name('dob', db_type)
-    email_col = quote_field_name('email', db_type)
-    phone_col = quote_field_name('phone', db_type)
-    primaryaddressid_col = quote_field_name('primaryaddressid', db_type)
-    billingaddressid_col = quote_field_name('billingaddressid', db_type)
-
-    # Quote table names for database compatibility
-    quoted_source_table = quote_table_name(sourceCustomerTableName, db_type)
-    quoted_output_table = quote_table_name(outputCustomerTableName, db_type)
-
-    # Insert masked records using database-specific SQL
-    insert_query = f"""
-    INSERT INTO {quoted_output_table}
-    ({id_col}, {firstname_col}, {lastname_col}, {dob_col}, {email_col}, {phone_col}, {primaryaddressid_col}, {billingaddressid_col})
-    SELECT
-        {id_col},
-        {firstname_sql} as {firstname_col},
-        {lastname_sql} as {lastname_col},
-        {dob_col},
-        {email_sql} as {email_col},
-        {phone_sql} as {phone_col},
-        {primaryaddressid_sql} as {primaryaddressid_col},
-        {billingaddressid_sql} as {billingaddressid_col}
-    FROM {quoted_source_table}
-    """
-
-    result = conn.execute(text(insert_query))
-    print(f"Successfully processed and masked {result.rowcount} customer records")
+WORKER_URL_OPTION: str = "DT_WORKER_URL"
+
+# The environment variable with the token the worker requires, best set from a secret as the hint options are in the model
+WORKER_TOKEN_OPTION: str = "DT_WORKER_TOKEN"
+
+# The datasets of the run, inputs from the Store1 sink of the Original dataset group, whose tables the worker is sent
+INPUT_DATASETS: tuple[str, ...] = ("customers", "addresses")
+OUTPUT_DATASETS: tuple[str, ...] = ("customers", "addresses", "customeraddresses")
+
+# Seconds between attempts while the worker is busy with another run
+WORKER_BUSY_RETRY_SECONDS: float = 1.0
+
+
+def get_context_tables(context: DataTransformerContext) -> dict[str, dict[str, str]]:
+    """The table of each dataset of the run from the platform's context, as the worker takes them."""
+    return {
+        "inputs": {name: context.getInputTableNameForDataset("Original", "Store1", name) for name in INPUT_DATASETS},
+        "outputs": {name: context.getOutputTableNameForDataset(name) for name in OUTPUT_DATASETS}
+    }
+
+
+def run_on_worker(worker_url: str, tables: dict[str, dict[str, str]], timeout_seconds: float, token: str) -> dict[str, Any]:
+    """Have the worker at worker_url do a run of the tables and wait for it, sending token as a bearer token. While the
+    worker is busy with another run the request is retried until timeout_seconds have passed. Raises RuntimeError if
+    the run failed or the worker stayed busy, so the platform job fails as it would have running it itself."""
+    deadline = time.monotonic() + timeout_seconds
+    body = json.dumps(tables).encode()
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {token}"}
+    while True:
+        request = urllib.request.Request(f"{worker_url.rstrip('/')}/run", data=body, method="POST", headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=max(deadline - time.monotonic(), WORKER_BUSY_RETRY_SECONDS)) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            result = json.loads(e.read() or b"{}")
+            if e.code != 409:
+                raise RuntimeError(f"Transformer worker run failed: {result.get('error', e)}")
+        if time.monotonic() + WORKER_BUSY_RETRY_SECONDS > deadline:
+            raise RuntimeError(f"Transformer worker at {worker_url} was still busy with another run after {timeout_seconds:.0f}s")
+        time.sleep(WORKER_BUSY_RETRY_SECONDS)
+
+
+def executeTransformer(conn: Connection, context: DataTransformerContext, commit: bool = False) -> None:
+    """Mask Store1 customers into the MaskedCustomers datasets, see transformer_masking.executeTransformer, or have
+    the worker at DT_WORKER_URL do it and wait for it, allowing ten trigger intervals. The request has the token in
+    DT_WORKER_TOKEN. The worker emits the metrics of the runs it does.
+
+    The platform truncates the outputs in its transaction before calling this. That transaction is committed before
+    the handoff so its locks don't block the worker, which clears the outputs itself."""
+    worker_url = os.environ.get(WORKER_URL_OPTION, "")
+    if not worker_url:
+        import transformer_masking
+        transformer_masking.executeTransformer(conn, context, commit)
+        return
+    conn.commit()
+    timeout_seconds = float(os.environ.get("DT_TRIGGER_INTERVAL_SECONDS", "60")) * 10
+    result = run_on_worker(worker_url, get_context_tables(context), timeout_seconds, os.environ.get(WORKER_TOKEN_OPTION, ""))
+    print(f"Transformer worker run: {result}")
@@ -0,0 +1,411 @@
+"""
+// Copyright (c) William Newport
+// SPDX-License-Identifier: BUSL-1.1
+
+The SQL the masking transformer generates differs between databases in quoting, string functions, row limits, hashing
+and upserts. Each supported database has a MaskingDialect which generates those parts natively so the masking always
+runs as set based statements in the database, wherever the transformer is placed.
+"""
+
+import re
+from typing import Optional
+from sqlalchemy import Connection
+
+# The Yellow platform stamps every merged row with the id of the batch which last wrote it
+BATCH_ID_COLUMN: str = "ds_surf_batch_id"
+
+
+class MaskingDialect:
+    """Generates the database specific parts of the masking SQL. The base class is ANSI SQL with || concatenation,
+    subclasses override what their database does differently."""
+
+    name: str = "ansi"
+
+    def quote(self, name: str) -> str:
+        """Quote a table or column name, doubling any quote in it."""
+        return '"' + name.replace('"', '""') + '"'
+
+    def masked_field_sql(self, quoted_field: str, mask_pattern: str) -> str:
+        """Generate the expression masking a field, NULLs stay NULL."""
+        if mask_pattern == 'name':  # For firstname/lastname - show last 2 chars
+            return f"CASE WHEN {quoted_field} IS NOT NULL THEN '***' || {self.right_sql(quoted_field, 2)} ELSE NULL END"
+        elif mask_pattern == 'phone':  # For phone - show last 4 chars
+            return f"CASE WHEN {quoted_field} IS NOT NULL THEN '***-***-' || {self.right_sql(quoted_field, 4)} ELSE NULL END"
+        elif mask_pattern == 'id':  # For IDs - show last 3 chars
+            return f"CASE WHEN {quoted_field} IS NOT NULL THEN '***' || {self.right_sql(quoted_field, 3)} ELSE NULL END"
+        elif mask_pattern == 'email':  # For email - keep 3 chars and the domain
+            return self.masked_email_sql(quoted_field)
+        elif mask_pattern == 'initial':  # For free text - show the first char
+            return f"CASE WHEN {quoted_field} IS NOT NULL THEN SUBSTRING({quoted_field}, 1, 1) || '***' ELSE NULL END"
+        elif mask_pattern == 'redact':  # Hide everything
+            return f"CASE WHEN {quoted_field} IS NOT NULL THEN '***' ELSE NULL END"
+
+        # Default fallback - should never reach here with valid inputs
+        return f"CASE WHEN {quoted_field} IS NOT NULL THEN '***' ELSE NULL END"
+
+    def right_sql(self, quoted_field: str, length: int) -> str:
+        """The last length characters of a field, all of it if it's shorter."""
+        return f"SUBSTRING({quoted_field}, LENGTH({quoted_field}) - {length - 1})"
+
+    def masked_email_sql(self, quoted_field: str) -> str:
+        """Keep the first 3 characters and the domain, which is the text between the first and any second @."""
+        return f"""CASE
+                WHEN {quoted_field} IS NOT NULL AND {quoted_field} LIKE '%@%'
+                THEN SUBSTRING({quoted_field}, 1, 3) || '***@' || SPLIT_PART({quoted_field}, '@', 2)
+                ELSE NULL
+            END"""
+
+    def select_value_sql(self, expression: str) -> str:
+        """A query returning a single value which needs no table."""
+        return f"SELECT {expression}"
+
+    def limit_sql(self, select_sql: str, limit_param: str) -> str:
+        """Restrict an ordered select to the first :limit_param rows."""
+        return f"{select_sql} FETCH FIRST :{limit_param} ROWS ONLY"
+
+    def hash_partition_sql(self, quoted_field: str, partitions: int) -> str:
+        """An expression putting each row in one of partitions hash partitions numbered from 0."""
+        raise ValueError(f"Hash partitioning isn't supported on {self.name}, use range partitioning")
+
+    def row_hash_sql(self, quoted_values: list[str]) -> str:
+        """The MD5 of the values, as 32 hex characters. NULLs hash differently to any value and a unit separator
+        between values stops values shifting between columns hashing the same."""
+        return f"md5({self.joined_values_sql(quoted_values)})"
+
+    def joined_values_sql(self, quoted_values: list[str]) -> str:
+        """The values as strings joined with unit separators, NULLs replaced by a marker."""
+        return " || CHR(31) || ".join(f"COALESCE(CAST({v} AS VARCHAR(255)), '~null~')" for v in quoted_values)
+
+    def upsert_sql(self, quoted_output_table: str, masked_select: str, key_col: str, value_cols: list[str]) -> str:
+        """Merge the masked select into the output table. New rows are inserted and existing rows only updated when
+        a value differs."""
+        all_cols = ", ".join([key_col] + value_cols)
+        return f"""
+    MERGE INTO {quoted_output_table} AS t
+    USING ({masked_select}) AS s
+    ON t.{key_col} = s.{key_col}
+    WHEN MATCHED AND ({" OR ".join(f"t.{c} IS DISTINCT FROM s.{c}" for c in value_cols)})
+        THEN UPDATE SET {", ".join(f"{c} = s.{c}" for c in value_cols)}
+    WHEN NOT MATCHED
+        THEN INSERT ({all_cols}) VALUES ({", ".join(f"s.{c}" for c in [key_col] + value_cols)})"""
+
+    def bulk_insert_into_sql(self, quoted_table: str) -> str:
+        """The start of an INSERT into a new table with no indexes, asking for minimal logging where the database has it."""
+        return f"INSERT INTO {quoted_table}"
+
+    def add_primary_key_sql(self, quoted_table: str, quoted_name: str, quoted_cols: list[str]) -> str:
+        """Add a named primary key to a table."""
+        return f"ALTER TABLE {quoted_table} ADD CONSTRAINT {quoted_name} PRIMARY KEY ({', '.join(quoted_cols)})"
+
+    def rename_table_sql(self, quoted_table: str, new_name: str) -> str:
+        """Rename a table, new_name is unquoted."""
+        return f"ALTER TABLE {quoted_table} RENAME TO {self.quote(new_name)}"
+
+    def table_grants_sql(self) -> Optional[str]:
+        """A query for the grantee, privilege and whether it is grantable (1 or 0) of each privilege granted to others on
+        the table named by the unquoted :table parameter, or None if the database has no grants."""
+        return """SELECT grantee, privilege_type, CASE WHEN is_grantable = 'YES' THEN 1 ELSE 0 END
+    FROM information_schema.table_privileges WHERE table_name = :table AND grantee <> CURRENT_USER"""
+
+    def grant_sql(self, quoted_table: str, grantee: str, privilege: str, grantable: bool) -> str:
+        """Grant a privilege returned by table_grants_sql on a table."""
+        quoted_grantee = grantee if grantee.upper() == "PUBLIC" else self.quote(grantee)
+        return f"GRANT {privilege} ON {quoted_table} TO {quoted_grantee}{' WITH GRANT OPTION' if grantable else ''}"
+
+    def mask_function_sql(self, function_name: str, mask_pattern: str) -> list[str]:
+        """The statements creating or replacing the functions of a mask. function_name is always a deterministic scalar
+        function applying the mask to its one string argument, which computed or generated columns can use too, and
+        any other function the masking SQL calls instead is named after it."""
+        raise ValueError(f"Masking functions aren't supported on {self.name}")
+
+    def mask_function_call_sql(self, function_name: str, quoted_field: str, alias: str) -> tuple[str, Optional[str]]:
+        """Call a function created by mask_function_sql. Returns the masked value expression and, for databases whose
+        functions are table valued, the join after the source which makes the value, named alias, available."""
+        return f"{function_name}({quoted_field})", None
+
+
+class PostgresDialect(MaskingDialect):
+    name = "postgresql"
+
+    def limit_sql(self, select_sql: str, limit_param: str) -> str:
+        return f"{select_sql} LIMIT :{limit_param}"
+
+    def hash_partition_sql(self, quoted_field: str, partitions: int) -> str:
+        # Mask off the sign bit rather than use ABS which overflows on the smallest integer
+        return f"(hashtext({quoted_field}) & 2147483647) % {partitions}"
+
+    def row_hash_sql(self, quoted_values: list[str]) -> str:
+        values = ", ".join(f"COALESCE(CAST({v} AS VARCHAR), '~null~')" for v in quoted_values)
+        return f"md5(concat_ws(chr(31), {values}))"
+
+    def upsert_sql(self, quoted_output_table: str, masked_select: str, key_col: str, value_cols: list[str]) -> str:
+        all_cols = ", ".join([key_col] + value_cols)
+        return f"""
+    INSERT INTO {quoted_output_table} AS t
+    ({all_cols})
+    {masked_select}
+    ON CONFLICT ({key_col}) DO UPDATE SET {", ".join(f"{c} = EXCLUDED.{c}" for c in value_cols)}
+    WHERE ({", ".join(f"t.{c}" for c in value_cols)}) IS DISTINCT FROM ({", ".join(f"EXCLUDED.{c}" for c in value_cols)})"""
+
+    def mask_function_sql(self, function_name: str, mask_pattern: str) -> list[str]:
+        # A single SELECT SQL function which is IMMUTABLE is inlined into the calling query by the planner, and can be
+        # used by generated columns
+        return [f"""CREATE OR REPLACE FUNCTION {function_name}(v VARCHAR) RETURNS VARCHAR
+    LANGUAGE SQL IMMUTABLE PARALLEL SAFE
+    AS $$ SELECT {self.masked_field_sql("v", mask_pattern)} $$"""]
+
+    def table_grants_sql(self) -> Optional[str]:
+        # The owner's implicit privileges aren't in relacl until something else is granted, the new table gets them anyway
+        return """SELECT CASE WHEN g.grantee = 0 THEN 'PUBLIC' ELSE pg_get_userbyid(g.grantee) END, g.privilege_type,
+        CASE WHEN g.is_grantable THEN 1 ELSE 0 END
+    FROM pg_class c CROSS JOIN LATERAL aclexplode(c.relacl) g
+    WHERE c.oid = to_regclass(quote_ident(:table)) AND g.grantee <> c.relowner"""
+
+
+class SQLServerDialect(MaskingDialect):
+    name = "sqlserver"
+    # The suffix of the name of the table valued function the masking SQL calls for a mask
+    TABLE_FUNCTION_SUFFIX: str = "_rows"
+
+    def quote(self, name: str) -> str:
+        return "[" + name.replace("]", "]]") + "]"
+
+    def masked_field_sql(self, quoted_field: str, mask_pattern: str) -> str:
+        if mask_pattern == 'name':  # For firstname/lastname - show last 2 chars
+            return f"CASE WHEN {quoted_field} IS NOT NULL THEN '***' + RIGHT({quoted_field}, 2) ELSE NULL END"
+        elif mask_pattern == 'phone':  # For phone - show last 4 chars
+            return f"CASE WHEN {quoted_field} IS NOT NULL THEN '***-***-' + RIGHT({quoted_field}, 4) ELSE NULL END"
+        elif mask_pattern == 'id':  # For IDs - show last 3 chars
+            return f"CASE WHEN {quoted_field} IS NOT NULL THEN '***' + RIGHT({quoted_field}, 3) ELSE NULL END"
+        elif mask_pattern == 'email':  # For email - complex masking
+            # Replaces the 4th character up to the first @ with '***@', finding the @ once. STUFF gives NULL for a
+            # NULL or negative length, so for no @ (-3) or one in the first 3 characters (-2 to 0, 0 made NULL)
+            return f"STUFF({quoted_field}, 4, NULLIF(CHARINDEX('@', {quoted_field}) - 3, 0), '***@')"
+        elif mask_pattern == 'initial':  # For free text - show the first char
+            return f"CASE WHEN {quoted_field} IS NOT NULL THEN LEFT({quoted_field}, 1) + '***' ELSE NULL END"
+        return super().masked_field_sql(quoted_field, mask_pattern)
+
+    def limit_sql(self, select_sql: str, limit_param: str) -> str:
+        return re.sub(r"^SELECT ", f"SELECT TOP (:{limit_param}) ", select_sql)
+
+    def hash_partition_sql(self, quoted_field: str, partitions: int) -> str:
+        # Mask off the sign bit rather than use ABS which overflows on the smallest integer
+        return f"(CHECKSUM({quoted_field}) & 2147483647) % {partitions}"
+
+    def row_hash_sql(self, quoted_values: list[str]) -> str:
+        values = ", ".join(f"COALESCE(CAST({v} AS VARCHAR(255)), '~null~')" for v in quoted_values)
+        return f"CONVERT(CHAR(32), HASHBYTES('MD5', CONCAT_WS(CHAR(31), {values})), 2)"
+
+    def upsert_sql(self, quoted_output_table: str, masked_select: str, key_col: str, value_cols: list[str]) -> str:
+        all_cols = ", ".join([key_col] + value_cols)
+        # EXCEPT compares NULLs as equal which a chain of <> would not
+        return f"""
+    MERGE INTO {quoted_output_table} AS t
+    USING ({masked_select}) AS s
+    ON t.{key_col} = s.{key_col}
+    WHEN MATCHED AND EXISTS (SELECT {", ".join(f"s.{c}" for c in value_cols)} EXCEPT SELECT {", ".join(f"t.{c}" for c in value_cols)})
+        THEN UPDATE SET {", ".join(f"t.{c} = s.{c}" for c in value_cols)}
+    WHEN NOT MATCHED BY TARGET
+        THEN INSERT ({all_cols}) VALUES ({", ".join(f"s.{c}" for c in [key_col] + value_cols)});"""
+
+    def bulk_insert_into_sql(self, quoted_table: str) -> str:
+        # A table lock lets an insert into a heap be minimally logged under the simple or bulk logged recovery models
+        return f"INSERT INTO {quoted_table} WITH (TABLOCK)"
+
+    def rename_table_sql(self, quoted_table: str, new_name: str) -> str:
+        return f"EXEC sp_rename '{quoted_table}', '{new_name}'"
+
+    def table_grants_sql(self) -> Optional[str]:
+        # Object level grants, with grant option when the state is W. DENYs aren't copied.
+        return """SELECT USER_NAME(p.grantee_principal_id), p.permission_name, CASE WHEN p.state = 'W' THEN 1 ELSE 0 END
+    FROM sys.database_permissions p
+    WHERE p.class = 1 AND p.minor_id = 0 AND p.major_id = OBJECT_ID(QUOTENAME(:table)) AND p.state IN ('G', 'W')"""
+
+    def mask_function_sql(self, function_name: str, mask_pattern: str) -> list[str]:
+        # Computed and persisted columns can only call scalar functions, which schema binding makes deterministic. The
+        # masking SQL calls an inline table valued function instead, which is expanded into the calling query like a
+        # view on every version, where a scalar function is only inlined from SQL Server 2019 and otherwise runs row
+        # by row and blocks parallel plans.
+        masked_field = self.masked_field_sql("@v", mask_pattern)
+        return [
+            f"""CREATE OR ALTER FUNCTION dbo.{function_name}(@v NVARCHAR(4000)) RETURNS NVARCHAR(4000)
+    WITH SCHEMABINDING
+    AS BEGIN RETURN {masked_field} END""",
+            f"""CREATE OR ALTER FUNCTION dbo.{function_name}{self.TABLE_FUNCTION_SUFFIX}(@v NVARCHAR(4000)) RETURNS TABLE
+    WITH SCHEMABINDING
+    AS RETURN SELECT {masked_field} AS v"""]
+
+    def mask_function_call_sql(self, function_name: str, quoted_field: str, alias: str) -> tuple[str, Optional[str]]:
+        return f"{alias}.v", f"CROSS APPLY dbo.{function_name}{self.TABLE_FUNCTION_SUFFIX}({quoted_field}) {alias}"
+
+
+class OracleDialect(MaskingDialect):
+    """Oracle 12c or later, for FETCH FIRST and STANDARD_HASH."""
+    name = "oracle"
+
+    def quote(self, name: str) -> str:
+        # Lower case names are left unquoted so they match the upper case names Oracle folds unquoted names to
+        return name if re.fullmatch(r"[a-z_][a-z0-9_$#]*", name) else super().quote(name)
+
+    def right_sql(self, quoted_field: str, length: int) -> str:
+        # SUBSTR with a negative start returns NULL for shorter strings so count from the front instead
+        return f"SUBSTR({quoted_field}, GREATEST(LENGTH({quoted_field}) - {length - 1}, 1))"
+
+    def masked_field_sql(self, quoted_field: str, mask_pattern: str) -> str:
+        if mask_pattern == 'initial':  # For free text - show the first char
+            return f"CASE WHEN {quoted_field} IS NOT NULL THEN SUBSTR({quoted_field}, 1, 1) || '***' ELSE NULL END"
+        return super().masked_field_sql(quoted_field, mask_pattern)
+
+    def masked_email_sql(self, quoted_field: str) -> str:
+        at = f"INSTR({quoted_field}, '@')"
+        second_at = f"INSTR({quoted_field}, '@', 1, 2)"
+        return f"""CASE
+                WHEN {quoted_field} IS NOT NULL AND {at} > 0
+                THEN SUBSTR({quoted_field}, 1, 3) || '***@' ||
+                     SUBSTR({quoted_field}, {at} + 1, CASE WHEN {second_at} > 0 THEN {second_at} - {at} - 1 ELSE LENGTH({quoted_field}) END)
+                ELSE NULL
+            END"""
+
+    def select_value_sql(self, expression: str) -> str:
+        return f"SELECT {expression} FROM DUAL"
+
+    def hash_partition_sql(self, quoted_field: str, partitions: int) -> str:
+        return f"ORA_HASH({quoted_field}, {partitions - 1})"
+
+    def row_hash_sql(self, quoted_values: list[str]) -> str:
+        return f"RAWTOHEX(STANDARD_HASH({self.joined_values_sql(quoted_values)}, 'MD5'))"
+
+    def upsert_sql(self, quoted_output_table: str, masked_select: str, key_col: str, value_cols: list[str]) -> str:
+        all_cols = ", ".join([key_col] + value_cols)
+        # Oracle has no AS for table aliases and DECODE is its NULL safe comparison
+        return f"""
+    MERGE INTO {quoted_output_table} t
+    USING ({masked_select}) s
+    ON (t.{key_col} = s.{key_col})
+    WHEN MATCHED THEN UPDATE SET {", ".join(f"t.{c} = s.{c}" for c in value_cols)}
+        WHERE {" OR ".join(f"DECODE(t.{c}, s.{c}, 0, 1) = 1" for c in value_cols)}
+    WHEN NOT MATCHED
+        THEN INSERT ({all_cols}) VALUES ({", ".join(f"s.{c}" for c in [key_col] + value_cols)})"""
+
+    def bulk_insert_into_sql(self, quoted_table: str) -> str:
+        # A direct path insert writes above the high water mark and skips undo for the new rows
+        return f"INSERT /*+ APPEND */ INTO {quoted_table}"
+
+    def table_grants_sql(self) -> Optional[str]:
+        # Names quote() leaves unquoted are stored in upper case
+        return """SELECT grantee, privilege, CASE WHEN grantable = 'YES' THEN 1 ELSE 0 END FROM user_tab_privs_made
+    WHERE table_name = CASE WHEN REGEXP_LIKE(:table, '^[a-z_][a-z0-9_$#]*$') THEN UPPER(:table) ELSE :table END"""
+
+
+class DB2Dialect(MaskingDialect):
+    """Db2 for LUW 11.1 or later, for HASH_MD5."""
+    name = "db2"
+
+    def quote(self, name: str) -> str:
+        # Lower case names are left unquoted so they match the upper case names Db2 folds unquoted names to
+        return name if re.fullmatch(r"[a-z_][a-z0-9_]*", name) else super().quote(name)
+
+    def right_sql(self, quoted_field: str, length: int) -> str:
+        # SUBSTRING, unlike SUBSTR, never pads with blanks or fails past the end of the value
+        return f"SUBSTRING({quoted_field}, MAX(CHARACTER_LENGTH({quoted_field}, CODEUNITS32) - {length - 1}, 1), CODEUNITS32)"
+
+    def masked_field_sql(self, quoted_field: str, mask_pattern: str) -> str:
+        if mask_pattern == 'initial':  # For free text - show the first char
+            return f"CASE WHEN {quoted_field} IS NOT NULL THEN SUBSTRING({quoted_field}, 1, 1, CODEUNITS32) || '***' ELSE NULL END"
+        return super().masked_field_sql(quoted_field, mask_pattern)
+
+    def masked_email_sql(self, quoted_field: str) -> str:
+        at = f"LOCATE_IN_STRING({quoted_field}, '@', 1, 1, CODEUNITS32)"
+        second_at = f"LOCATE_IN_STRING({quoted_field}, '@', 1, 2, CODEUNITS32)"
+        return f"""CASE
+                WHEN {quoted_field} IS NOT NULL AND {at} > 0
+                THEN SUBSTRING({quoted_field}, 1, 3, CODEUNITS32) || '***@' ||
+                     CASE WHEN {second_at} > 0
+                          THEN SUBSTRING({quoted_field}, {at} + 1, {second_at} - {at} - 1, CODEUNITS32)
+                          ELSE SUBSTRING({quoted_field}, {at} + 1, CODEUNITS32) END
+                ELSE NULL
+            END"""
+
+    def select_value_sql(self, expression: str) -> str:
+        return f"SELECT {expression} FROM SYSIBM.SYSDUMMY1"
+
+    def row_hash_sql(self, quoted_values: list[str]) -> str:
+        return f"HEX(HASH_MD5({self.joined_values_sql(quoted_values)}))"
+
+    def rename_table_sql(self, quoted_table: str, new_name: str) -> str:
+        return f"RENAME TABLE {quoted_table} TO {self.quote(new_name)}"
+
+    def table_grants_sql(self) -> Optional[str]:
+        # A row per privilege column of TABAUTH, G is grantable. The creator's own CONTROL comes with the new table.
+        privileges = [("ALTER", "ALTERAUTH"), ("DELETE", "DELETEAUTH"), ("INDEX", "INDEXAUTH"), ("INSERT", "INSERTAUTH"),
+                      ("REFERENCES", "REFAUTH"), ("SELECT", "SELECTAUTH"), ("UPDATE", "UPDATEAUTH")]
+        table_name = "CASE WHEN REGEXP_LIKE(:table, '^[a-z_][a-z0-9_]*$') THEN UPPER(:table) ELSE :table END"
+        return "\n    UNION ALL ".join(
+            f"SELECT GRANTEE, '{privilege}', CASE WHEN {column} = 'G' THEN 1 ELSE 0 END FROM SYSCAT.TABAUTH "
+            f"WHERE TABSCHEMA = CURRENT SCHEMA AND TABNAME = {table_name} AND GRANTEE <> SESSION_USER AND {column} <> 'N'"
+            for privilege, column in privileges)
+
+
+class SQLiteDialect(MaskingDialect):
+    """SQLite 3.39 or later, for IS DISTINCT FROM. This is a stand in database for benchmarks and local testing.
+    SQLite has no hash functions so it can't do hash partitioning or row hashing."""
+    name = "sqlite"
+
+    def right_sql(self, quoted_field: str, length: int) -> str:
+        return f"SUBSTR({quoted_field}, MAX(LENGTH({quoted_field}) - {length - 1}, 1))"
+
+    def masked_email_sql(self, quoted_field: str) -> str:
+        after_at = f"SUBSTR({quoted_field}, INSTR({quoted_field}, '@') + 1)"
+        return f"""CASE
+                WHEN {quoted_field} IS NOT NULL AND INSTR({quoted_field}, '@') > 0
+                THEN SUBSTR({quoted_field}, 1, 3) || '***@' ||
+                     CASE WHEN INSTR({after_at}, '@') > 0 THEN SUBSTR({after_at}, 1, INSTR({after_at}, '@') - 1) ELSE {after_at} END
+                ELSE NULL
+            END"""
+
+    def limit_sql(self, select_sql: str, limit_param: str) -> str:
+        return f"{select_sql} LIMIT :{limit_param}"
+
+    def row_hash_sql(self, quoted_values: list[str]) -> str:
+        raise ValueError("Row hashing isn't supported on sqlite")
+
+    def upsert_sql(self, quoted_output_table: str, masked_select: str, key_col: str, value_cols: list[str]) -> str:
+        # SQLite needs a WHERE before ON CONFLICT to parse an upsert from a SELECT
+        return PostgresDialect().upsert_sql(quoted_output_table, f"SELECT * FROM ({masked_select}) WHERE true", key_col, value_cols)
+
+    def add_primary_key_sql(self, quoted_table: str, quoted_name: str, quoted_cols: list[str]) -> str:
+        # SQLite can't add constraints to an existing table, a unique index enforces the same thing
+        return f"CREATE UNIQUE INDEX {quoted_name} ON {quoted_table} ({', '.join(quoted_cols)})"
+
+    def table_grants_sql(self) -> Optional[str]:
+        return None
+
+
+DIALECTS: dict[str, MaskingDialect] = {d.name: d for d in [PostgresDialect(), SQLServerDialect(), OracleDialect(), DB2Dialect(), SQLiteDialect()]}
+
+
+def get_dialect(db_type: str) -> MaskingDialect:
+    """Return the dialect for a database type returned by get_database_type."""
+    dialect = DIALECTS.get(db_type)
+    if dialect is None:
+        raise ValueError(f"Unsupported database type '{db_type}'")
+    return dialect
+
+
+def get_database_type(conn: Connection) -> str:
+    """Detect the database type from the connection."""
+    dialect_name = conn.dialect.name.lower()
+    if 'postgresql' in dialect_name or 'postgres' in dialect_name:
+        return 'postgresql'
+    elif 'mssql' in dialect_name or 'sqlserver' in dialect_name:
+        return 'sqlserver'
+    elif 'oracle' in dialect_name:
+        return 'oracle'
+    elif 'db2' in dialect_name or 'ibm_db' in dialect_name:
+        return 'db2'
+    elif 'sqlite' in dialect_name:
+        return 'sqlite'
+    else:
+        # Default to PostgreSQL syntax
+        print(f"Warning: no masking dialect for {dialect_name}, using PostgreSQL syntax. DT_ENGINE=stream masks client side instead")
+        return 'postgresql'
@@ -0,0 +1,60 @@
+"""
+// Copyright (c) William Newport
+// SPDX-License-Identifier: BUSL-1.1
+
+Run the data transformers in this repository outside the Yellow platform. The platform gives a transformer a
+DataTransformerContext which maps datasets to the tables it reads and writes. LocalTransformerContext does the same
+from fixed mappings so a transformer can be run against any database, for example by benchmarks or a developer.
+"""
+
+from typing import Optional
+from sqlalchemy import Column, Date, Engine, MetaData, String, Table, create_engine, event
+from datasurface.md import DDLTable, NullableStatus, PrimaryKeyStatus
+
+
+class LocalTransformerContext:
+    """A stand in for the platform's DataTransformerContext with fixed table names for the input and output datasets."""
+
+    def __init__(self, input_tables: dict[tuple[str, str, str], str], output_tables: dict[str, str]) -> None:
+        self.input_tables: dict[tuple[str, str, str], str] = input_tables
+        """Table names by (dataset group sink name, store name, dataset name)"""
+        self.output_tables: dict[str, str] = output_tables
+        """Table names by output dataset name"""
+
+    def getInputTableNameForDataset(self, dsgName: str, storeName: str, datasetName: str) -> str:
+        return self.input_tables[(dsgName, storeName, datasetName)]
+
+    def getOutputTableNameForDataset(self, datasetName: str) -> str:
+        return self.output_tables[datasetName]
+
+    def __str__(self) -> str:
+        return f"LocalTransformerContext({self.input_tables}, {self.output_tables})"
+
+
+def create_local_engine(url: str) -> Engine:
+    """Create an engine for a local database. SQLite databases use WAL journaling and wait for locks so the
+    parallel and stream engines, which use several connections, work against them."""
+    if not url.startswith("sqlite"):
+        return create_engine(url)
+    engine = create_engine(url, connect_args={"timeout": 600})
+
+    @event.listens_for(engine, "connect")
+    def set_journal_mode(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+    return engine
+
+
+def create_table_for_schema(engine: Engine, table_name: str, schema: DDLTable, extra_columns: Optional[list[Column]] = None) -> Table:
+    """Create, replacing any existing one, a table for a dataset schema. Strings are sized VARCHARs and dates are
+    DATEs, other types are stored as strings."""
+    columns: list[Column] = []
+    for c in schema.columns.values():
+        max_size: Optional[int] = getattr(c.type, "maxSize", None)
+        col_type = Date() if type(c.type).__name__ == "Date" else String(max_size if max_size is not None else 100)
+        columns.append(Column(c.name, col_type, primary_key=c.primaryKey == PrimaryKeyStatus.PK, nullable=c.nullable != NullableStatus.NOT_NULLABLE))
+    table = Table(table_name, MetaData(), *columns, *(extra_columns or []))
+    table.drop(engine, checkfirst=True)
+    table.create(engine)
+    return table
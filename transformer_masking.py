@@ -0,0 +1,958 @@
+"""
+// Copyright (c) William Newport
+// SPDX-License-Identifier: BUSL-1.1
+
+The masking done by the MaskedCustomerGenerator data transformer. The platform calls the executeTransformer entry
+point in transformer.py, which runs the masking here, in the platform's job or on a long lived transformer_worker.py.
+"""
+
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from typing import Callable, Optional
+from sqlalchemy import Column, Connection, Engine, Index, MetaData, String, Table, inspect, text
+from datasurface.md import DDLColumn, DDLTable, PrimaryKeyStatus
+from datasurface.platforms.yellow.transformer_context import DataTransformerContext
+from team1 import createAddressesSchema, createCustomerAddressesSchema, createCustomersSchema
+from transformer_dialects import BATCH_ID_COLUMN, get_database_type, get_dialect
+from transformer_metrics import estimate_row_bytes, phase, start_run
+from transformer_state import clearState, ensureStateTable, getState, setState
+from transformer_stream import stream_masked_rows
+
+TRANSFORMER_NAME: str = "MaskedCustomerGenerator"
+
+# The masks get_masked_field_sql knows how to generate
+MASK_PATTERNS: set[str] = {'name', 'phone', 'id', 'email', 'initial', 'redact'}
+
+# Masks applied to columns by name. Columns without a rule are copied as they are.
+COLUMN_MASK_RULES: dict[str, str] = {
+    'firstname': 'name',
+    'lastname': 'name',
+    'email': 'email',
+    'phone': 'phone',
+    'primaryaddressid': 'id',
+    'billingaddressid': 'id',
+    'streetname': 'redact',
+    'zipcode': 'initial'
+}
+
+# Masks applied to columns by the type of their data classification when no column rule applies
+CLASSIFICATION_MASK_RULES: dict[str, str] = {}
+
+
+def quote_field_name(field_name: str, db_type: str) -> str:
+    """Quote field names appropriately for the database type."""
+    return get_dialect(db_type).quote(field_name)
+
+
+def quote_table_name(table_name: str, db_type: str) -> str:
+    """Quote table names appropriately for the database type."""
+    return get_dialect(db_type).quote(table_name)
+
+
+def get_masked_field_sql(field_name: str, mask_pattern: str, db_type: str) -> str:
+    """Generate database-specific SQL for masking a field."""
+    return get_dialect(db_type).masked_field_sql(quote_field_name(field_name, db_type), mask_pattern)
+
+
+def get_hint_option(name: str, default: str) -> str:
+    """Return an option from the transformer's K8sDataTransformerHint kv map. The platform passes the kv
+    entries to the transformer job as environment variables."""
+    return os.environ.get(name, default)
+
+
+@dataclass
+class TransformerOptions:
+    """How a transformer run does its work, read from the K8sDataTransformerHint kv options."""
+    mode: str = "full"
+    """DT_MODE: 'full' masks every customer, 'incremental' only the customers changed since the last run and
+    'rowhash' only the customers whose source columns hash differently to the last run. The platform truncates the
+    outputs before every run, so the last two keep the masked rows in a masked copy of each output, see
+    get_masked_copy_table_name, and copy all of it into the output once the changes are applied. That copy is every
+    row each run, what they save is masking and reading the unchanged source rows."""
+    chunk_size: int = 0
+    """DT_CHUNK_SIZE: if set, full rebuilds commit resumable chunks of this many ids into the masked copy of each output,
+    committing the platform's truncation of the outputs with the first of them"""
+    parallelism: int = 1
+    """DT_PARALLELISM: if above 1, full rebuilds run this many partitions concurrently into the masked copy of each
+    output, or the staging table of a swap, committing the platform's truncation of the outputs first"""
+    partitioning: str = "hash"
+    """DT_PARTITIONING: 'hash' or 'range' partitioning of the ids for parallel rebuilds"""
+    output: str = "insert"
+    """DT_OUTPUT: 'insert' appends masked rows, 'upsert' updates only the rows of the masked copy of each output whose
+    masked values changed, the copy then being copied into the truncated output, and 'swap' builds the masked rows in
+    a staging table which then replaces the output table"""
+    engine: str = "sql"
+    """DT_ENGINE: 'sql' masks in the database, 'stream' masks client side for databases which can't run the masking SQL"""
+    batch_size: int = 10000
+    """DT_BATCH_SIZE: rows per batch streamed by the 'stream' engine"""
+    metrics_file: str = ""
+    """DT_METRICS_FILE: if set, the Prometheus text file the run metrics are written to"""
+    trigger_interval_seconds: float = 60.0
+    """DT_TRIGGER_INTERVAL_SECONDS: the interval between trigger firings, run times are reported as a fraction of it"""
+    skip_unchanged: bool = False
+    """DT_SKIP_UNCHANGED: if true, the masked rows are kept in the masked copy of each output and a run whose inputs have
+    not changed since the last successful run masks nothing, it only copies them into the truncated outputs. Off by
+    default as the check costs a COUNT and MAX over every input table each run, see get_input_fingerprint."""
+    mask_functions: bool = False
+    """DT_MASK_FUNCTIONS: if true, the masks are installed as versioned functions in the database the first time they are
+    needed and the masking SQL calls them rather than repeating their CASE expressions. Postgres and SQL Server only.
+    Each mask's function is deterministic so computed columns can call it too, on SQL Server the masking SQL calls an
+    inline table valued version of it instead, see SQLServerDialect.mask_function_sql. Off by default until the
+    benchmark's mask_functions mode has been compared to inline CASE SQL on Postgres and SQL Server."""
+
+    @property
+    def keeps_masked_copy(self) -> bool:
+        """Whether the masked rows are built in the masked copy of each output and then copied into the output."""
+        return self.mode != "full" or self.output == "upsert" or self.chunk_size > 0 or (self.parallelism > 1 and self.output != "swap") or \
+            self.skip_unchanged
+
+    @staticmethod
+    def from_hints() -> 'TransformerOptions':
+        options = TransformerOptions(
+            mode=get_hint_option("DT_MODE", "full"),
+            chunk_size=int(get_hint_option("DT_CHUNK_SIZE", "0")),
+            parallelism=int(get_hint_option("DT_PARALLELISM", "1")),
+            partitioning=get_hint_option("DT_PARTITIONING", "hash"),
+            output=get_hint_option("DT_OUTPUT", "insert"),
+            engine=get_hint_option("DT_ENGINE", "sql"),
+            batch_size=int(get_hint_option("DT_BATCH_SIZE", "10000")),
+            metrics_file=get_hint_option("DT_METRICS_FILE", ""),
+            trigger_interval_seconds=float(get_hint_option("DT_TRIGGER_INTERVAL_SECONDS", "60")),
+            skip_unchanged=get_hint_option("DT_SKIP_UNCHANGED", "false").lower() == "true",
+            mask_functions=get_hint_option("DT_MASK_FUNCTIONS", "false").lower() == "true"
+        )
+        if options.mode not in ("full", "incremental", "rowhash"):
+            raise ValueError(f"Unknown transformer mode '{options.mode}'")
+        if options.partitioning not in ("hash", "range"):
+            raise ValueError(f"Unknown partitioning '{options.partitioning}'")
+        if options.output not in ("insert", "upsert", "swap"):
+            raise ValueError(f"Unknown output mode '{options.output}'")
+        if options.chunk_size > 0 and options.parallelism > 1:
+            raise ValueError("DT_CHUNK_SIZE and DT_PARALLELISM cannot be used together")
+        if options.engine not in ("sql", "stream"):
+            raise ValueError(f"Unknown engine '{options.engine}'")
+        if options.output == "swap" and (options.mode != "full" or options.chunk_size > 0 or options.skip_unchanged):
+            raise ValueError("The swap output mode only does unchunked full rebuilds and can't skip unchanged runs")
+        if options.engine == "stream" and (options.mode != "full" or options.output == "upsert" or options.chunk_size > 0 or options.parallelism > 1):
+            raise ValueError("The stream engine only does full rebuilds with the insert or swap output modes")
+        return options
+
+
+def register_mask_rule(mask_pattern: str, columns: Optional[list[str]] = None, classifications: Optional[list[str]] = None) -> None:
+    """Mask the named columns, and columns with the named data classification types, with mask_pattern in every
+    masked dataset. Masking compiled before the rule was registered is discarded so the next run uses it."""
+    if mask_pattern not in MASK_PATTERNS:
+        raise ValueError(f"Unknown mask pattern '{mask_pattern}'")
+    for c in columns or []:
+        COLUMN_MASK_RULES[c] = mask_pattern
+    for dc in classifications or []:
+        CLASSIFICATION_MASK_RULES[dc] = mask_pattern
+    clear_compiled_masking()
+
+
+def get_column_mask(column: DDLColumn) -> Optional[str]:
+    """Return the mask for a column or None if it is copied unmasked."""
+    mask = COLUMN_MASK_RULES.get(column.name)
+    if mask is None and CLASSIFICATION_MASK_RULES and column.classifications:
+        for dc in column.classifications:
+            mask = CLASSIFICATION_MASK_RULES.get(dc.dcType.name)
+            if mask is not None:
+                break
+    return mask
+
+
+def get_schema_version(schema: DDLTable) -> str:
+    """A short hash of the column names, types and keys of a schema. It changes whenever the schema does."""
+    desc = "|".join(f"{c.name}:{c.type}:{c.primaryKey == PrimaryKeyStatus.PK}" for c in schema.columns.values())
+    return hashlib.sha256(desc.encode()).hexdigest()[:16]
+
+
+@dataclass(frozen=True)
+class CompiledMasking:
+    """The masking select list for a dataset schema in one dialect."""
+    key_column: str
+    columns: tuple[str, ...]
+    masks: tuple[Optional[str], ...]
+    select_list: str
+    apply_sql: str = ""
+    """Joins after the source the select list reads masked values from, the CROSS APPLYs of table valued mask functions"""
+
+    @property
+    def value_columns(self) -> tuple[str, ...]:
+        """The non key columns. These are the source columns read by the masking."""
+        return tuple(c for c in self.columns if c != self.key_column)
+
+
+# Compiled masking by (dialect, schema version, whether the masks are function calls)
+_compiled_masking: dict[tuple[str, str, bool], CompiledMasking] = {}
+
+# The state table scope recording the masking functions installed in the database
+MASK_FUNCTIONS_SCOPE: str = "dt_mask_functions"
+
+
+@lru_cache(maxsize=None)
+def get_mask_function_name(mask_pattern: str, db_type: str) -> str:
+    """The name of the function applying a mask. It ends with a hash of the function's definition so a changed mask
+    is a new function, which runs still using the old definition are unaffected by."""
+    definition = "\n".join(get_dialect(db_type).mask_function_sql("ds_mask", mask_pattern))
+    return f"ds_mask_{mask_pattern}_{hashlib.sha256(definition.encode()).hexdigest()[:12]}"
+
+
+def compile_masking(schema: DDLTable, db_type: str, mask_functions: bool = False) -> CompiledMasking:
+    """Compile the masking select list for a schema from the mask rules, reusing an earlier compilation of the same
+    schema version for the dialect. With mask_functions the masks call the functions install_mask_functions creates."""
+    cache_key = (db_type, get_schema_version(schema), mask_functions)
+    compiled = _compiled_masking.get(cache_key)
+    if compiled is None:
+        key_columns = [c.name for c in schema.columns.values() if c.primaryKey == PrimaryKeyStatus.PK]
+        if len(key_columns) != 1:
+            raise ValueError(f"Masked datasets need a single primary key column, not {key_columns}")
+        masks = tuple(None if column.name == key_columns[0] else get_column_mask(column) for column in schema.columns.values())
+        expressions: list[str] = []
+        applies: list[str] = []
+        for index, (column, mask) in enumerate(zip(schema.columns.values(), masks)):
+            quoted_col = quote_field_name(column.name, db_type)
+            if mask is None:
+                # Qualified where mask functions may join columns named v of their own
+                expressions.append(f"s.{quoted_col} as {quoted_col}" if mask_functions else quoted_col)
+            elif mask_functions:
+                call_sql, apply_sql = get_dialect(db_type).mask_function_call_sql(get_mask_function_name(mask, db_type), f"s.{quoted_col}", f"m{index}")
+                expressions.append(f"{call_sql} as {quoted_col}")
+                if apply_sql is not None:
+                    applies.append(apply_sql)
+            else:
+                expressions.append(f"{get_masked_field_sql(column.name, mask, db_type)} as {quoted_col}")
+        compiled = CompiledMasking(
+            key_columns[0], tuple(schema.columns.keys()), masks, ",\n        ".join(expressions), "".join(f"\n    {a}" for a in applies))
+        _compiled_masking[cache_key] = compiled
+    return compiled
+
+
+def get_masking_version(masking: CompiledMasking) -> str:
+    """A short hash of the masking SQL. It changes whenever the mask rules, the schema or the mask functions change
+    what the masking writes."""
+    return hashlib.sha256(f"{masking.select_list}|{masking.apply_sql}".encode()).hexdigest()[:16]
+
+
+@lru_cache(maxsize=None)
+def get_customers_schema() -> DDLTable:
+    """The schema of the masked customers dataset."""
+    return createCustomersSchema()
+
+
+@lru_cache(maxsize=None)
+def get_customer_masking(db_type: str, mask_functions: bool = False) -> CompiledMasking:
+    """The compiled masking for the customers dataset."""
+    return compile_masking(get_customers_schema(), db_type, mask_functions)
+
+
+def get_addresses_source_sql(input_tables: dict[str, str], db_type: str, batch_id: bool) -> str:
+    """The addresses are masked straight from their input table."""
+    return quote_table_name(input_tables["addresses"], db_type)
+
+
+def get_customer_addresses_source_sql(input_tables: dict[str, str], db_type: str, batch_id: bool) -> str:
+    """A subquery joining each customer to its primary address, the columns are those of the customeraddresses schema.
+    With batch_id it also has the BATCH_ID_COLUMN of whichever of the customer and its address changed last. That is
+    NULL when the primary address has gone so incremental runs mask the customer again until it is back."""
+    customer_columns = createCustomersSchema().columns
+    columns = ", ".join(
+        f"{'c' if name in customer_columns else 'a'}.{quote_field_name(name, db_type)}" for name in createCustomerAddressesSchema().columns)
+    id_col = quote_field_name('id', db_type)
+    address_col = quote_field_name('primaryaddressid', db_type)
+    if batch_id:
+        batch_col = quote_field_name(BATCH_ID_COLUMN, db_type)
+        columns += (
+            f", CASE WHEN c.{address_col} IS NOT NULL AND a.{id_col} IS NULL THEN NULL "
+            f"WHEN a.{batch_col} > c.{batch_col} THEN a.{batch_col} ELSE c.{batch_col} END AS {batch_col}")
+    return (
+        f"(SELECT {columns} FROM {quote_table_name(input_tables['customers'], db_type)} c "
+        f"LEFT JOIN {quote_table_name(input_tables['addresses'], db_type)} a ON a.{id_col} = c.{address_col})")
+
+
+@dataclass(frozen=True)
+class DerivedDataset:
+    """An output dataset, other than the customers, masked from Store1 datasets in the same way as the customers."""
+    name: str
+    inputs: tuple[str, ...]
+    """The Store1 datasets it is built from"""
+    create_schema: Callable[[], DDLTable]
+    source_sql: Callable[[dict[str, str], str, bool], str]
+    """Builds the quoted table or parenthesized subquery masked into the dataset from the input table names by dataset,
+    the database type and whether it needs a BATCH_ID_COLUMN for incremental runs"""
+
+
+DERIVED_DATASETS: list[DerivedDataset] = [
+    DerivedDataset("addresses", ("addresses",), createAddressesSchema, get_addresses_source_sql),
+    DerivedDataset("customeraddresses", ("customers", "addresses"), createCustomerAddressesSchema, get_customer_addresses_source_sql)
+]
+
+
+@lru_cache(maxsize=None)
+def get_derived_masking(dataset: DerivedDataset, db_type: str, mask_functions: bool = False) -> CompiledMasking:
+    """The compiled masking for a derived dataset."""
+    return compile_masking(dataset.create_schema(), db_type, mask_functions)
+
+
+@dataclass
+class MaskedSource:
+    """A dataset masked by a run, the rows of its source masked into its output table."""
+    name: str
+    schema: DDLTable
+    masking: CompiledMasking
+    source_sql: str
+    """A quoted table or parenthesized subquery, which every statement gives the alias s"""
+    input_tables: tuple[str, ...]
+    """The tables read by the source, the highest batch id in them is the position of an incremental run"""
+    output_table: str
+    batch_id: bool
+    """Whether the source has a BATCH_ID_COLUMN, without one incremental runs are full rebuilds"""
+
+
+def get_masked_sources(
+        input_tables: dict[str, str], output_tables: dict[str, str], db_type: str, mask_functions: bool, batch_ids: dict[str, bool]) -> list[MaskedSource]:
+    """The customers and then each derived dataset. input_tables and batch_ids, whether each input table has a
+    BATCH_ID_COLUMN, are by Store1 dataset and output_tables by output dataset."""
+    sources = [MaskedSource(
+        "customers", get_customers_schema(), get_customer_masking(db_type, mask_functions), quote_table_name(input_tables["customers"], db_type),
+        (input_tables["customers"],), output_tables["customers"], batch_ids.get("customers", False))]
+    for d in DERIVED_DATASETS:
+        batch_id = all(batch_ids.get(i, False) for i in d.inputs)
+        sources.append(MaskedSource(
+            d.name, d.create_schema(), get_derived_masking(d, db_type, mask_functions), d.source_sql(input_tables, db_type, batch_id),
+            tuple(input_tables[i] for i in d.inputs), output_tables[d.name], batch_id))
+    return sources
+
+
+@lru_cache(maxsize=None)
+def get_masked_select_sql(masking: CompiledMasking, from_sql: str, where: Optional[str] = None) -> str:
+    """Generate the SELECT which masks the rows of a quoted table or parenthesized subquery, optionally restricted by a
+    WHERE predicate."""
+    select_query = f"""
+    SELECT
+        {masking.select_list}
+    FROM {from_sql} s{masking.apply_sql}
+    """
+    if where is not None:
+        select_query += f"WHERE {where}\n"
+    return select_query
+
+
+@lru_cache(maxsize=None)
+def get_masked_insert_sql(masking: CompiledMasking, from_sql: str, output_table: str, db_type: str, where: Optional[str] = None, bulk: bool = False) -> str:
+    """Generate the INSERT...SELECT which writes masked rows to the output table. A bulk insert is for a new output
+    table with no indexes and asks for minimal logging."""
+    columns = ", ".join(quote_field_name(c, db_type) for c in masking.columns)
+    quoted_output_table = quote_table_name(output_table, db_type)
+    insert_into = get_dialect(db_type).bulk_insert_into_sql(quoted_output_table) if bulk else f"INSERT INTO {quoted_output_table}"
+    return f"""
+    {insert_into}
+    ({columns})
+    {get_masked_select_sql(masking, from_sql, where)}"""
+
+
+@lru_cache(maxsize=None)
+def get_masked_upsert_sql(masking: CompiledMasking, from_sql: str, output_table: str, db_type: str, where: Optional[str] = None) -> str:
+    """Generate the upsert of masked rows into the output table. New rows are inserted and existing ones are only
+    updated when a masked value differs, so unchanged output rows are not rewritten."""
+    quoted_output_table = quote_table_name(output_table, db_type)
+    id_col = quote_field_name(masking.key_column, db_type)
+    value_cols = [quote_field_name(c, db_type) for c in masking.value_columns]
+    return get_dialect(db_type).upsert_sql(quoted_output_table, get_masked_select_sql(masking, from_sql, where), id_col, value_cols)
+
+
+@lru_cache(maxsize=None)
+def get_masked_write_sql(masking: CompiledMasking, from_sql: str, output_table: str, db_type: str, output_mode: str, where: Optional[str] = None) -> str:
+    """Generate the statement which writes masked rows for the 'insert', 'upsert' or 'swap' output mode. The swap
+    output mode writes to a new staging table."""
+    if output_mode == "upsert":
+        return get_masked_upsert_sql(masking, from_sql, output_table, db_type, where)
+    return get_masked_insert_sql(masking, from_sql, output_table, db_type, where, output_mode == "swap")
+
+
+@lru_cache(maxsize=None)
+def get_masked_customer_select_sql(source_table: str, db_type: str, where: Optional[str] = None) -> str:
+    """Generate the SELECT which masks the customers in the source table, optionally restricted by a WHERE predicate."""
+    return get_masked_select_sql(get_customer_masking(db_type), quote_table_name(source_table, db_type), where)
+
+
+@lru_cache(maxsize=None)
+def get_masked_customer_insert_sql(source_table: str, output_table: str, db_type: str, where: Optional[str] = None, bulk: bool = False) -> str:
+    """Generate the INSERT...SELECT which writes masked customers from the source table to the output table."""
+    return get_masked_insert_sql(get_customer_masking(db_type), quote_table_name(source_table, db_type), output_table, db_type, where, bulk)
+
+
+@lru_cache(maxsize=None)
+def get_masked_customer_upsert_sql(source_table: str, output_table: str, db_type: str, where: Optional[str] = None) -> str:
+    """Generate the upsert of masked customers from the source table into the output table."""
+    return get_masked_upsert_sql(get_customer_masking(db_type), quote_table_name(source_table, db_type), output_table, db_type, where)
+
+
+@lru_cache(maxsize=None)
+def get_masked_customer_write_sql(
+        source_table: str, output_table: str, db_type: str, output_mode: str, where: Optional[str] = None, mask_functions: bool = False) -> str:
+    """Generate the statement which writes masked customers from the source table for the output mode."""
+    return get_masked_write_sql(
+        get_customer_masking(db_type, mask_functions), quote_table_name(source_table, db_type), output_table, db_type, output_mode, where)
+
+
+def clear_compiled_masking() -> None:
+    """Discard the compiled masking and the SQL generated from it, for when the mask rules change."""
+    _compiled_masking.clear()
+    for cached in (get_customer_masking, get_derived_masking, get_masked_select_sql, get_masked_insert_sql, get_masked_upsert_sql,
+                   get_masked_write_sql, get_masked_customer_select_sql, get_masked_customer_insert_sql, get_masked_customer_upsert_sql,
+                   get_masked_customer_write_sql):
+        cached.cache_clear()
+
+
+def delete_missing_rows(conn: Connection, source: MaskedSource, output_table: str, db_type: str) -> int:
+    """Delete output rows whose key is no longer in the source. Returns the number deleted."""
+    quoted_output_table = quote_table_name(output_table, db_type)
+    key_col = quote_field_name(source.masking.key_column, db_type)
+    return conn.execute(text(
+        f"DELETE FROM {quoted_output_table} WHERE NOT EXISTS "
+        f"(SELECT 1 FROM {source.source_sql} s WHERE s.{key_col} = {quoted_output_table}.{key_col})")).rowcount
+
+
+def table_has_column(conn: Connection, table_name: str, column_name: str) -> bool:
+    """Check whether a table has a column, ignoring case."""
+    return any(c["name"].lower() == column_name.lower() for c in inspect(conn).get_columns(table_name))
+
+
+def is_table_empty(conn: Connection, table_name: str, db_type: str) -> bool:
+    """Check whether a table has no rows without counting them."""
+    quoted_table = quote_table_name(table_name, db_type)
+    return conn.execute(text(get_dialect(db_type).select_value_sql(f"CASE WHEN EXISTS (SELECT 1 FROM {quoted_table}) THEN 0 ELSE 1 END"))).scalar() == 1
+
+
+def get_input_fingerprint(conn: Connection, input_tables: list[str], db_type: str, masking_version: str) -> Optional[str]:
+    """A hash of the row count and highest batch id of each input table and of the masking version. Every ingested
+    insert or update gets a new batch id and deletes change the count so it changes whenever an input does. Returns
+    None, so the run is never skipped, if an input has no batch id column.
+
+    It is not free: the batch id column is not indexed by the platform so each input is read in full, a scan of every
+    row per run, although a much cheaper one than masking them. Enable it where runs are frequent and inputs mostly
+    idle."""
+    parts: list[str] = [masking_version]
+    batch_col = quote_field_name(BATCH_ID_COLUMN, db_type)
+    for table in sorted(set(input_tables)):
+        if not table_has_column(conn, table, BATCH_ID_COLUMN):
+            return None
+        row_count, max_batch = conn.execute(text(f"SELECT COUNT(*), MAX({batch_col}) FROM {quote_table_name(table, db_type)}")).one()
+        parts.append(f"{table}:{row_count}:{max_batch}")
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+
+def install_mask_functions(conn: Connection, db_type: str, maskings: list[CompiledMasking]) -> None:
+    """Create the masking functions the compiled maskings call. The functions installed are recorded in the state
+    table so they are only created once per database, later runs just call them."""
+    names: dict[str, str] = {get_mask_function_name(m, db_type): m for masking in maskings for m in masking.masks if m is not None}
+    installed = ",".join(sorted(names))
+    ensureStateTable(conn)
+    if getState(conn, MASK_FUNCTIONS_SCOPE, db_type) == installed:
+        return
+    dialect = get_dialect(db_type)
+    for name, mask in sorted(names.items()):
+        for statement in dialect.mask_function_sql(name, mask):
+            conn.execute(text(statement))
+    setState(conn, MASK_FUNCTIONS_SCOPE, db_type, installed)
+    print(f"Installed masking functions {installed}")
+
+
+@lru_cache(maxsize=None)
+def get_next_chunk_bound_sql(source_sql: str, key_column: str, db_type: str, first_chunk: bool) -> str:
+    """Generate the query for the highest key in the next chunk of :chunkSize keys above :lowKey."""
+    key_col = quote_field_name(key_column, db_type)
+    where = "" if first_chunk else f"WHERE s.{key_col} > :lowKey "
+    inner = get_dialect(db_type).limit_sql(f"SELECT s.{key_col} FROM {source_sql} s {where}ORDER BY s.{key_col}", "chunkSize")
+    return f"SELECT MAX(c.{key_col}) FROM ({inner}) c"
+
+
+def execute_chunked_rebuild(conn: Connection, source: MaskedSource, write_table: str, db_type: str, clear_output: bool, options: TransformerOptions) -> int:
+    """Mask every source row in key ranges of options.chunk_size rows, committing each range with a checkpoint of the last key done.
+
+    A run which finds a checkpoint resumes after it rather than starting again. The write table is the masked copy of
+    the output, which the platform doesn't truncate, so the rows a checkpoint vouches for survive a failed run. The
+    checkpoint is ignored if the copy is empty all the same. The chunks are committed on the caller's connection, so
+    the first commit also commits what the caller has pending, the platform's truncation of the outputs included, and
+    consumers see the outputs empty until the run's final commit. Returns the number of rows written."""
+    chunk_size: int = options.chunk_size
+    key_column = source.masking.key_column
+    key_col = quote_field_name(key_column, db_type)
+    row_count = 0
+    chunk_count = 0
+    ensureStateTable(conn)
+    checkpoint: Optional[str] = getState(conn, write_table, "chunkCheckpoint")
+    if checkpoint is not None and is_table_empty(conn, write_table, db_type):
+        checkpoint = None
+    if checkpoint is None:
+        if clear_output:
+            conn.execute(text(f"DELETE FROM {quote_table_name(write_table, db_type)}"))
+    else:
+        print(f"Resuming masking of {write_table} after key {checkpoint}")
+
+    while True:
+        params: dict[str, object] = {"chunkSize": chunk_size}
+        if checkpoint is not None:
+            params["lowKey"] = checkpoint
+        high_key: Optional[str] = conn.execute(
+            text(get_next_chunk_bound_sql(source.source_sql, key_column, db_type, checkpoint is None)), params).scalar()
+        if high_key is None:
+            break
+        params["highKey"] = high_key
+        where = f"{key_col} <= :highKey" if checkpoint is None else f"{key_col} > :lowKey AND {key_col} <= :highKey"
+        write_sql = get_masked_write_sql(source.masking, source.source_sql, write_table, db_type, options.output, where)
+        row_count += conn.execute(text(write_sql), params).rowcount
+        setState(conn, write_table, "chunkCheckpoint", high_key)
+        with phase("commit"):
+            conn.commit()
+        checkpoint = high_key
+        chunk_count += 1
+    clearState(conn, write_table, "chunkCheckpoint")
+    print(f"Masked {row_count} {source.name} records in {chunk_count} chunks of up to {chunk_size}")
+    return row_count
+
+
+@dataclass
+class PartitionTiming:
+    """How long one partition of a parallel rebuild took."""
+    partition: int
+    rows: int
+    seconds: float
+
+
+def get_partition_predicates(
+        conn: Connection, source_sql: str, key_column: str, db_type: str, parallelism: int, partitioning: str) -> list[tuple[str, dict[str, object]]]:
+    """Split the source keys into parallelism partitions, returning a WHERE predicate and its parameters for each."""
+    key_col = quote_field_name(key_column, db_type)
+    if partitioning == "hash":
+        hash_sql = get_dialect(db_type).hash_partition_sql(key_col, parallelism)
+        return [(f"{hash_sql} = :partition", {"partition": p}) for p in range(parallelism)]
+
+    # Range partitions of roughly equal size from the upper key of each NTILE
+    bounds: list[str] = [row[0] for row in conn.execute(text(
+        f"SELECT MAX(t.{key_col}) FROM (SELECT s.{key_col}, NTILE({parallelism}) OVER (ORDER BY s.{key_col}) AS tile FROM {source_sql} s) t "
+        f"GROUP BY t.tile ORDER BY MAX(t.{key_col})"))]
+    predicates: list[tuple[str, dict[str, object]]] = []
+    low_key: Optional[str] = None
+    for high_key in bounds:
+        if low_key is None:
+            predicates.append((f"{key_col} <= :highKey", {"highKey": high_key}))
+        else:
+            predicates.append((f"{key_col} > :lowKey AND {key_col} <= :highKey", {"lowKey": low_key, "highKey": high_key}))
+        low_key = high_key
+    return predicates
+
+
+def print_partition_report(timings: list[PartitionTiming]) -> None:
+    """Print the time taken by each partition and how skewed they were."""
+    for t in timings:
+        rate = t.rows / t.seconds if t.seconds > 0 else 0.0
+        print(f"Partition {t.partition}: {t.rows} rows in {t.seconds:.3f}s ({rate:.0f} rows/s)")
+    if timings:
+        mean_seconds = sum(t.seconds for t in timings) / len(timings)
+        slowest = max(timings, key=lambda t: t.seconds)
+        skew = slowest.seconds / mean_seconds if mean_seconds > 0 else 1.0
+        print(f"Slowest partition {slowest.partition} took {skew:.2f}x the mean partition time")
+
+
+def execute_parallel_rebuild(conn: Connection, source: MaskedSource, write_table: str, db_type: str, clear_output: bool, options: TransformerOptions) -> int:
+    """Mask every source row with the keys split into partitions, each inserted concurrently on its own pooled connection.
+
+    The write table is the masked copy of the output or the staging table of a swap, never the output itself. What the
+    caller has pending, the platform's truncation of the outputs included, is committed first so its locks can't block
+    the partitions, and consumers see the outputs empty until the run's final commit. Partitions commit independently
+    so a failed run can leave some of them written. Returns the number of rows written."""
+    engine: Engine = conn.engine
+    if clear_output:
+        conn.execute(text(f"DELETE FROM {quote_table_name(write_table, db_type)}"))
+    with phase("commit"):
+        conn.commit()
+    predicates = get_partition_predicates(conn, source.source_sql, source.masking.key_column, db_type, options.parallelism, options.partitioning)
+
+    def mask_partition(partition: int) -> PartitionTiming:
+        where, params = predicates[partition]
+        start = time.perf_counter()
+        with engine.begin() as worker_conn:
+            rows = worker_conn.execute(
+                text(get_masked_write_sql(source.masking, source.source_sql, write_table, db_type, options.output, where)), params).rowcount
+        return PartitionTiming(partition, rows, time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=options.parallelism) as pool:
+        timings: list[PartitionTiming] = list(pool.map(mask_partition, range(len(predicates))))
+    print_partition_report(timings)
+    return sum(t.rows for t in timings)
+
+
+def get_staging_table_name(output_table: str) -> str:
+    """The table the swap output mode builds the masked customers in."""
+    return f"{output_table}_staging"
+
+
+def get_swapped_out_table_name(output_table: str) -> str:
+    """The name the swap output mode gives the replaced output table until it is dropped."""
+    return f"{output_table}_swapped"
+
+
+def get_swap_index_name(index_name: str) -> str:
+    """The name of an output table index when it is rebuilt on the staging table. Index names are unique per schema
+    on most databases so the rebuilt indexes alternate between the original name and one with a _swap suffix."""
+    return index_name[:-len("_swap")] if index_name.endswith("_swap") else f"{index_name}_swap"
+
+
+def create_staging_table(conn: Connection, output_table: str, db_type: str) -> str:
+    """Create an empty staging table with the columns of the output table but none of its indexes, replacing any
+    left by a failed run. Returns its name."""
+    staging_table = get_staging_table_name(output_table)
+    Table(staging_table, MetaData()).drop(conn, checkfirst=True)
+    columns = [Column(c["name"], c["type"], nullable=c["nullable"]) for c in inspect(conn).get_columns(output_table)]
+    Table(staging_table, MetaData(), *columns).create(conn)
+    return staging_table
+
+
+def build_staging_indexes(conn: Connection, output_table: str, staging_table: str, db_type: str) -> None:
+    """Build the primary key and indexes of the output table on the loaded staging table. Building them after the
+    load is faster than maintaining them row by row."""
+    dialect = get_dialect(db_type)
+    inspector = inspect(conn)
+    pk = inspector.get_pk_constraint(output_table)
+    if pk["constrained_columns"]:
+        pk_name = get_swap_index_name(pk.get("name") or f"{output_table}_pkey")
+        conn.execute(text(dialect.add_primary_key_sql(
+            quote_table_name(staging_table, db_type), quote_field_name(pk_name, db_type), [quote_field_name(c, db_type) for c in pk["constrained_columns"]])))
+    staging = Table(staging_table, MetaData(), autoload_with=conn)
+    for index in inspector.get_indexes(output_table):
+        Index(get_swap_index_name(index["name"]), *(staging.c[c] for c in index["column_names"]), unique=index["unique"]).create(conn)
+
+
+def swap_in_staging_table(conn: Connection, output_table: str, staging_table: str, db_type: str) -> None:
+    """Replace the output table with the staging table by renaming both and dropping the old output table.
+    Readers of the output table only wait for the renames, which commit with the rest of the run. The renames are
+    transactional on PostgreSQL, SQL Server and Db2 but Oracle commits each one. The grants on the output table are
+    copied to the staging table first. Views which bind to the output table rather than its name, such as PostgreSQL
+    views, make dropping the old table fail, which fails the run rather than leaving them on the old table."""
+    dialect = get_dialect(db_type)
+    grants_sql = dialect.table_grants_sql()
+    if grants_sql is not None:
+        quoted_staging_table = quote_table_name(staging_table, db_type)
+        for grantee, privilege, grantable in conn.execute(text(grants_sql), {"table": output_table}).all():
+            conn.execute(text(dialect.grant_sql(quoted_staging_table, grantee, privilege, bool(grantable))))
+    swapped_out_table = get_swapped_out_table_name(output_table)
+    Table(swapped_out_table, MetaData()).drop(conn, checkfirst=True)
+    conn.execute(text(dialect.rename_table_sql(quote_table_name(output_table, db_type), swapped_out_table)))
+    conn.execute(text(dialect.rename_table_sql(quote_table_name(staging_table, db_type), output_table)))
+    conn.execute(text(f"DROP TABLE {quote_table_name(swapped_out_table, db_type)}"))
+
+
+def get_masked_copy_table_name(output_table: str) -> str:
+    """The table the masked rows of an output table are kept in between runs, see TransformerOptions.keeps_masked_copy."""
+    return f"{output_table}_masked"
+
+
+def ensure_masked_copy_table(conn: Connection, output_table: str, key_column: str) -> str:
+    """Create the masked copy of the output table, with its columns and the key column as primary key, if it doesn't
+    exist yet. Returns its name."""
+    copy_table = get_masked_copy_table_name(output_table)
+    inspector = inspect(conn)
+    if not inspector.has_table(copy_table):
+        columns: list[Column] = []
+        for c in inspector.get_columns(output_table):
+            is_key = c["name"].lower() == key_column.lower()
+            columns.append(Column(c["name"], c["type"], primary_key=is_key, nullable=c["nullable"] and not is_key))
+        Table(copy_table, MetaData(), *columns).create(conn)
+    return copy_table
+
+
+def publish_masked_copy(conn: Connection, copy_table: str, output_table: str, masking: CompiledMasking, db_type: str) -> int:
+    """Replace the rows of the output table with those of its masked copy. Returns the number of rows copied."""
+    quoted_output_table = quote_table_name(output_table, db_type)
+    columns = ", ".join(quote_field_name(c, db_type) for c in masking.columns)
+    conn.execute(text(f"DELETE FROM {quoted_output_table}"))
+    return conn.execute(text(f"INSERT INTO {quoted_output_table} ({columns}) SELECT {columns} FROM {quote_table_name(copy_table, db_type)}")).rowcount
+
+
+def execute_full_rebuild(conn: Connection, source: MaskedSource, db_type: str, clear_output: bool, options: TransformerOptions) -> int:
+    """Mask every source row into the output table, chunked, in parallel or client side if the options ask for it.
+    Upserts keep the existing output and remove the rows no longer in the source afterwards rather than clearing it
+    first. Swaps load and index a staging table, which swap_in_staging_table later puts in place of the output table.
+    Returns the number of rows written."""
+    upsert: bool = options.output == "upsert"
+    swap: bool = options.output == "swap"
+    if upsert or swap:
+        clear_output = False
+    write_table: str = source.output_table
+    if swap:
+        with phase("staging"):
+            write_table = create_staging_table(conn, source.output_table, db_type)
+    if options.engine == "stream":
+        if clear_output:
+            conn.execute(text(f"DELETE FROM {quote_table_name(write_table, db_type)}"))
+        row_count = stream_masked_rows(conn, source.source_sql, write_table, source.masking.columns, source.masking.masks, db_type, options.batch_size)
+    elif options.chunk_size > 0:
+        row_count = execute_chunked_rebuild(conn, source, write_table, db_type, clear_output, options)
+    elif options.parallelism > 1:
+        row_count = execute_parallel_rebuild(conn, source, write_table, db_type, clear_output, options)
+    else:
+        if clear_output:
+            conn.execute(text(f"DELETE FROM {quote_table_name(write_table, db_type)}"))
+        row_count = conn.execute(text(get_masked_write_sql(source.masking, source.source_sql, write_table, db_type, options.output))).rowcount
+    if upsert:
+        deleted = delete_missing_rows(conn, source, write_table, db_type)
+        print(f"Upsert removed {deleted} deleted {source.name} records")
+    if swap:
+        with phase("indexing"):
+            build_staging_indexes(conn, source.output_table, write_table, db_type)
+    return row_count
+
+
+def get_current_batch(conn: Connection, input_tables: tuple[str, ...], db_type: str) -> Optional[int]:
+    """The highest batch id in any of the input tables, None if they are all empty."""
+    batch_col = quote_field_name(BATCH_ID_COLUMN, db_type)
+    batches = [conn.execute(text(f"SELECT MAX({batch_col}) FROM {quote_table_name(t, db_type)}")).scalar() for t in input_tables]
+    return max((b for b in batches if b is not None), default=None)
+
+
+def execute_incremental(conn: Connection, source: MaskedSource, db_type: str, options: TransformerOptions) -> int:
+    """Mask only the source rows added, changed or deleted since the last successful run.
+
+    The position is the highest batch id seen in the input tables at the end of the last run. It is stored in the
+    transformer state table, by output table, in the same transaction as the output changes, so a failed run leaves
+    it untouched. A full rebuild is done when there is no stored position, the output is empty or the source has no
+    batch column. The output is the masked copy the platform doesn't truncate, see execute_masking. Returns the number
+    of rows written."""
+    ensureStateTable(conn)
+    if not source.batch_id:
+        print(f"The source of {source.name} has no {BATCH_ID_COLUMN} column, doing a full rebuild")
+        return execute_full_rebuild(conn, source, db_type, True, options)
+
+    quoted_output_table = quote_table_name(source.output_table, db_type)
+    key_col = quote_field_name(source.masking.key_column, db_type)
+    batch_col = quote_field_name(BATCH_ID_COLUMN, db_type)
+
+    current_batch = get_current_batch(conn, source.input_tables, db_type)
+    last_batch: Optional[str] = getState(conn, source.output_table, "lastBatchId")
+    if last_batch is None or current_batch is None or is_table_empty(conn, source.output_table, db_type):
+        print(f"No incremental state for {source.output_table}, doing a full rebuild")
+        # Chunked rebuilds commit as they go, a run failing part way must not leave a position for a partial output
+        clearState(conn, source.output_table, "lastBatchId")
+        row_count = execute_full_rebuild(conn, source, db_type, True, options)
+    else:
+        changed = f"{batch_col} > :lastBatchId"
+        if len(source.input_tables) > 1:
+            # A joined source gives rows it can't date a NULL batch id, they are always masked again
+            changed = f"({changed} OR {batch_col} IS NULL)"
+        params = {"lastBatchId": int(last_batch)}
+        # Rows written since the last run are replaced, rows no longer in the source are deleted
+        if options.output != "upsert":
+            conn.execute(
+                text(f"DELETE FROM {quoted_output_table} WHERE {key_col} IN (SELECT s.{key_col} FROM {source.source_sql} s WHERE {changed})"),
+                params)
+        deleted = delete_missing_rows(conn, source, source.output_table, db_type)
+        row_count = conn.execute(
+            text(get_masked_write_sql(source.masking, source.source_sql, source.output_table, db_type, options.output, changed)), params).rowcount
+        print(f"Incremental run of {source.name} from batch {last_batch} to {current_batch} removed {deleted} deleted records")
+
+    if current_batch is not None:
+        setState(conn, source.output_table, "lastBatchId", str(current_batch))
+    return row_count
+
+
+def get_row_hash_table_name(output_table: str) -> str:
+    """The table holding the source row hash of every row in the output table."""
+    return f"{output_table}_rowhash"
+
+
+def get_row_hash_work_table_name(output_table: str) -> str:
+    """The table a row hash run computes the current source row hashes into."""
+    return f"{output_table}_rowhash_work"
+
+
+def ensure_row_hash_tables(conn: Connection, output_table: str, key_column: str) -> None:
+    """Create the row hash table for the output table and its work table if they don't exist yet. Their key
+    column has the name and type of the output key column."""
+    key_type = next(c["type"] for c in inspect(conn).get_columns(output_table) if c["name"].lower() == key_column.lower())
+    for table_name in (get_row_hash_table_name(output_table), get_row_hash_work_table_name(output_table)):
+        Table(
+            table_name,
+            MetaData(),
+            Column(key_column, key_type, primary_key=True),
+            Column("rowhash", String(32), nullable=False)
+        ).create(conn, checkfirst=True)
+
+
+@lru_cache(maxsize=None)
+def get_row_hash_sql(masking: CompiledMasking, db_type: str, qualifier: str) -> str:
+    """Generate the database native MD5 hash, as 32 hex characters, of the masking version and the non key columns of
+    the masking. Columns are qualified with the quoted table name or alias given. NULLs hash differently to any
+    value and a unit separator between values stops values shifting between columns hashing the same. Every row hashes
+    differently once the masking changes, so all of them are masked again."""
+    return get_dialect(db_type).row_hash_sql(
+        [f"'{get_masking_version(masking)}'"] + [f"{qualifier}.{quote_field_name(c, db_type)}" for c in masking.value_columns])
+
+
+def execute_row_hash(conn: Connection, source: MaskedSource, db_type: str, options: TransformerOptions) -> int:
+    """Mask only the source rows whose hashed columns changed since the last run.
+
+    The hash of every masked row is kept in a row hash table next to the output table. The hashes of the source
+    are computed once per run into a work table, which the changed rows, the deletes and the stored hashes are
+    then found from by joins. It is an ordinary table rather than a temporary one as temporary table syntax differs
+    on every database. A full rebuild is done when there are no stored hashes or the output is empty. The output is
+    the masked copy the platform doesn't truncate, see execute_masking. Returns the number of rows written."""
+    output_table = source.output_table
+    key_column = source.masking.key_column
+    ensure_row_hash_tables(conn, output_table, key_column)
+    hash_table = get_row_hash_table_name(output_table)
+    quoted_output_table = quote_table_name(output_table, db_type)
+    quoted_hash_table = quote_table_name(hash_table, db_type)
+    quoted_work_table = quote_table_name(get_row_hash_work_table_name(output_table), db_type)
+    key_col = quote_field_name(key_column, db_type)
+    hash_col = quote_field_name('rowhash', db_type)
+
+    with phase("hashing"):
+        conn.execute(text(f"DELETE FROM {quoted_work_table}"))
+        conn.execute(text(
+            f"INSERT INTO {quoted_work_table} ({key_col}, {hash_col}) "
+            f"SELECT s.{key_col}, {get_row_hash_sql(source.masking, db_type, 's')} FROM {source.source_sql} s"))
+
+    if is_table_empty(conn, hash_table, db_type) or is_table_empty(conn, output_table, db_type):
+        print(f"No row hashes for {output_table}, doing a full rebuild")
+        # Chunked rebuilds commit as they go, a run failing part way must not leave hashes for a partial output
+        conn.execute(text(f"DELETE FROM {quoted_hash_table}"))
+        row_count = execute_full_rebuild(conn, source, db_type, True, options)
+    else:
+        changed = (
+            f"{key_col} IN (SELECT w.{key_col} FROM {quoted_work_table} w WHERE NOT EXISTS "
+            f"(SELECT 1 FROM {quoted_hash_table} h WHERE h.{key_col} = w.{key_col} AND h.{hash_col} = w.{hash_col}))")
+        if options.output != "upsert":
+            conn.execute(text(f"DELETE FROM {quoted_output_table} WHERE {changed}"))
+        deleted = delete_missing_rows(conn, source, output_table, db_type)
+        row_count = conn.execute(text(get_masked_write_sql(source.masking, source.source_sql, output_table, db_type, options.output, changed))).rowcount
+        print(f"Row hash run of {source.name} removed {deleted} deleted records")
+        # Drop the hashes of changed and deleted rows, the changed ones are added back below
+        conn.execute(text(
+            f"DELETE FROM {quoted_hash_table} WHERE NOT EXISTS (SELECT 1 FROM {quoted_work_table} w "
+            f"WHERE w.{key_col} = {quoted_hash_table}.{key_col} AND w.{hash_col} = {quoted_hash_table}.{hash_col})"))
+
+    conn.execute(text(
+        f"INSERT INTO {quoted_hash_table} ({key_col}, {hash_col}) SELECT w.{key_col}, w.{hash_col} FROM {quoted_work_table} w "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {quoted_hash_table} h WHERE h.{key_col} = w.{key_col})"))
+    return row_count
+
+
+def execute_masking(conn: Connection, source: MaskedSource, db_type: str, options: TransformerOptions) -> int:
+    """Mask a source into its output table in the mode of the options. Returns the number of rows masked.
+
+    When the options keep a masked copy the mode masks into the copy instead, which is then copied into the output.
+    The version of the masking the copy was built with is kept in the state table and the copy is emptied, so every
+    row is masked again, when the masking changes. Otherwise rows masked before a new mask rule would keep the values
+    it hides."""
+    if not options.keeps_masked_copy:
+        return execute_full_rebuild(conn, source, db_type, False, options)
+    copy_source = replace(source, output_table=ensure_masked_copy_table(conn, source.output_table, source.masking.key_column))
+    ensureStateTable(conn)
+    masking_version = get_masking_version(source.masking)
+    if getState(conn, copy_source.output_table, "maskingVersion") != masking_version:
+        print(f"The masking of {source.name} changed, masking every record again")
+        conn.execute(text(f"DELETE FROM {quote_table_name(copy_source.output_table, db_type)}"))
+        setState(conn, copy_source.output_table, "maskingVersion", masking_version)
+    if options.mode == "incremental":
+        row_count = execute_incremental(conn, copy_source, db_type, options)
+    elif options.mode == "rowhash":
+        row_count = execute_row_hash(conn, copy_source, db_type, options)
+    else:
+        row_count = execute_full_rebuild(conn, copy_source, db_type, True, options)
+    with phase("publish"):
+        published = publish_masked_copy(conn, copy_source.output_table, source.output_table, source.masking, db_type)
+    print(f"Copied {published} masked {source.name} records to {source.output_table}")
+    return row_count
+
+
+def executeTransformer(conn: Connection, context: DataTransformerContext, commit: bool = False) -> None:
+    """Mask Store1 customers into the MaskedCustomers customers dataset and the derived datasets, addresses and
+    customers joined to their primary address, on the same connection and transaction. Every dataset is masked with
+    the mode, output mode and engine of the hint options, see TransformerOptions. Swaps of the output tables are all
+    done at the end so the renamed tables are locked only briefly. Run metrics are emitted however the run ends.
+
+    The platform commits the transaction after this returns, where the metrics can't time it. A caller passing commit
+    has it committed here instead, timed as the commit phase along with the commits of chunked and parallel rebuilds."""
+    print(f"Executing transformer with {context}")
+    options: TransformerOptions = TransformerOptions.from_hints()
+    metrics = start_run(TRANSFORMER_NAME, options.trigger_interval_seconds)
+    metrics.mode = options.mode
+    try:
+        with phase("setup"):
+            inputTableNames: dict[str, str] = {
+                name: context.getInputTableNameForDataset("Original", "Store1", name) for name in {"customers"} | {i for d in DERIVED_DATASETS for i in d.inputs}}
+            outputTableNames: dict[str, str] = {name: context.getOutputTableNameForDataset(name) for name in ["customers"] + [d.name for d in DERIVED_DATASETS]}
+
+            # Detect database type
+            db_type = get_database_type(conn)
+            print(f"Detected database type: {db_type}")
+            batchIds: dict[str, bool] = {}
+            if options.mode == "incremental":
+                batchIds = {name: table_has_column(conn, table, BATCH_ID_COLUMN) for name, table in inputTableNames.items()}
+        metrics.dialect = db_type
+
+        with phase("sql_generation"):
+            sources: list[MaskedSource] = get_masked_sources(inputTableNames, outputTableNames, db_type, options.mask_functions, batchIds)
+            for source in sources:
+                get_masked_write_sql(source.masking, source.source_sql, source.output_table, db_type, options.output)
+            maskings: list[CompiledMasking] = [source.masking for source in sources]
+
+        if options.mask_functions:
+            with phase("mask_functions"):
+                install_mask_functions(conn, db_type, maskings)
+
+        outputCustomerTableName = outputTableNames["customers"]
+        fingerprint: Optional[str] = None
+        if options.skip_unchanged:
+            with phase("fingerprint"):
+                ensureStateTable(conn)
+                masking_version = "|".join([options.mode, options.output] + [m.select_list for m in maskings])
+                fingerprint = get_input_fingerprint(conn, list(inputTableNames.values()), db_type, masking_version)
+                # An empty masked copy is always rebuilt
+                unchanged = fingerprint is not None and fingerprint == getState(conn, outputCustomerTableName, "inputFingerprint") and \
+                    not any(is_table_empty(conn, get_masked_copy_table_name(table), db_type) for table in outputTableNames.values())
+            if unchanged:
+                print("Inputs unchanged since the last run, copying the masked copies to the outputs")
+                with phase("publish"):
+                    for source in sources:
+                        publish_masked_copy(conn, get_masked_copy_table_name(source.output_table), source.output_table, source.masking, db_type)
+                if commit:
+                    with phase("commit"):
+                        conn.commit()
+                metrics.finish("skipped")
+                return
+
+        with phase("execution"):
+            row_count = execute_masking(conn, sources[0], db_type, options)
+        print(f"Successfully processed and masked {row_count} customer records")
+        bytes_estimated = row_count * estimate_row_bytes(sources[0].schema)
+
+        with phase("derived_datasets"):
+            for source in sources[1:]:
+                rows = execute_masking(conn, source, db_type, options)
+                print(f"Masked {rows} {source.name} records")
+                row_count += rows
+                bytes_estimated += rows * estimate_row_bytes(source.schema)
+        if options.output == "swap":
+            with phase("swap"):
+                for source in sources:
+                    swap_in_staging_table(conn, source.output_table, get_staging_table_name(source.output_table), db_type)
+        if fingerprint is not None:
+            setState(conn, outputCustomerTableName, "inputFingerprint", fingerprint)
+        if commit:
+            with phase("commit"):
+                conn.commit()
+        metrics.rows_written = row_count
+        metrics.bytes_estimated = bytes_estimated
+        metrics.finish("success")
+    except Exception:
+        metrics.finish("failure")
+        raise
+    finally:
+        metrics.emit(options.metrics_file)
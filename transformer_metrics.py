@@ -0,0 +1,183 @@
+"""
+// Copyright (c) William Newport
+// SPDX-License-Identifier: BUSL-1.1
+
+Run metrics for the data transformers in this repository. A run records how long each phase took, the rows read and
+written, an estimate of the bytes written and how it ended. When it finishes the metrics are printed as a single JSON
+log line and, if a file is configured, written in the Prometheus text format for the node exporter textfile collector
+or for pushing to a pushgateway. The run time is also given as a fraction of the trigger interval so an alert can fire
+before runs start to overlap.
+"""
+
+import json
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+from datasurface.md import DDLTable
+from atomic_file import write_atomically
+
+# Estimated stored bytes for the fixed width types, strings use their maximum size
+TYPE_BYTE_ESTIMATES: dict[str, int] = {
+    "Date": 4,
+    "Timestamp": 8,
+    "Integer": 4,
+    "SmallInt": 2,
+    "BigInt": 8,
+    "Decimal": 16,
+    "Boolean": 1,
+    "Double": 8,
+    "Float": 4
+}
+
+
+def peak_rss_mb() -> float:
+    """The peak resident set size of this process so far in MB. It never goes down, so a measurement of one piece of
+    work needs a process of its own."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def prometheus_metric(name: str, help_text: str, samples: list[tuple[str, float]], metric_type: str = "gauge") -> list[str]:
+    """The lines of a metric in the Prometheus text exposition format. Each sample is its labels, without the braces,
+    and its value."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    lines += [f"{name}{{{labels}}} {value}" if labels else f"{name} {value}" for labels, value in samples]
+    return lines
+
+
+def estimate_row_bytes(schema: DDLTable) -> int:
+    """Estimate the stored width of a row of the schema from its column types."""
+    total = 0
+    for column in schema.columns.values():
+        max_size: Optional[int] = getattr(column.type, "maxSize", None)
+        total += max_size if max_size is not None else TYPE_BYTE_ESTIMATES.get(type(column.type).__name__, 8)
+    return total
+
+
+class TransformerMetrics:
+    """The metrics for one transformer run. Phases may be timed from several threads."""
+
+    def __init__(self, transformer_name: str, trigger_interval_seconds: float) -> None:
+        self.transformer_name: str = transformer_name
+        self.trigger_interval_seconds: float = trigger_interval_seconds
+        self.dialect: str = "unknown"
+        self.mode: str = "unknown"
+        self.outcome: str = "running"
+        self.rows_read: Optional[int] = None
+        """Rows the stream engine read from the inputs, which it counts as it fetches them. The masking SQL reads inside
+        the database and the drivers only report the rows an INSERT...SELECT wrote, so it is left unset when nothing was
+        streamed rather than guessed."""
+        self.rows_written: int = 0
+        self.bytes_estimated: int = 0
+        self.phase_seconds: dict[str, float] = {}
+        self.start_time: float = time.time()
+        self._start: float = time.perf_counter()
+        self.run_seconds: float = 0.0
+        self._lock: threading.Lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time a phase of the run. Time spent in the same phase more than once is added up."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + elapsed
+
+    def add_rows_read(self, rows: int) -> None:
+        """Count rows read from the inputs."""
+        with self._lock:
+            self.rows_read = (self.rows_read or 0) + rows
+
+    def finish(self, outcome: str) -> None:
+        """Record how the run ended and its total time."""
+        self.outcome = outcome
+        self.run_seconds = time.perf_counter() - self._start
+
+    def to_dict(self) -> dict[str, Any]:
+        rows_per_second = self.rows_written / self.run_seconds if self.run_seconds > 0 else 0.0
+        return {
+            "event": "transformer_run",
+            "transformer": self.transformer_name,
+            "dialect": self.dialect,
+            "mode": self.mode,
+            "outcome": self.outcome,
+            "start_time": self.start_time,
+            "run_seconds": round(self.run_seconds, 6),
+            "phase_seconds": {k: round(v, 6) for k, v in self.phase_seconds.items()},
+            "rows_read": self.rows_read,
+            "rows_written": self.rows_written,
+            "rows_per_second": round(rows_per_second, 1),
+            "bytes_estimated": self.bytes_estimated,
+            "trigger_interval_seconds": self.trigger_interval_seconds,
+            "interval_utilization": round(self.run_seconds / self.trigger_interval_seconds, 4) if self.trigger_interval_seconds > 0 else None
+        }
+
+    def to_prometheus(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        labels = f'transformer="{self.transformer_name}",dialect="{self.dialect}",mode="{self.mode}"'
+        d = self.to_dict()
+        lines: list[str] = []
+
+        def gauge(name: str, help_text: str, samples: list[tuple[str, float]]) -> None:
+            lines.extend(prometheus_metric(f"datasurface_dt_{name}", help_text, [(labels + extra_labels, value) for extra_labels, value in samples]))
+
+        gauge("run_seconds", "Duration of the last transformer run", [("", self.run_seconds)])
+        gauge("phase_seconds", "Duration of each phase of the last transformer run",
+              [(f',phase="{p}"', v) for p, v in sorted(self.phase_seconds.items())])
+        gauge("rows_written", "Rows written by the last transformer run", [("", self.rows_written)])
+        if self.rows_read is not None:
+            gauge("rows_read", "Rows streamed from the inputs by the last transformer run", [("", self.rows_read)])
+        gauge("rows_per_second", "Rows written per second by the last transformer run", [("", d["rows_per_second"])])
+        gauge("bytes_estimated", "Estimated bytes written by the last transformer run", [("", self.bytes_estimated)])
+        if d["interval_utilization"] is not None:
+            gauge("interval_utilization", "Last run duration as a fraction of the trigger interval", [("", d["interval_utilization"])])
+        gauge("last_run_timestamp_seconds", "Start time of the last transformer run", [("", self.start_time)])
+        gauge("last_run_outcome", "1 for the outcome of the last transformer run",
+              [(f',outcome="{o}"', 1 if o == self.outcome else 0) for o in ("success", "skipped", "failure")])
+        return "\n".join(lines) + "\n"
+
+    def emit(self, prometheus_file: Optional[str] = None) -> None:
+        """Print the metrics as a JSON log line and write the Prometheus file if one is given. The file is replaced
+        atomically so a collector never reads half of it."""
+        print(json.dumps(self.to_dict()))
+        if prometheus_file:
+            write_atomically(prometheus_file, self.to_prometheus())
+
+
+# The metrics of the run in progress in this process
+_current: Optional[TransformerMetrics] = None
+
+
+def start_run(transformer_name: str, trigger_interval_seconds: float) -> TransformerMetrics:
+    """Start collecting metrics for a new run."""
+    global _current
+    _current = TransformerMetrics(transformer_name, trigger_interval_seconds)
+    return _current
+
+
+def current_run() -> Optional[TransformerMetrics]:
+    """The metrics of the run in progress, if there is one."""
+    return _current
+
+
+def add_rows_read(rows: int) -> None:
+    """Count rows read by the run in progress, doing nothing if no run is being measured."""
+    if _current is not None:
+        _current.add_rows_read(rows)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time a phase of the run in progress, doing nothing if no run is being measured."""
+    if _current is None:
+        yield
+    else:
+        with _current.phase(name):
+            yield
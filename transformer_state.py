@@ -0,0 +1,51 @@
+"""
+// Copyright (c) William Newport
+// SPDX-License-Identifier: BUSL-1.1
+
+Bookkeeping for the data transformers in this repository. Transformer runs are stateless jobs so anything a run needs
+to remember for the next one (high water marks, checkpoints and so on) is kept in a small key/value table in the same
+database as the transformer output tables. Values are scoped, normally by the output table name, so several
+transformers can share the table.
+"""
+
+from typing import Optional
+from sqlalchemy import Column, Connection, MetaData, String, Table, and_, delete, insert, select
+
+STATE_TABLE_NAME: str = "dt_transformer_state"
+
+_metadata: MetaData = MetaData()
+
+stateTable: Table = Table(
+    STATE_TABLE_NAME,
+    _metadata,
+    Column("scope", String(255), primary_key=True),
+    Column("name", String(100), primary_key=True),
+    Column("value", String(1000), nullable=True)
+)
+
+
+def ensureStateTable(conn: Connection) -> None:
+    """Create the state table if it doesn't exist yet."""
+    stateTable.create(conn, checkfirst=True)
+
+
+def getState(conn: Connection, scope: str, name: str) -> Optional[str]:
+    """Return the stored value or None if nothing has been stored for this scope/name."""
+    row = conn.execute(
+        select(stateTable.c.value).where(and_(stateTable.c.scope == scope, stateTable.c.name == name))
+    ).first()
+    return None if row is None else row[0]
+
+
+def setState(conn: Connection, scope: str, name: str, value: str) -> None:
+    """Store a value, replacing any previous value. This runs in the caller's transaction so it commits with the work it describes."""
+    clearState(conn, scope, name)
+    conn.execute(insert(stateTable).values(scope=scope, name=name, value=value))
+
+
+def clearState(conn: Connection, scope: str, name: Optional[str] = None) -> None:
+    """Remove a value or, if name is None, every value in the scope."""
+    stmt = delete(stateTable).where(stateTable.c.scope == scope)
+    if name is not None:
+        stmt = stmt.where(stateTable.c.name == name)
+    conn.execute(stmt)
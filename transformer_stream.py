@@ -0,0 +1,141 @@
+"""
+// Copyright (c) William Newport
+// SPDX-License-Identifier: BUSL-1.1
+
+Client side masking engine for databases which can't run the masking SQL. Source rows are streamed through a server
+side cursor in fixed size batches, each batch is masked a column at a time and then bulk loaded into the output table,
+so memory use depends on the batch size rather than the table size. Every mask uses the PyArrow compute kernels, PyArrow
+is in requirements.txt, and plain Python does the same work if it isn't installed.
+"""
+
+import io
+from typing import Any, Callable, Optional, Sequence
+from sqlalchemy import Connection, text
+from transformer_metrics import add_rows_read
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # PyArrow is optional
+    pa = None
+    pc = None
+
+# Masks which keep the last few characters of a value behind a prefix
+SUFFIX_MASKS: dict[str, tuple[str, int]] = {
+    'name': ('***', 2),
+    'phone': ('***-***-', 4),
+    'id': ('***', 3)
+}
+
+
+def mask_email(value: str, db_type: str) -> Optional[str]:
+    """Mask an email address exactly as the masking SQL for the dialect does."""
+    at = value.find('@')
+    if db_type == 'sqlserver':
+        # The SQL Server mask needs at least 3 characters before the @ and keeps everything after it
+        return value[:3] + '***@' + value[at + 1:] if at >= 3 else None
+    # SPLIT_PART keeps only the text between the first and second @
+    return value[:3] + '***@' + value.split('@')[1] if at >= 0 else None
+
+
+def get_email_domain_pattern(db_type: str) -> str:
+    """The regular expression the PyArrow kernels take the domain kept by mask_email from. Values it doesn't match
+    mask to NULL."""
+    if db_type == 'sqlserver':
+        return r'^[^@]{3}[^@]*@(?P<domain>(?s:.*))$'
+    return r'^[^@]*@(?P<domain>[^@]*)'
+
+
+def mask_column(values: list[Any], mask: Optional[str], db_type: str) -> list[Any]:
+    """Mask a column of values, NULLs stay NULL as they do in the masking SQL."""
+    if mask is None:
+        return values
+    if mask in SUFFIX_MASKS:
+        prefix, keep = SUFFIX_MASKS[mask]
+        if pc is not None:
+            suffixes = pc.utf8_slice_codeunits(pa.array(values, pa.string()), start=-keep)
+            return pc.binary_join_element_wise(prefix, suffixes, '').to_pylist()
+        return [None if v is None else prefix + v[-keep:] for v in values]
+    if mask == 'initial':
+        if pc is not None:
+            return pc.binary_join_element_wise(pc.utf8_slice_codeunits(pa.array(values, pa.string()), start=0, stop=1), '***', '').to_pylist()
+        return [None if v is None else v[:1] + '***' for v in values]
+    if mask == 'redact':
+        if pc is not None:
+            arr = pa.array(values, pa.string())
+            return pc.if_else(pc.is_valid(arr), '***', pa.scalar(None, pa.string())).to_pylist()
+        return [None if v is None else '***' for v in values]
+    if mask == 'email':
+        if pc is not None:
+            arr = pa.array(values, pa.string())
+            domains = pc.struct_field(pc.extract_regex(arr, get_email_domain_pattern(db_type)), 'domain')
+            return pc.binary_join_element_wise(pc.utf8_slice_codeunits(arr, start=0, stop=3), '***@', domains, '').to_pylist()
+        return [None if v is None else mask_email(v, db_type) for v in values]
+    raise ValueError(f"Unknown mask pattern '{mask}'")
+
+
+def to_csv_value(value: Any) -> str:
+    """Format a value for COPY in CSV format. Everything but NULL is quoted so COPY can tell NULLs, written as
+    nothing, from empty strings."""
+    if value is None:
+        return ''
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def get_bulk_loader(conn: Connection, quoted_output_table: str, quoted_columns: list[str]) -> Callable[[list[tuple[Any, ...]]], None]:
+    """Return a function which bulk loads rows into the output table using the fastest path the driver has:
+    COPY for the psycopg drivers, fast_executemany for pyodbc and a plain executemany otherwise. The loads run on
+    the caller's connection so they commit with the rest of the run."""
+    column_list = ", ".join(quoted_columns)
+    driver: str = conn.dialect.driver
+
+    if conn.dialect.name == 'postgresql' and driver in ('psycopg2', 'psycopg'):
+        copy_sql = f"COPY {quoted_output_table} ({column_list}) FROM STDIN WITH (FORMAT csv)"
+
+        def copy_rows(rows: list[tuple[Any, ...]]) -> None:
+            data = "".join(",".join(to_csv_value(v) for v in row) + "\n" for row in rows)
+            cursor = conn.connection.dbapi_connection.cursor()
+            if driver == 'psycopg2':
+                cursor.copy_expert(copy_sql, io.StringIO(data))
+            else:
+                with cursor.copy(copy_sql) as copy:
+                    copy.write(data)
+        return copy_rows
+
+    if conn.dialect.name == 'mssql' and driver == 'pyodbc':
+        insert_sql = f"INSERT INTO {quoted_output_table} ({column_list}) VALUES ({', '.join('?' for _ in quoted_columns)})"
+
+        def fast_insert_rows(rows: list[tuple[Any, ...]]) -> None:
+            cursor = conn.connection.dbapi_connection.cursor()
+            cursor.fast_executemany = True
+            cursor.executemany(insert_sql, rows)
+        return fast_insert_rows
+
+    insert_stmt = text(f"INSERT INTO {quoted_output_table} ({column_list}) VALUES ({', '.join(f':p{i}' for i in range(len(quoted_columns)))})")
+
+    def insert_rows(rows: list[tuple[Any, ...]]) -> None:
+        conn.execute(insert_stmt, [{f"p{i}": v for i, v in enumerate(row)} for row in rows])
+    return insert_rows
+
+
+def stream_masked_rows(
+        conn: Connection, from_sql: str, output_table: str, columns: Sequence[str], masks: Sequence[Optional[str]],
+        db_type: str, batch_size: int) -> int:
+    """Copy the source, a quoted table name or parenthesized query, to the output table, masking each column with its
+    mask (None copies it as is).
+    The source is read on a separate pooled connection so the server side cursor stays open while the caller's
+    connection loads each batch. The rows read are counted in the run's metrics. Returns the number of rows written."""
+    preparer = conn.dialect.identifier_preparer
+    quoted_columns = [preparer.quote(c) for c in columns]
+    select_stmt = text(f"SELECT {', '.join(f's.{c}' for c in quoted_columns)} FROM {from_sql} s")
+    load_rows = get_bulk_loader(conn, preparer.quote(output_table), quoted_columns)
+
+    row_count = 0
+    with conn.engine.connect() as read_conn:
+        result = read_conn.execution_options(stream_results=True, yield_per=batch_size).execute(select_stmt)
+        for batch in result.partitions(batch_size):
+            masked_columns = [mask_column(list(values), mask, db_type) for values, mask in zip(zip(*batch), masks)]
+            load_rows(list(zip(*masked_columns)))
+            add_rows_read(len(batch))
+            row_count += len(batch)
+    return row_count
@@ -0,0 +1,213 @@
+"""
+// Copyright (c) William Newport
+// SPDX-License-Identifier: BUSL-1.1
+
+A long lived worker which runs the masking transformer in process. A platform job for the transformer pays to start
+Python, import datasurface, SQLAlchemy and the transformer and connect to the database on every trigger, which is often
+longer than the masking. The worker pays that once: it imports transformer_masking, keeps a connection pool open and
+runs its executeTransformer each time it is triggered.
+
+The worker is triggered with POST /run, whose JSON body has the tables of the run's input and output datasets as the
+platform's context gives them, see transformer.get_context_tables. It answers with the outcome once the run is done, or
+409 if a run is already going. Setting the DT_WORKER_URL option in the K8sDataTransformerHint makes the platform's job
+hand its run to the worker instead of running it. Like the platform the worker clears the outputs before each run. The
+cold start, split into importing, connecting and the first run, and the latency of the warm runs after it are reported
+separately in GET /metrics in the Prometheus text format.
+
+A run deletes every row of its output tables, so the worker only runs on the tables listed for each dataset in the
+--tables file and only for requests with the shared token in DT_WORKER_TOKEN, which the platform's job must have too.
+Give both from a Kubernetes secret rather than the hint options, which are in the model. The worker listens on
+localhost unless --host says otherwise.
+
+    DT_WORKER_TOKEN=... python transformer_worker.py --url postgresql://... --tables worker_tables.json --port 8080
+
+The tables file has the table names each dataset may be run on:
+
+    {"inputs": {"customers": ["store1_customers"], ...}, "outputs": {"customers": ["masked_customers"], ...}}
+"""
+
+import argparse
+import hmac
+import importlib
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import ModuleType
+from typing import Any, Optional
+from sqlalchemy import Engine, text
+from transformer_local import LocalTransformerContext, create_local_engine
+from transformer import WORKER_TOKEN_OPTION
+from transformer_metrics import prometheus_metric
+
+# Warm run latencies kept for the quantiles
+WARM_RUN_HISTORY: int = 1000
+
+
+def load_allowed_tables(file_name: str) -> dict[str, dict[str, set[str]]]:
+    """The table names each input and output dataset may be run on from a tables file, see the module documentation."""
+    with open(file_name) as f:
+        config = json.load(f)
+    allowed: dict[str, dict[str, set[str]]] = {}
+    for kind in ("inputs", "outputs"):
+        datasets = config.get(kind)
+        if not isinstance(datasets, dict) or not datasets:
+            raise ValueError(f"The tables file {file_name} has no {kind}")
+        allowed[kind] = {name: {tables} if isinstance(tables, str) else set(tables) for name, tables in datasets.items()}
+    return allowed
+
+
+def get_run_context(tables: dict[str, Any], allowed_tables: dict[str, dict[str, set[str]]]) -> LocalTransformerContext:
+    """The context of a run from the tables in its request, raising ValueError unless they are, for every dataset the
+    worker runs, one of the tables allowed for it."""
+    for kind in ("inputs", "outputs"):
+        requested = tables.get(kind)
+        if not isinstance(requested, dict) or set(requested) != set(allowed_tables[kind]):
+            raise ValueError(f"A run needs {kind} mapping each of {', '.join(sorted(allowed_tables[kind]))} to a table")
+        for name, table in requested.items():
+            if table not in allowed_tables[kind][name]:
+                raise ValueError(f"{table!r} isn't one of the tables allowed for the {name} {kind[:-1]}")
+    return LocalTransformerContext({("Original", "Store1", name): table for name, table in tables["inputs"].items()}, dict(tables["outputs"]))
+
+
+class TransformerWorker:
+    """Runs the transformer in this process, one run at a time, timing the cold start and the warm runs."""
+
+    def __init__(self, url: str, allowed_tables: dict[str, dict[str, set[str]]], token: str) -> None:
+        self.url: str = url
+        self.allowed_tables: dict[str, dict[str, set[str]]] = allowed_tables
+        self.token: str = token
+        """The shared token requests to run must have"""
+        self.transformer: Optional[ModuleType] = None
+        self.engine: Optional[Engine] = None
+        self.cold_start_seconds: dict[str, float] = {}
+        self.warm_run_seconds: deque[float] = deque(maxlen=WARM_RUN_HISTORY)
+        self.run_counts: dict[str, int] = {"success": 0, "failure": 0, "busy": 0}
+        self._run_lock: threading.Lock = threading.Lock()
+
+    def start(self) -> None:
+        """Import the masking and open the connection pool, the part of the cold start paid before any trigger."""
+        start = time.perf_counter()
+        self.transformer = importlib.import_module("transformer_masking")
+        self.cold_start_seconds["import"] = time.perf_counter() - start
+        start = time.perf_counter()
+        self.engine = create_local_engine(self.url)
+        with self.engine.connect():
+            pass
+        self.cold_start_seconds["connect"] = time.perf_counter() - start
+
+    def clear_outputs(self, context: LocalTransformerContext) -> None:
+        """Empty the output tables, committed on their own, as the platform does before a run."""
+        assert self.transformer is not None and self.engine is not None
+        with self.engine.begin() as conn:
+            db_type = self.transformer.get_database_type(conn)
+            for table in context.output_tables.values():
+                conn.execute(text(f"DELETE FROM {self.transformer.quote_table_name(table, db_type)}"))
+
+    def run(self, context: LocalTransformerContext) -> dict[str, Any]:
+        """Run the transformer on the tables of the context in its own transaction unless a run is already going.
+        The first run is part of the cold start as it fills the caches of compiled masking SQL."""
+        if not self._run_lock.acquire(blocking=False):
+            self.run_counts["busy"] += 1
+            return {"outcome": "busy"}
+        try:
+            assert self.transformer is not None and self.engine is not None
+            start = time.perf_counter()
+            try:
+                self.clear_outputs(context)
+                with self.engine.connect() as conn:
+                    self.transformer.executeTransformer(conn, context, commit=True)
+            except Exception as e:
+                self.run_counts["failure"] += 1
+                return {"outcome": "failure", "error": repr(e), "seconds": time.perf_counter() - start}
+            seconds = time.perf_counter() - start
+            self.run_counts["success"] += 1
+            if "first_run" not in self.cold_start_seconds:
+                self.cold_start_seconds["first_run"] = seconds
+            else:
+                self.warm_run_seconds.append(seconds)
+            return {"outcome": "success", "seconds": seconds}
+        finally:
+            self._run_lock.release()
+
+    def is_authorized(self, authorization: Optional[str]) -> bool:
+        """Whether an Authorization header has the worker's token as a bearer token."""
+        return hmac.compare_digest((authorization or "").encode(), f"Bearer {self.token}".encode())
+
+    def to_prometheus(self) -> str:
+        lines = prometheus_metric(
+            "datasurface_dt_worker_cold_start_seconds", "Time to import the transformer, connect and do the first run",
+            [(f'phase="{p}"', v) for p, v in self.cold_start_seconds.items()])
+        lines.append("# HELP datasurface_dt_worker_warm_run_seconds Latency of the runs after the first")
+        lines.append("# TYPE datasurface_dt_worker_warm_run_seconds summary")
+        if len(self.warm_run_seconds) >= 2:
+            quantiles = statistics.quantiles(self.warm_run_seconds, n=20, method="inclusive")
+            lines.append(f'datasurface_dt_worker_warm_run_seconds{{quantile="0.5"}} {statistics.median(self.warm_run_seconds)}')
+            lines.append(f'datasurface_dt_worker_warm_run_seconds{{quantile="0.95"}} {quantiles[18]}')
+        lines.append(f"datasurface_dt_worker_warm_run_seconds_sum {sum(self.warm_run_seconds)}")
+        lines.append(f"datasurface_dt_worker_warm_run_seconds_count {len(self.warm_run_seconds)}")
+        lines += prometheus_metric(
+            "datasurface_dt_worker_runs_total", "Triggers received by outcome", [(f'outcome="{o}"', count) for o, count in self.run_counts.items()], "counter")
+        return "\n".join(lines) + "\n"
+
+
+def create_handler(worker: TransformerWorker) -> type[BaseHTTPRequestHandler]:
+    class WorkerRequestHandler(BaseHTTPRequestHandler):
+        def send(self, status: int, body: str, content_type: str) -> None:
+            data = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self) -> None:
+            if self.path != "/run":
+                self.send(404, "Not found\n", "text/plain")
+                return
+            if not worker.is_authorized(self.headers.get("Authorization")):
+                self.send(401, json.dumps({"outcome": "failure", "error": "Unauthorized"}) + "\n", "application/json")
+                return
+            try:
+                context = get_run_context(json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}"), worker.allowed_tables)
+            except ValueError as e:
+                self.send(400, json.dumps({"outcome": "failure", "error": str(e)}) + "\n", "application/json")
+                return
+            result = worker.run(context)
+            status = {"success": 200, "busy": 409}.get(result["outcome"], 500)
+            self.send(status, json.dumps(result) + "\n", "application/json")
+
+        def do_GET(self) -> None:
+            if self.path == "/metrics":
+                self.send(200, worker.to_prometheus(), "text/plain; version=0.0.4")
+            elif self.path == "/healthz":
+                self.send(200, "ok\n", "text/plain")
+            else:
+                self.send(404, "Not found\n", "text/plain")
+    return WorkerRequestHandler
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the masking transformer in a long lived process triggered over HTTP")
+    parser.add_argument("--url", required=True, help="SQLAlchemy URL of the database the transformer runs in")
+    parser.add_argument("--tables", required=True, help="JSON file of the tables each dataset may be run on")
+    parser.add_argument("--host", default="127.0.0.1", help="The address to listen on, 0.0.0.0 for every interface")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args(argv)
+
+    token = os.environ.get(WORKER_TOKEN_OPTION, "")
+    if not token:
+        parser.error(f"{WORKER_TOKEN_OPTION} must be set to the token the platform's job sends")
+    worker = TransformerWorker(args.url, load_allowed_tables(args.tables), token)
+    worker.start()
+    print(f"Transformer worker ready in {sum(worker.cold_start_seconds.values()):.2f}s {worker.cold_start_seconds}, listening on port {args.port}")
+    ThreadingHTTPServer((args.host, args.port), create_handler(worker)).serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""
+// Copyright (c) William Newport
+// SPDX-License-Identifier: BUSL-1.1
+
+Find the jobs the model schedules on the same database hosts at the same time, and spread them out. Every CronTrigger
+in a runtime environment is collected: datastore ingestion, data transformers and consumer replica groups. Each job
+counts against the hosts it reads and writes, which always includes the merge database. A day of runs is simulated
+with an estimated duration per kind of job, giving the peak number of concurrent jobs on each host.
+
+Jobs which run every N minutes can start at any minute offset below N without changing how often they run. Offsets
+are chosen job by job, deterministically, to minimise the peak and then the overlap on the job's hosts. The report
+shows each host's peak before and after and the cron expression to use for each job.
+
+    python trigger_analysis.py --rte prod [--duration ingestion=30] [--duration crg=90]
+
+Only the minute and hour fields of cron expressions are simulated, a day is assumed to run every job.
+"""
+
+import argparse
+import hashlib
+import re
+import sys
+from dataclasses import dataclass, replace
+from typing import Any, Iterable, Optional
+from datasurface.md import ConsumerReplicaGroup, CronTrigger, DataContainer, Ecosystem
+from eco import createEcosystem
+
+SECONDS_PER_DAY: int = 24 * 60 * 60
+
+# Estimated seconds each kind of job runs for, override with --duration
+DEFAULT_DURATIONS: dict[str, int] = {
+    "ingestion": 30,
+    "transformer": 30,
+    "crg": 60
+}
+
+
+@dataclass(frozen=True)
+class ScheduledJob:
+    name: str
+    kind: str
+    """ingestion, transformer or crg, which picks the estimated duration"""
+    cron: str
+    hosts: frozenset[str]
+
+
+def parse_cron_field(field: str, low: int, high: int) -> list[int]:
+    """The values a cron field matches: *, N, A-B and lists of them, each optionally with /STEP."""
+    values: set[int] = set()
+    for part in field.split(","):
+        m = re.fullmatch(r"(\*|\d+)(?:-(\d+))?(?:/(\d+))?", part)
+        if m is None:
+            raise ValueError(f"Unsupported cron field '{field}'")
+        start = low if m.group(1) == "*" else int(m.group(1))
+        end = high if m.group(1) == "*" else int(m.group(2)) if m.group(2) else (high if m.group(3) else start)
+        values.update(range(start, end + 1, int(m.group(3) or 1)))
+    return sorted(v for v in values if low <= v <= high)
+
+
+def get_start_seconds(cron: str) -> list[int]:
+    """The seconds into the day the cron expression starts a run."""
+    fields = cron.split()
+    if len(fields) != 5:
+        raise ValueError(f"Cron expression '{cron}' doesn't have 5 fields")
+    return [h * 3600 + m * 60 for h in parse_cron_field(fields[1], 0, 23) for m in parse_cron_field(fields[0], 0, 59)]
+
+
+def get_minute_step(cron: str) -> Optional[int]:
+    """The period in minutes of a cron expression running every N minutes of every hour, else None."""
+    fields = cron.split()
+    m = re.fullmatch(r"(?:\*|\d+-59)/(\d+)", fields[0]) if len(fields) == 5 and fields[1] == "*" else None
+    return int(m.group(1)) if m is not None and 1 < int(m.group(1)) <= 30 else None
+
+
+def with_minute_offset(cron: str, offset: int) -> str:
+    step = get_minute_step(cron)
+    assert step is not None
+    fields = cron.split()
+    fields[0] = f"*/{step}" if offset == 0 else f"{offset}-59/{step}"
+    return " ".join(fields)
+
+
+def get_host_load(jobs: Iterable[ScheduledJob], durations: dict[str, int]) -> dict[str, tuple[int, int]]:
+    """The peak number of concurrent jobs on each host over a day, and the job seconds spent overlapping another job."""
+    events: dict[str, list[tuple[int, int]]] = {}
+    for job in jobs:
+        duration = durations[job.kind]
+        for start in get_start_seconds(job.cron):
+            for host in job.hosts:
+                events.setdefault(host, []).extend([(start, 1), (start + duration, -1)])
+    load: dict[str, tuple[int, int]] = {}
+    for host, host_events in events.items():
+        host_events.sort()  # Ends sort before starts at the same second, back to back runs don't overlap
+        running = peak = overlap = 0
+        last = 0
+        for when, change in host_events:
+            if running > 1:
+                overlap += (running - 1) * (when - last)
+            running += change
+            last = when
+            peak = max(peak, running)
+        load[host] = (peak, overlap)
+    return load
+
+
+def stagger_jobs(jobs: list[ScheduledJob], durations: dict[str, int]) -> list[ScheduledJob]:
+    """Choose a minute offset for every job running each N minutes. Jobs are placed one at a time in name order on top
+    of the jobs which can't move, each at the offset giving its hosts the lowest peak then the least overlap. Ties go to
+    the first offset counting from one picked by a hash of the job name, so the same model always gets the same offsets
+    and equal jobs don't all pick the same one."""
+    placed = [j for j in jobs if get_minute_step(j.cron) is None]
+    for job in sorted((j for j in jobs if get_minute_step(j.cron) is not None), key=lambda j: j.name):
+        step = get_minute_step(job.cron)
+        assert step is not None
+        first = int(hashlib.sha256(job.name.encode()).hexdigest(), 16) % step
+        best: Optional[tuple[tuple[int, int], ScheduledJob]] = None
+        for i in range(step):
+            candidate = replace(job, cron=with_minute_offset(job.cron, (first + i) % step))
+            load = get_host_load([j for j in placed if j.hosts & job.hosts] + [candidate], durations)
+            score = (max(load[h][0] for h in job.hosts), sum(load[h][1] for h in job.hosts))
+            if best is None or score < best[0]:
+                best = (score, candidate)
+        assert best is not None
+        placed.append(best[1])
+    by_name = {j.name: j for j in placed}
+    return [by_name[j.name] for j in jobs]
+
+
+def get_container_hosts(containers: Iterable[DataContainer]) -> set[str]:
+    """The host names of the containers with one. Containers referenced by environment have none until deployed."""
+    hosts: set[str] = set()
+    for container in containers:
+        hostPort = getattr(container, "hostPortPair", None)
+        if hostPort is not None:
+            hosts.add(hostPort.hostName)
+    return hosts
+
+
+def as_list(items: Any) -> list[Any]:
+    return list(items.values()) if isinstance(items, dict) else list(items or [])
+
+
+def get_placed_containers(psp: Any) -> dict[str, list[DataContainer]]:
+    """The consumer replica group containers each workspace's data transformer is placed on by an execution placement
+    hint, by workspace name. Transformers without one run against the merge database."""
+    crgs: dict[str, ConsumerReplicaGroup] = {crg.name: crg for crg in as_list(psp.consumerReplicaGroups)}
+    placements: dict[str, list[DataContainer]] = {}
+    for hint in as_list(psp.hints):
+        placement = getattr(hint, "executionPlacement", None)
+        if placement is not None and placement.crgName in crgs:
+            placements[hint.workspaceName] = [c for c in crgs[placement.crgName].dataContainers if c.name == placement.dcName]
+    return placements
+
+
+def get_scheduled_jobs(ecosys: Ecosystem, rteName: str) -> list[ScheduledJob]:
+    """Every job of the runtime environment started by a CronTrigger, with the hosts it uses."""
+    psp = ecosys.getRuntimeEnvironmentOrThrow(rteName).psp
+    assert psp is not None
+    merge_hosts = get_container_hosts([psp.mergeStore])
+    crgs: dict[str, ConsumerReplicaGroup] = {crg.name: crg for crg in as_list(psp.consumerReplicaGroups)}
+    jobs: list[ScheduledJob] = []
+    for entry in ecosys.datastoreCache.values():
+        cmd = entry.datastore.cmd
+        if cmd is not None and isinstance(cmd.stepTrigger, CronTrigger):
+            sources = [cmd.dataContainer] if cmd.dataContainer is not None else []
+            jobs.append(ScheduledJob(
+                f"ingestion:{entry.datastore.name}", "ingestion", cmd.stepTrigger.cron, frozenset(merge_hosts | get_container_hosts(sources))))
+    placements: dict[str, set[str]] = {name: get_container_hosts(containers) for name, containers in get_placed_containers(psp).items()}
+    for entry in ecosys.workSpaceCache.values():
+        dt = entry.workspace.dataTransformer
+        if dt is not None and isinstance(dt.trigger, CronTrigger):
+            jobs.append(ScheduledJob(
+                f"transformer:{dt.name}", "transformer", dt.trigger.cron, frozenset(merge_hosts | placements.get(entry.workspace.name, set()))))
+    for crg in crgs.values():
+        if isinstance(crg.trigger, CronTrigger):
+            jobs.append(ScheduledJob(f"crg:{crg.name}", "crg", crg.trigger.cron, frozenset(merge_hosts | get_container_hosts(crg.dataContainers))))
+    return jobs
+
+
+def format_stagger_report(jobs: list[ScheduledJob], staggered: list[ScheduledJob], durations: dict[str, int]) -> str:
+    before = get_host_load(jobs, durations)
+    after = get_host_load(staggered, durations)
+    lines = [f"{'host':<24}{'peak before':>12}{'peak after':>12}{'overlap before':>16}{'overlap after':>15}"]
+    for host in sorted(before):
+        lines.append(f"{host:<24}{before[host][0]:>12}{after[host][0]:>12}{before[host][1]:>15}s{after[host][1]:>14}s")
+    lines.append("")
+    for job, new_job in zip(jobs, staggered):
+        change = f"-> {new_job.cron}" if new_job.cron != job.cron else "unchanged"
+        lines.append(f"{job.name:<40}{job.cron:<16}{change:<22}{', '.join(sorted(job.hosts))}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Report concurrent jobs per host and propose staggered cron triggers")
+    parser.add_argument("--rte", default="prod", help="The runtime environment to analyse")
+    parser.add_argument("--duration", action="append", default=[], help="KIND=SECONDS, the estimated run time of ingestion, transformer or crg jobs")
+    args = parser.parse_args(argv)
+
+    durations = dict(DEFAULT_DURATIONS)
+    for d in args.duration:
+        kind, _, seconds = d.partition("=")
+        if kind not in durations or not seconds.isdigit():
+            parser.error(f"--duration {d} is not one of {', '.join(durations)}=SECONDS")
+        durations[kind] = int(seconds)
+
+    jobs = get_scheduled_jobs(createEcosystem(), args.rte)
+    print(format_stagger_report(jobs, stagger_jobs(jobs, durations), durations))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())